@@ -1,11 +1,126 @@
-from fastapi import FastAPI
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+
+import startup
+
+# Set INVOICE_GUARD_STARTUP_PROFILE=1 to log import/init times once the app is up
+if os.getenv("INVOICE_GUARD_STARTUP_PROFILE"):
+    startup.enable()
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import risk  # <-- your risk scoring logic lives here
+import main  # full pipeline; OCR / embedding models load on first use
+from llm_price_check import acached_price_check, price_cache_stats
+from ml.batching import MicroBatcher
+from ocr import available_cores
+from product_extraction import pick_product_desc
+import tracing
+from writer import WriteQueue
+
+DB_PATH = os.getenv("INVOICE_GUARD_DB", "invoices.db")
+# Requests admitted at once (queued + running); beyond this /analyze answers 429
+MAX_PENDING = int(os.getenv("INVOICE_GUARD_API_MAX_PENDING", "32"))
+OCR_THREADS = int(os.getenv("INVOICE_GUARD_API_OCR_THREADS", "0")) or available_cores()
+PRICE_CACHE_THREADS = int(os.getenv("INVOICE_GUARD_API_PRICE_CACHE_THREADS", "2"))
+# Stage histograms + counters for GET /metrics; INVOICE_GUARD_METRICS=0 turns spans into no-ops
+if os.getenv("INVOICE_GUARD_METRICS", "1") != "0":
+    tracing.enable_metrics()
+
+
+class _Pipeline:
+    """
+    Executors behind /analyze, so the event loop never blocks:
+      ocr    - OCR_THREADS threads (the OCR backend does the heavy lifting); each keeps its
+               own store connection for OCR-cache reads, which never take the write lock
+      price_cache - PRICE_CACHE_THREADS threads for the price-check cache lookups (SQLite
+               reads, description index refresh + search), off the loop and the OCR pool
+      embed  - a MicroBatcher over the shared embedder: concurrent uploads are encoded
+               together in one forward pass (one model instance, one encoding thread)
+      writes - a WriteQueue: one thread owning the writer connection and neighbour index
+               (scoring, inserts and the OCR-cache write are serialized, as in the CLI
+               worker), committing concurrent uploads in groups
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.store = main.get_store(db_path)  # one warm connection per thread
+        self.ocr = ThreadPoolExecutor(OCR_THREADS, thread_name_prefix="ocr")
+        self.price_cache = ThreadPoolExecutor(PRICE_CACHE_THREADS, thread_name_prefix="price-cache")
+        self.batcher = MicroBatcher(main.get_embedder())
+        self.writes = WriteQueue(db_path)
+        self.pending = 0  # only touched on the event loop
+
+    def read(self, data: bytes, suffix: str):
+        # The OCR path reads from disk; spool the upload to a temp file for the call
+        fd, tmp = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return main.ocr_invoice(self.store.conn, tmp)  # reads only; the cache write is a write job
+        finally:
+            os.unlink(tmp)
+
+    async def price_check(self, raw_text: str, fields: Dict[str, Any]):
+        # Before the write job, so the LLM call and the description embedding (through the
+        # batcher) never run inside the writer's transaction; cache reads on price_cache
+        product_desc = pick_product_desc(raw_text)
+        result, save = await acached_price_check(
+            self.store,
+            product_desc=product_desc,
+            vendor_name=fields.get("vendor_name"),
+            total_amount=fields.get("total_amount"),
+            currency=fields.get("currency") or "USD",
+            aembed=self.batcher.aembed_text,
+            executor=self.price_cache,
+        )
+        return product_desc, result, save
+
+    def write(
+        self, conn, digest: str, tier: str, raw_text: str, fields: Dict[str, Any], source_file: str, emb,
+        price_check: bool, price,
+    ):
+        # Runs on the WriteQueue thread, inside its group transaction: reads and inserts only
+        main.cache_ocr(conn, digest, raw_text, fields, tier, commit=False)
+        index = main._neighbor_index(conn, self.db_path)
+        return main.analyze(
+            conn, self.db_path, raw_text, source_file, index,
+            new_emb=emb, fields=fields, price_check=price_check, commit=False, price=price,
+        )
+
+    def close(self) -> None:
+        self.ocr.shutdown(wait=True)
+        self.price_cache.shutdown(wait=True)
+        self.writes.close()
+        self.batcher.close()
+        self.store.close()
+
+
+_pipeline: Optional[_Pipeline] = None
 
-app = FastAPI(title="InvoiceGuard ML API")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _pipeline
+    _pipeline = _Pipeline(DB_PATH)
+    if startup.profiler():
+        print(startup.profiler().report(), file=sys.stderr)
+    try:
+        yield
+    finally:
+        _pipeline.close()
+        _pipeline = None
+
+
+app = FastAPI(title="InvoiceGuard ML API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,6 +137,90 @@ class PredictRequest(BaseModel):
 def root():
     return {"ok": True, "service": "invoice_guard_ml"}
 
+@app.post("/analyze")
+async def analyze(
+    file: UploadFile = File(...), price_check: bool = Form(False), timings: bool = Form(False)
+):
+    """
+    Multipart upload of one invoice image -> same JSON as `main.py <image>`
+    (timings=true adds the per-stage "timings" block). Returns 429 when MAX_PENDING
+    requests are already in the pipeline.
+    """
+    p = _pipeline
+    if p.pending >= MAX_PENDING:
+        tracing.count("analyze_requests", status=429)
+        raise HTTPException(status_code=429, detail="Too many pending invoices", headers={"Retry-After": "1"})
+
+    p.pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        data = await file.read()
+        source_file = os.path.basename(file.filename or "upload")
+        suffix = os.path.splitext(source_file)[1] or ".png"
+
+        with tracing.collect(timings) as trace, tracing.span("request"):
+            try:
+                digest, raw_text, fields, tier = await loop.run_in_executor(p.ocr, tracing.bind(p.read), data, suffix)
+            except Exception as e:
+                tracing.count("analyze_requests", status=422)
+                raise HTTPException(status_code=422, detail=f"OCR failed: {type(e).__name__}: {e}")
+            with tracing.span("embed"):
+                emb = await p.batcher.aembed_text(raw_text)
+            price = None
+            if price_check and os.getenv("GEMINI_API_KEY"):
+                with tracing.span("price_check"):
+                    price = await p.price_check(raw_text, fields)
+            out = await p.writes.acall(
+                tracing.bind(p.write), digest, tier, raw_text, fields, source_file, emb, price_check, price
+            )
+        tracing.count("analyze_requests", status=200)
+        out["ocr_cache"] = "hit" if tier == "cache" else "miss"
+        out["ocr_tier"] = tier
+        if trace is not None:
+            out["timings"] = trace
+        return out
+    finally:
+        p.pending -= 1
+
+
+@app.get("/stats")
+def stats():
+    p = _pipeline
+    return {
+        "pending": p.pending,
+        "max_pending": MAX_PENDING,
+        "embedding_batches": p.batcher.stats(),
+        "writes": p.writes.stats(),
+        "price_cache": price_cache_stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms, counters and a few gauges."""
+    registry = tracing.metrics()
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Metrics disabled (INVOICE_GUARD_METRICS=0)")
+    p = _pipeline
+    conn = p.store.conn
+    db_rows = {
+        (("table", table),): float(conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0])
+        for table in ("invoices", "invoice_embeddings", "price_checks")
+    }
+    batches = p.batcher.stats()
+    writes = p.writes.stats()
+    gauges = {
+        "pending_requests": {(): float(p.pending)},
+        "max_pending_requests": {(): float(MAX_PENDING)},
+        "embed_queue_depth": {(): float(batches["queue_depth"])},
+        "embed_mean_batch_size": {(): float(batches["mean_batch_size"])},
+        "writer_queue_depth": {(): float(writes["queue_depth"])},
+        "writer_mean_group_size": {(): float(writes["mean_group_size"])},
+        "db_rows": db_rows,  # max rowid: append-mostly tables, no COUNT(*) scan per scrape
+    }
+    return PlainTextResponse(registry.render(gauges), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/predict")
 def predict(req: PredictRequest):
     """
@@ -52,4 +251,3 @@ def predict(req: PredictRequest):
     if isinstance(out, dict):
         return out
     return {"result": str(out)}
-EOF
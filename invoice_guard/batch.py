@@ -0,0 +1,69 @@
+# batch.py
+from __future__ import annotations
+
+import glob
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from extract_fields import extract_dict
+from ocr import _local_backend, available_cores, ocr_cascade, ocr_worker_init, set_backend
+from utils import lazy_module
+
+futures = lazy_module("concurrent.futures")
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"}
+
+
+def collect_inputs(spec: str) -> List[str]:
+    """
+    Resolve --batch input: a directory (all images, sorted), a text file with one
+    path per line (relative paths resolve against the list's folder), or a glob.
+    """
+    if os.path.isdir(spec):
+        return sorted(
+            os.path.join(spec, f)
+            for f in os.listdir(spec)
+            if os.path.splitext(f)[1].lower() in IMAGE_EXTS
+        )
+
+    if os.path.isfile(spec) and os.path.splitext(spec)[1].lower() not in IMAGE_EXTS:
+        base = os.path.dirname(os.path.abspath(spec))
+        with open(spec, "r", encoding="utf-8") as f:
+            lines = [ln.strip() for ln in f]
+        return [ln if os.path.isabs(ln) else os.path.join(base, ln) for ln in lines if ln and not ln.startswith("#")]
+
+    return sorted(glob.glob(spec, recursive=True))
+
+
+def _ocr_pool_init() -> None:
+    # This process is already one of the pool's workers; OCR in-process, don't nest a pool
+    ocr_worker_init()
+    set_backend(_local_backend())
+
+
+OcrResult = Tuple[str, Optional[str], Optional[Dict[str, Any]], Optional[str], Optional[str]]
+
+
+def _ocr_worker(image_path: str) -> OcrResult:
+    """
+    Runs in a pool process: OCR cascade + field extraction (the cascade needs the fields
+    to pick its tier). Errors are returned, not raised, so one bad file can't stop the batch.
+    """
+    try:
+        text, fields, tier = ocr_cascade(image_path, extract_dict)
+        return image_path, text, fields, tier, None
+    except Exception as e:
+        return image_path, None, None, None, f"{type(e).__name__}: {e}"
+
+
+def ocr_many(paths: List[str], workers: Optional[int] = None) -> Iterator[OcrResult]:
+    """Parallel OCR over a process pool; yields (path, text, fields, tier, error) in input order."""
+    workers = workers or available_cores()
+    if workers <= 1 or len(paths) <= 1:
+        for p in paths:
+            yield _ocr_worker(p)
+        return
+    # Tesseract itself is multi-threaded; with one process per core, one thread each is
+    # faster (the workers set their own OMP_THREAD_LIMIT in _ocr_pool_init)
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=_ocr_pool_init) as pool:
+        yield from pool.map(_ocr_worker, paths, chunksize=1)
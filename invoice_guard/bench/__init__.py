@@ -0,0 +1,23 @@
+# bench/__init__.py
+"""
+End-to-end benchmark harness: times each stage of main.run separately over
+sample_invoices/ against a synthetic history of configurable size.
+
+    python -m bench --history 1000 100000 --out bench.json
+    python -m bench --history 1000000 --compare bench.json
+
+Runs offline: a hashing embedder stands in for sentence-transformers when the model
+can't load, and price checks go to scripts/stub_llm_server.py (see bench.stubs).
+
+bench.corpus writes million-row corpora with known duplicates for load and accuracy runs:
+
+    python -m bench.corpus --db corpus.db --rows 1000000 --eval 2000
+
+bench.stress hammers one DB from several processes and checks that no vendor stats
+update was lost (direct per-thread commits vs writer.WriteQueue group commits):
+
+    python -m bench.stress --procs 4 --threads 8 --synchronous FULL
+"""
+from bench.stages import StageTimer, summarize
+
+__all__ = ["StageTimer", "summarize"]
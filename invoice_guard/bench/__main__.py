@@ -0,0 +1,244 @@
+# bench/__main__.py
+"""
+    python -m bench [--images 'sample_invoices/*.jpg'] [--history 1000 100000 1000000]
+                    [--repeat 5] [--out bench.json] [--compare old.json]
+
+OCRs each image once, then for every history size fills a scratch DB and replays the
+invoices --repeat times through the stages of main.run, timing each one on its own:
+extract, risk, embed, neighbors, anomaly, price_check, write (+ the per-invoice total).
+Without the tesseract binary the OCR stage is skipped and synthetic invoice texts are used.
+--compare prints p95 changes against an earlier --out file and exits 1 on regressions.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import main
+from bench import stubs
+from bench.history import fill_history, vendor_names
+from bench.stages import StageTimer, summarize
+from llm_price_check import cached_price_check
+from ml.anomaly import amount_anomaly_score
+from ml.embeddings import DEFAULT_MODEL, get_embedder
+from ml.neighbors import nearest_neighbors
+from ocr import available_cores, ocr_text
+from product_extraction import pick_product_desc
+from risk import score_invoice_indexed
+from store import (
+    Store,
+    get_vendor_amount_stats,
+    insert_invoice,
+    save_price_check,
+    unit_of_work,
+    update_vendor_amount_stats,
+    upsert_embedding,
+)
+
+_SYNTHETIC_VENDORS = vendor_names(40)
+
+
+def _synthetic_text(rng: random.Random) -> str:
+    """Invoice text laid out like the OCR of sample_invoices/ (used when OCR is unavailable)."""
+    seller, client = rng.sample(_SYNTHETIC_VENDORS, 2)
+    items = "\n".join(
+        f"{k}. {rng.choice(['Dell Desktop PC', 'Wireless Mouse', 'USB-C Hub', 'Office Chair', 'LED Monitor 24in'])} "
+        f"{rng.randint(1, 9)},00 each {rng.randint(10, 900)},00 {rng.randint(10, 900)},00 10% {rng.randint(10, 900)},70"
+        for k in range(1, rng.randint(2, 6))
+    )
+    total = rng.randint(50, 5000)
+    return (
+        f"Invoice no: {rng.randint(10**7, 10**8 - 1)}\n"
+        f"Date of issue: {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2012, 2021)}\n"
+        f"Seller: Client:\n{seller}    {client}\n"
+        f"Tax Id: {rng.randint(900, 999)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}\n"
+        f"ITEMS\nNo. Description Qty UM Net price Net worth VAT [%] Gross worth\n{items}\n"
+        f"SUMMARY\nTotal $ {total},00 $ {total // 10},00 $ {total + total // 10},00"
+    )
+
+
+def load_invoices(pattern: str, timer: StageTimer, synthetic: int) -> Tuple[List[Tuple[str, str]], bool]:
+    """OCR every image once (timed as "ocr") -> ([(name, text)], ocr_ran)."""
+    paths = sorted(glob.glob(pattern))
+    docs: List[Tuple[str, str]] = []
+    try:
+        for p in paths:
+            with timer.time("ocr"):
+                docs.append((os.path.basename(p), ocr_text(p)))
+    except Exception as e:
+        print(f"bench: OCR unavailable ({type(e).__name__}: {e}); using synthetic texts", file=sys.stderr)
+        timer.samples.pop("ocr", None)
+        docs = []
+    if docs:
+        return docs, True
+    rng = random.Random(0)
+    return [(f"synthetic-{i:04d}", _synthetic_text(rng)) for i in range(synthetic)], False
+
+
+def run_history(
+    docs: List[Tuple[str, str]], history: int, repeat: int, price_check: bool, workdir: str
+) -> Dict[str, Any]:
+    db_path = os.path.join(workdir, f"history-{history}.db")
+    store = Store(db_path)
+    conn = store.conn
+    fill = fill_history(conn, history, DEFAULT_MODEL)
+
+    t0 = time.perf_counter()
+    index = main._neighbor_index(conn, db_path)
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    embedder = get_embedder()
+    timer = StageTimer()
+    for _ in range(repeat):
+        for name, text in docs:
+            with timer.time("total"):
+                with timer.time("extract"):
+                    rec = main._extract(text)
+                    rec["raw_text"] = text
+                    rec["source_file"] = name
+                with timer.time("risk"):
+                    score_invoice_indexed(rec, conn)
+                with timer.time("embed"):
+                    emb = embedder.embed_text(text)
+                with timer.time("neighbors"):
+                    nearest_neighbors(conn, index, emb, k=3)
+                vendor, amount = rec.get("vendor_name"), rec.get("total_amount")
+                with timer.time("anomaly"):
+                    amount_anomaly_score(amount, get_vendor_amount_stats(conn, vendor) if vendor else None)
+                if price_check:
+                    with timer.time("price_check"):
+                        product_desc = pick_product_desc(text)
+                        price_out, price_save = cached_price_check(
+                            conn, product_desc, vendor, amount, rec.get("currency") or "USD"
+                        )
+                with timer.time("write"):
+                    with unit_of_work(conn):
+                        invoice_id = insert_invoice(conn, rec, commit=False)
+                        upsert_embedding(conn, invoice_id, emb, DEFAULT_MODEL, commit=False)
+                        index.add(invoice_id, emb)
+                        if vendor and amount is not None:
+                            update_vendor_amount_stats(conn, vendor, float(amount), commit=False)
+                        if price_check:
+                            save_price_check(conn, invoice_id, product_desc, price_out, commit=False, **price_save)
+
+    key = os.path.abspath(db_path)
+    main._MATRICES.pop(key, None)
+    main._ANN_INDEXES.pop(key, None)
+    store.close()
+    return {
+        "history": history,
+        "fill": fill,
+        "index": {"type": type(index).__name__, "load_ms": round(load_ms, 3)},
+        "stages": timer.summary(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """p95 table vs baseline; returns "history/stage" entries slower by more than tolerance."""
+    old_runs = {r["history"]: r for r in baseline.get("runs", [])}
+    regressions = []
+    print(f"\n{'history':>9} {'stage':<12} {'old p95':>10} {'new p95':>10} {'change':>8}")
+    for run in current["runs"]:
+        old = old_runs.get(run["history"])
+        if old is None:
+            continue
+        for stage, st in run["stages"].items():
+            before = old["stages"].get(stage, {}).get("p95_ms")
+            after = st.get("p95_ms")
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            flag = "  REGRESSION" if change > tolerance else ""
+            print(f"{run['history']:>9} {stage:<12} {before:10.3f} {after:10.3f} {change:+8.1%}{flag}")
+            if flag:
+                regressions.append(f"{run['history']}/{stage}")
+    return regressions
+
+
+def _print_run(run: Dict[str, Any]) -> None:
+    idx = run["index"]
+    print(
+        f"\nhistory={run['history']}  fill={run['fill']['total_s']:.1f}s  "
+        f"index={idx['type']} (load {idx['load_ms']:.0f} ms)"
+    )
+    print(f"  {'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>9}")
+    for stage, st in run["stages"].items():
+        print(f"  {stage:<12} {st['p50_ms']:9.3f} {st['p95_ms']:9.3f} {st['p99_ms']:9.3f} {st['per_s'] or 0:9.1f}")
+
+
+def main_cli():
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ap = argparse.ArgumentParser(prog="python -m bench", description="Per-stage InvoiceGuard benchmark")
+    ap.add_argument("--images", default=os.path.join(here, "sample_invoices", "*.jpg"))
+    ap.add_argument("--history", type=int, nargs="+", default=[1000, 100_000], help="history sizes (rows)")
+    ap.add_argument("--repeat", type=int, default=5, help="passes over the invoices per history size")
+    ap.add_argument("--synthetic", type=int, default=20, help="synthetic invoices when OCR is unavailable")
+    ap.add_argument("--embedder", choices=["auto", "model", "stub"], default="auto")
+    ap.add_argument("--llm", choices=["stub", "real", "off"], default="stub", help="price-check backend")
+    ap.add_argument("--llm-latency-ms", type=float, default=50.0, help="stub LLM response delay")
+    ap.add_argument("--out", default=None, help="write results JSON here")
+    ap.add_argument("--compare", default=None, help="earlier --out file to diff p95 against")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="p95 slowdown counted as a regression")
+    ap.add_argument("--keep-dbs", default=None, help="directory to keep the scratch DBs in")
+    args = ap.parse_args()
+
+    embedder = stubs.use_embedder(args.embedder)
+    srv = stubs.use_stub_llm(args.llm_latency_ms) if args.llm == "stub" else None
+
+    load_timer = StageTimer()
+    docs, ocr_ran = load_invoices(args.images, load_timer, args.synthetic)
+
+    workdir = args.keep_dbs or tempfile.mkdtemp(prefix="invoice_guard_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    results: Dict[str, Any] = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cores": available_cores()},
+        "config": {
+            "invoices": len(docs),
+            "source": "ocr" if ocr_ran else "synthetic",
+            "repeat": args.repeat,
+            "embedder": embedder,
+            "llm": args.llm,
+            "llm_latency_ms": args.llm_latency_ms if args.llm == "stub" else None,
+        },
+        "ocr": summarize(load_timer.samples.get("ocr", [])),
+        "runs": [],
+    }
+    try:
+        for n in args.history:
+            run = run_history(docs, n, args.repeat, args.llm != "off", workdir)
+            results["runs"].append(run)
+            _print_run(run)
+    finally:
+        if srv is not None:
+            srv.shutdown()
+        if not args.keep_dbs:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if ocr_ran:
+        o = results["ocr"]
+        print(f"\nocr: {o['n']} pages  p50 {o['p50_ms']:.1f} ms  p95 {o['p95_ms']:.1f} ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} p95 regressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
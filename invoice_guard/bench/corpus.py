@@ -0,0 +1,487 @@
+# bench/corpus.py
+"""
+Synthetic invoice corpus for load and accuracy testing of the store, the duplicate rules
+and neighbour search, bulk-written straight into the SQLite schema.
+
+    python -m bench.corpus --db corpus.db --rows 1000000 [--dup-rate 0.01] [--near-rate 0.01]
+    python -m bench.corpus --db corpus.db --eval 2000 [--out eval.json]
+
+Each vendor gets a Zipf-distributed share of the volume, its own invoice-number format and
+running sequence, a lognormal amount distribution (plus rare outliers), dates spread over
+the years in sequence order, and a cluster of embeddings around a vendor centroid.
+
+A fraction of rows are injected re-submissions of an earlier row from the same chunk:
+  exact  same vendor and invoice number (what risk rule 1 looks for)
+  near   OCR-style edit to the number, sometimes a variant vendor spelling, and either the
+         amount nudged by under 1% or the date moved by a few days (rule 2)
+Their sources are recorded in corpus_truth(invoice_id, original_id, kind). evaluate()
+builds fresh probe invoices (exact, near and clean) from the stored rows without writing
+them, then reports duplicate precision/recall and neighbour recall next to latency.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench.history import vendor_names
+from bench.stages import StageTimer
+from ml import quantize
+from ml.embeddings import DEFAULT_MODEL
+from ml.sketch import KLLSketch
+from store import INDEXES, Store, _statements, fetch_embedding_vectors, find_exact_duplicate, unit_of_work
+from utils import norm_key
+
+TRUTH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS corpus_truth (
+  invoice_id INTEGER PRIMARY KEY,
+  original_id INTEGER NOT NULL,
+  kind TEXT NOT NULL  -- exact | near
+);
+CREATE INDEX IF NOT EXISTS idx_corpus_truth_original ON corpus_truth(original_id);
+"""
+
+NUMBER_FORMATS = (
+    "INV-{seq:06d}",
+    "{prefix}{seq:07d}",
+    "{prefix}-{year}-{seq:05d}",
+    "{seq}",
+    "{prefix}/{year}/{seq:04d}",
+)
+CURRENCIES = ("USD",) * 8 + ("EUR", "GBP")
+EPOCH = np.datetime64("2016-01-01")
+SPAN_DAYS = 8 * 365
+OUTLIER_RATE = 0.002  # amounts 5-10x the vendor's usual, for the anomaly rule
+VENDOR_SPREAD = 0.6  # noise around the vendor centroid (same as bench.history)
+DUP_NOISE = {"exact": 0.05, "near": 0.12}  # re-scan noise on a duplicate's embedding
+
+_OCR_SWAPS = {"0": "O", "O": "0", "1": "I", "I": "1", "5": "S", "S": "5", "8": "B", "B": "8", "2": "Z", "Z": "2"}
+
+
+# -------------------------
+# Near-duplicate edits
+# -------------------------
+def near_number(number: str, rnd: random.Random) -> str:
+    """One OCR/typing slip: confused glyph, transposed digits, dropped separator or doubled char."""
+    chars = list(number)
+    edit = rnd.randrange(4)
+    if edit == 0:
+        pos = [i for i, c in enumerate(chars) if c in _OCR_SWAPS]
+        if pos:
+            i = rnd.choice(pos)
+            chars[i] = _OCR_SWAPS[chars[i]]
+            return "".join(chars)
+    if edit == 1:
+        pos = [i for i in range(len(chars) - 1) if chars[i].isdigit() and chars[i + 1].isdigit() and chars[i] != chars[i + 1]]
+        if pos:
+            i = rnd.choice(pos)
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+            return "".join(chars)
+    if edit == 2:
+        pos = [i for i, c in enumerate(chars) if c in "-/"]
+        if pos:
+            del chars[rnd.choice(pos)]
+            return "".join(chars)
+    i = rnd.randrange(len(chars))
+    chars.insert(i, chars[i])
+    return "".join(chars)
+
+
+def near_vendor(name: str, rnd: random.Random) -> str:
+    """Vendor spelling as a different scan or clerk might produce it (still partial_ratio > 80)."""
+    edit = rnd.randrange(4)
+    if edit == 0:
+        return name.upper()
+    if edit == 1:
+        return name + "."
+    if edit == 2 and " and " in name:
+        return name.replace(" and ", " & ")
+    return name.replace(" ", "  ", 1)
+
+
+# -------------------------
+# Generation
+# -------------------------
+class _VendorModel:
+    """Per-vendor parameters drawn once per generate_corpus() call."""
+
+    def __init__(self, n: int, n_vendors: int, dim: int, zipf: float, rng: np.random.Generator, seed: int):
+        self.names = vendor_names(n_vendors, seed)
+        weights = 1.0 / np.arange(1, n_vendors + 1) ** zipf
+        self.p = weights / weights.sum()
+        self.prefix = ["".join(w[0] for w in name.replace("-", " ").split()[:3]).upper() for name in self.names]
+        self.fmt = rng.integers(len(NUMBER_FORMATS), size=n_vendors)
+        self.seq0 = rng.integers(1, 5000, size=n_vendors) * np.where(self.fmt == 3, 10, 1)
+        self.day0 = rng.integers(0, SPAN_DAYS // 4, size=n_vendors)
+        self.gap = (SPAN_DAYS - self.day0) / np.maximum(1.0, n * self.p)  # days between invoices
+        self.scale = np.exp(rng.uniform(np.log(50), np.log(20_000), n_vendors))
+        self.sigma = rng.uniform(0.15, 0.6, n_vendors)
+        self.currency = [CURRENCIES[i] for i in rng.integers(len(CURRENCIES), size=n_vendors)]
+        self.centroids = rng.standard_normal((n_vendors, dim)).astype(np.float32)
+        self.next_ord = np.zeros(n_vendors, dtype=np.int64)
+
+
+class _VendorTables:
+    """Running vendor_keys / vendor_amount_stats / vendor_amount_sketches for the written rows."""
+
+    def __init__(self):
+        self.keys: Counter = Counter()
+        self.stats: Dict[str, Tuple[int, float, float]] = {}  # vendor_name -> (n, mean, m2)
+        self.sketches: Dict[str, KLLSketch] = {}
+
+    def add(self, names: List[str], amounts: np.ndarray) -> None:
+        uniq, inv = np.unique(np.array(names, dtype=object), return_inverse=True)
+        n = np.bincount(inv)
+        mean = np.bincount(inv, amounts) / n
+        m2 = np.bincount(inv, (amounts - mean[inv]) ** 2)
+        for name, nb, mb, m2b in zip(uniq.tolist(), n.tolist(), mean.tolist(), m2.tolist()):
+            self.stats[name] = _merge_moments(self.stats.get(name), (nb, mb, m2b))
+
+        order = np.argsort(inv, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(n)])
+        by_norm: Dict[str, List[float]] = {}
+        for g, name in enumerate(uniq.tolist()):
+            by_norm.setdefault(norm_key(name), []).extend(amounts[order[bounds[g]:bounds[g + 1]]].tolist())
+        for key, xs in by_norm.items():
+            self.keys[key] += len(xs)
+            self.sketches.setdefault(key, KLLSketch()).merge(KLLSketch.from_values(xs))
+
+    def write(self, conn) -> None:
+        """Fold into whatever the DB already holds (appending to an existing corpus works)."""
+        conn.executemany(
+            "INSERT INTO vendor_keys (vendor_norm, n) VALUES (?, ?) ON CONFLICT(vendor_norm) DO UPDATE SET n = n + excluded.n",
+            self.keys.items(),
+        )
+        for name, moments in self.stats.items():
+            row = conn.execute("SELECT n, mean, m2 FROM vendor_amount_stats WHERE vendor_name = ?", (name,)).fetchone()
+            if row is not None:
+                moments = _merge_moments((int(row["n"]), float(row["mean"]), float(row["m2"])), moments)
+            conn.execute(
+                "INSERT OR REPLACE INTO vendor_amount_stats (vendor_name, n, mean, m2) VALUES (?, ?, ?, ?)",
+                (name, *moments),
+            )
+        for key, sk in self.sketches.items():
+            row = conn.execute("SELECT sketch FROM vendor_amount_sketches WHERE vendor_norm = ?", (key,)).fetchone()
+            if row is not None:
+                old = KLLSketch.from_bytes(row["sketch"])
+                old.merge(sk)
+                sk = old
+            conn.execute(
+                "INSERT OR REPLACE INTO vendor_amount_sketches (vendor_norm, n, sketch) VALUES (?, ?, ?)",
+                (key, sk.n, sk.to_bytes()),
+            )
+
+
+def _merge_moments(a: Optional[Tuple[int, float, float]], b: Tuple[int, float, float]) -> Tuple[int, float, float]:
+    """Combine two (n, mean, m2) summaries (Chan et al. parallel variance)."""
+    if a is None:
+        return b
+    na, ma, m2a = a
+    nb, mb, m2b = b
+    n = na + nb
+    delta = mb - ma
+    return n, ma + delta * nb / n, m2a + m2b + delta * delta * na * nb / n
+
+
+def generate_corpus(
+    conn,
+    n: int,
+    model: str = DEFAULT_MODEL,
+    dim: int = 384,
+    codec: str = quantize.STORAGE_CODEC,
+    seed: int = 0,
+    dup_rate: float = 0.01,
+    near_rate: float = 0.01,
+    zipf: float = 1.1,
+    n_vendors: Optional[int] = None,
+    chunk: int = 50_000,
+) -> Dict[str, Any]:
+    """
+    Append n invoices (ids continue after the current max) with embeddings, derived vendor
+    tables and corpus_truth rows for the injected duplicates -> counts and timings.
+
+    Rows go in with executemany inside one transaction per chunk and synchronous=OFF;
+    on an empty invoices table the vendor index is dropped and rebuilt at the end.
+    """
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    rnd = random.Random(seed)
+    vm = _VendorModel(n, n_vendors or max(20, n // 200), dim, zipf, rng, seed)
+    tables = _VendorTables()
+    counts = Counter()
+
+    for stmt in _statements(TRUTH_SCHEMA):
+        conn.execute(stmt)
+    start = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0]) + 1
+    fresh = start == 1
+    if fresh:
+        conn.execute("DROP INDEX IF EXISTS idx_invoices_vendor_inv")
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        for lo in range(0, n, chunk):
+            m = min(n, lo + chunk) - lo
+            rows, embs, truth = _chunk(vm, start + lo, m, model, dim, codec, dup_rate, near_rate, rng, rnd)
+            with unit_of_work(conn):
+                conn.executemany(
+                    """
+                    INSERT INTO invoices
+                    (id, vendor_name, invoice_number, invoice_date, total_amount, currency, source_file, raw_text,
+                     vendor_norm, invoice_norm)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                conn.executemany(
+                    "INSERT INTO invoice_embeddings (invoice_id, model_name, dim, embedding, codec, scale) VALUES (?, ?, ?, ?, ?, ?)",
+                    embs,
+                )
+                conn.executemany("INSERT INTO corpus_truth (invoice_id, original_id, kind) VALUES (?, ?, ?)", truth)
+            tables.add([r[1] for r in rows], np.fromiter((r[4] for r in rows), dtype=np.float64, count=m))
+            counts.update(kind for _, _, kind in truth)
+        t_rows = time.perf_counter() - t0
+
+        with unit_of_work(conn):
+            tables.write(conn)
+            if fresh:
+                for stmt in _statements(INDEXES):
+                    conn.execute(stmt)
+    finally:
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+    total = time.perf_counter() - t0
+    return {
+        "rows": n,
+        "vendors": len(vm.names),
+        "exact": counts["exact"],
+        "near": counts["near"],
+        "rows_s": round(t_rows, 3),
+        "total_s": round(total, 3),
+        "rows_per_s": round(n / t_rows, 1) if t_rows > 0 else None,
+    }
+
+
+def _chunk(vm: _VendorModel, first_id: int, m: int, model: str, dim: int, codec: str,
+           dup_rate: float, near_rate: float, rng: np.random.Generator, rnd: random.Random):
+    v = rng.choice(len(vm.names), size=m, p=vm.p)
+    # Position of each row among its vendor's invoices, continuing across chunks
+    order = np.argsort(v, kind="stable")
+    sv = v[order]
+    rank = np.empty(m, dtype=np.int64)
+    rank[order] = np.arange(m) - np.searchsorted(sv, sv, side="left")
+    ordinal = vm.next_ord[v] + rank
+    vm.next_ord += np.bincount(v, minlength=len(vm.names))
+
+    days = vm.day0[v] + (ordinal * vm.gap[v]).astype(np.int64)
+    dates = (EPOCH + days.astype("timedelta64[D]")).astype(str).tolist()
+    amounts = vm.scale[v] * rng.lognormal(0.0, vm.sigma[v])
+    outlier = rng.random(m) < OUTLIER_RATE
+    amounts[outlier] *= rng.uniform(5, 10, int(outlier.sum()))
+    amounts = np.round(amounts, 2).tolist()
+    vecs = vm.centroids[v] + VENDOR_SPREAD * rng.standard_normal((m, dim)).astype(np.float32)
+
+    seqs = (vm.seq0[v] + ordinal).tolist()
+    vendor = [vm.names[i] for i in v.tolist()]
+    numbers = [
+        NUMBER_FORMATS[f].format(prefix=vm.prefix[i], seq=s, year=d[:4])
+        for i, f, s, d in zip(v.tolist(), vm.fmt[v].tolist(), seqs, dates)
+    ]
+    currency = [vm.currency[i] for i in v.tolist()]
+
+    # Re-submissions of an earlier row in this chunk (followed back to a non-duplicate)
+    draw = rng.random(m)
+    source: Dict[int, int] = {}
+    truth = []
+    for d in np.flatnonzero(draw[1:] < dup_rate + near_rate).tolist():
+        d += 1
+        kind = "exact" if draw[d] < dup_rate else "near"
+        o = rnd.randrange(d)
+        o = source.get(o, o)
+        source[d] = o
+        vendor[d], numbers[d], dates[d], amounts[d], currency[d] = vendor[o], numbers[o], dates[o], amounts[o], currency[o]
+        if kind == "near":
+            numbers[d] = near_number(numbers[o], rnd)
+            if rnd.random() < 0.3:
+                vendor[d] = near_vendor(vendor[o], rnd)
+            if rnd.random() < 0.5:
+                amounts[d] = round(amounts[o] * (1 + rnd.uniform(-0.008, 0.008)), 2)
+            else:
+                dates[d] = str(np.datetime64(dates[o]) + rnd.randint(1, 5))
+        vecs[d] = vecs[o] + DUP_NOISE[kind] * rng.standard_normal(dim).astype(np.float32)
+        truth.append((first_id + d, first_id + o, kind))
+
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    codes, scales = quantize.quantize(vecs, codec)
+    rows = [
+        (
+            first_id + j, vendor[j], numbers[j], dates[j], amounts[j], currency[j], f"corpus-{first_id + j}.jpg",
+            f"Invoice no: {numbers[j]}\nDate of issue: {dates[j]}\nSeller: {vendor[j]}\nTotal {currency[j]} {amounts[j]:.2f}",
+            norm_key(vendor[j]), norm_key(numbers[j]),
+        )
+        for j in range(m)
+    ]
+    embs = [
+        (first_id + j, model, dim, codes[j].tobytes(), codec, float(scales[j]) if scales is not None else None)
+        for j in range(m)
+    ]
+    return rows, embs, truth
+
+
+# -------------------------
+# Evaluation
+# -------------------------
+def make_probes(conn, n: int, model: str = DEFAULT_MODEL, seed: int = 1) -> List[Dict[str, Any]]:
+    """
+    n new invoices (not written), a third each of exact re-submissions, near duplicates and
+    clean invoices of a stored vendor -> [{"rec", "emb", "kind", "expect": set of ids}].
+    A duplicate probe may correctly match its source or any stored duplicate of that source.
+    """
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    max_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0])
+    if max_id == 0:
+        return []
+    picks = [rnd.randint(1, max_id) for _ in range(n)]
+    rows = {
+        int(r["id"]): dict(r)
+        for lo in range(0, n, 900)
+        for r in conn.execute(
+            f"SELECT id, vendor_name, invoice_number, invoice_date, total_amount, currency FROM invoices "
+            f"WHERE id IN ({','.join('?' * len(picks[lo:lo + 900]))})",
+            picks[lo:lo + 900],
+        )
+    }
+    vecs = fetch_embedding_vectors(conn, model, list(rows))
+
+    probes = []
+    for j, pid in enumerate(picks):
+        src = rows.get(pid)
+        if src is None or pid not in vecs:
+            continue
+        kind = ("exact", "near", "clean")[j % 3]
+        rec = {k: src[k] for k in ("vendor_name", "invoice_number", "invoice_date", "total_amount", "currency")}
+        expect: set = set()
+        if kind == "clean":
+            rec["invoice_number"] = _fresh_number(conn, rec["vendor_name"], rec["invoice_number"], rnd)
+            rec["total_amount"] = round(float(rec["total_amount"]) * rnd.uniform(0.7, 1.4), 2)
+            rec["invoice_date"] = str(np.datetime64(rec["invoice_date"]) + rnd.randint(7, 60))
+            noise = VENDOR_SPREAD
+        else:
+            root = conn.execute("SELECT original_id FROM corpus_truth WHERE invoice_id = ?", (pid,)).fetchone()
+            root = int(root[0]) if root else pid
+            expect = {root} | {int(r[0]) for r in conn.execute("SELECT invoice_id FROM corpus_truth WHERE original_id = ?", (root,))}
+            if kind == "near":
+                rec["invoice_number"] = near_number(rec["invoice_number"], rnd)
+                if rnd.random() < 0.5:
+                    rec["total_amount"] = round(float(rec["total_amount"]) * (1 + rnd.uniform(-0.008, 0.008)), 2)
+            noise = DUP_NOISE[kind]
+        emb = vecs[pid] + noise * rng.standard_normal(vecs[pid].shape[0]).astype(np.float32)
+        rec["raw_text"] = f"Invoice no: {rec['invoice_number']}\nSeller: {rec['vendor_name']}"
+        probes.append({"rec": rec, "emb": emb / np.linalg.norm(emb), "kind": kind, "expect": expect})
+    return probes
+
+
+def _fresh_number(conn, vendor: str, number: str, rnd: random.Random) -> str:
+    """Same layout as `number` with new digits, not already on file for this vendor."""
+    while True:
+        cand = "".join(str(rnd.randrange(10)) if c.isdigit() else c for c in number)
+        if find_exact_duplicate(conn, norm_key(vendor), norm_key(cand)) is None:
+            return cand
+
+
+def evaluate(conn, db_path: str, probes: List[Dict[str, Any]], k: int = 3) -> Dict[str, Any]:
+    """Duplicate-rule precision/recall, neighbour recall@k and per-probe latency."""
+    import main  # pulls in the OCR stack; only needed here
+    from ml.neighbors import nearest_neighbors
+    from risk import score_invoice_indexed
+
+    timer = StageTimer()
+    with timer.time("index_load"):
+        index = main._neighbor_index(conn, db_path)
+    by_kind: Dict[str, Counter] = {}
+    for p in probes:
+        c = by_kind.setdefault(p["kind"], Counter())
+        c["n"] += 1
+        with timer.time("risk"):
+            res = score_invoice_indexed(p["rec"], conn)
+        with timer.time("neighbors"):
+            hits = nearest_neighbors(conn, index, p["emb"], k=k)
+        if res["matches"]:
+            c["flagged"] += 1
+            c["correct"] += any(m["id"] in p["expect"] for m in res["matches"])
+        if p["expect"]:
+            c["nn_hit"] += any(h["invoice_id"] in p["expect"] for h in hits)
+
+    dup = sum((by_kind.get(kd, Counter()) for kd in ("exact", "near")), Counter())
+    flagged = sum(c["flagged"] for c in by_kind.values())
+    return {
+        "probes": len(probes),
+        "index": type(index).__name__,
+        "by_kind": {kd: dict(c) for kd, c in by_kind.items()},
+        "dup_recall": _ratio(dup["correct"], dup["n"]),
+        "dup_precision": _ratio(dup["correct"], flagged),
+        "clean_false_positive_rate": _ratio(by_kind.get("clean", Counter())["flagged"], by_kind.get("clean", Counter())["n"]),
+        f"neighbor_recall@{k}": _ratio(dup["nn_hit"], dup["n"]),
+        "latency": timer.summary(),
+    }
+
+
+def _ratio(a: int, b: int) -> Optional[float]:
+    return round(a / b, 4) if b else None
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(prog="python -m bench.corpus", description="Synthetic invoice corpus generator")
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--rows", type=int, default=0, help="invoices to append")
+    ap.add_argument("--vendors", type=int, default=None, help="default: rows / 200, at least 20")
+    ap.add_argument("--zipf", type=float, default=1.1, help="vendor volume skew")
+    ap.add_argument("--dup-rate", type=float, default=0.01, help="share of rows that are exact re-submissions")
+    ap.add_argument("--near-rate", type=float, default=0.01, help="share of rows that are near duplicates")
+    ap.add_argument("--codec", default=quantize.STORAGE_CODEC, choices=sorted(quantize.CODECS))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--eval", type=int, default=0, help="probe invoices to score after generating")
+    ap.add_argument("--out", default=None, help="write the generation/eval results JSON here")
+    args = ap.parse_args()
+
+    store = Store(args.db)
+    conn = store.conn
+    out: Dict[str, Any] = {}
+    if args.rows:
+        out["corpus"] = generate_corpus(
+            conn, args.rows, codec=args.codec, seed=args.seed, dup_rate=args.dup_rate,
+            near_rate=args.near_rate, zipf=args.zipf, n_vendors=args.vendors,
+        )
+        c = out["corpus"]
+        print(
+            f"wrote {c['rows']} invoices ({c['exact']} exact + {c['near']} near duplicates, {c['vendors']} vendors) "
+            f"in {c['total_s']:.1f}s, {c['rows_per_s']:.0f} rows/s"
+        )
+    if args.eval:
+        for stmt in _statements(TRUTH_SCHEMA):
+            conn.execute(stmt)
+        out["eval"] = e = evaluate(conn, args.db, make_probes(conn, args.eval, seed=args.seed + 1))
+        print(f"\n{e['probes']} probes against {e['index']}")
+        for kd, c in sorted(e["by_kind"].items()):
+            print(f"  {kd:<6} n={c['n']:<6} flagged={c.get('flagged', 0):<6} correct={c.get('correct', 0):<6} nn_hit={c.get('nn_hit', 0)}")
+        nn_key = next(key for key in e if key.startswith("neighbor_recall@"))
+        print(
+            f"  dup recall {e['dup_recall']}  precision {e['dup_precision']}  "
+            f"clean FP rate {e['clean_false_positive_rate']}  {nn_key} {e[nn_key]}"
+        )
+        for stage, st in e["latency"].items():
+            print(f"  {stage:<10} p50 {st['p50_ms']:.3f} ms  p95 {st['p95_ms']:.3f} ms")
+    store.close()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=2)
+        print(f"\nwrote {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,113 @@
+# bench/history.py
+"""
+Synthetic invoice history for benchmarks: n invoices from a Zipf-distributed vendor set,
+each with an embedding near its vendor's centroid, plus the derived tables the pipeline
+reads (vendor_keys, vendor_amount_stats, vendor_amount_sketches).
+"""
+from __future__ import annotations
+
+import time
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+
+from ml import quantize
+from ml.sketch import KLLSketch
+from store import unit_of_work
+from utils import norm_key
+
+SURNAMES = [
+    "Andrews", "Kirby", "Valdez", "Becker", "Castro", "Bradley", "Williams", "Garcia", "Nguyen",
+    "Patel", "Schmidt", "Rossi", "Kowalski", "Okafor", "Silva", "Tanaka", "Murphy", "Larsen",
+]
+SUFFIXES = ["Ltd", "PLC", "Inc", "LLC", "and Sons", "Group", "Supplies", "Trading"]
+
+
+def vendor_names(count: int, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(count):
+        a, b = rng.choice(SURNAMES, 2, replace=False)
+        names.append(f"{a}-{b} {SUFFIXES[i % len(SUFFIXES)]} {i}")
+    return names
+
+
+def fill_history(
+    conn,
+    n: int,
+    model: str,
+    dim: int = 384,
+    codec: str = quantize.STORAGE_CODEC,
+    seed: int = 0,
+    chunk: int = 50_000,
+) -> Dict[str, float]:
+    """Append n synthetic invoices (ids continue after the current max) -> fill timings."""
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    n_vendors = max(20, n // 200)
+    names = vendor_names(n_vendors, seed)
+    weights = 1.0 / np.arange(1, n_vendors + 1)
+    vendor_of = rng.choice(n_vendors, size=n, p=weights / weights.sum())
+    scale = np.exp(rng.uniform(np.log(50), np.log(20_000), n_vendors))
+    amounts = np.round(scale[vendor_of] * rng.lognormal(0.0, 0.25, n), 2)
+    centroids = rng.standard_normal((n_vendors, dim)).astype(np.float32)
+
+    start = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0]) + 1
+    for lo in range(0, n, chunk):
+        hi = min(n, lo + chunk)
+        ids = range(start + lo, start + hi)
+        vecs = centroids[vendor_of[lo:hi]] + 0.6 * rng.standard_normal((hi - lo, dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        codes, scales = quantize.quantize(vecs, codec)
+        with unit_of_work(conn):
+            conn.executemany(
+                """
+                INSERT INTO invoices
+                (id, vendor_name, invoice_number, invoice_date, total_amount, currency, source_file, raw_text,
+                 vendor_norm, invoice_norm)
+                VALUES (?, ?, ?, ?, ?, 'USD', ?, ?, ?, ?)
+                """,
+                (
+                    (
+                        i, names[v], f"INV-{i:08d}", f"20{10 + i % 15}-{1 + i % 12:02d}-{1 + i % 28:02d}", float(a),
+                        f"history-{i}.jpg", f"Invoice no: INV-{i:08d}\nSeller: {names[v]}\nTotal $ {a:.2f}",
+                        norm_key(names[v]), norm_key(f"INV-{i:08d}"),
+                    )
+                    for i, v, a in zip(ids, vendor_of[lo:hi], amounts[lo:hi])
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO invoice_embeddings (invoice_id, model_name, dim, embedding, codec, scale) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (i, model, dim, codes[j].tobytes(), codec, float(scales[j]) if scales is not None else None)
+                    for j, i in enumerate(ids)
+                ),
+            )
+    t_rows = time.perf_counter() - t0
+
+    # Derived per-vendor tables, computed in bulk instead of one Welford/sketch update per row
+    counts = Counter(vendor_of.tolist())
+    with unit_of_work(conn):
+        conn.executemany(
+            "INSERT INTO vendor_keys (vendor_norm, n) VALUES (?, ?) ON CONFLICT(vendor_norm) DO UPDATE SET n = n + excluded.n",
+            ((norm_key(names[v]), c) for v, c in counts.items()),
+        )
+        order = np.argsort(vendor_of, kind="stable")
+        bounds = np.searchsorted(vendor_of[order], np.arange(n_vendors + 1))
+        for v in range(n_vendors):
+            xs = amounts[order[bounds[v]:bounds[v + 1]]]
+            if xs.size == 0:
+                continue
+            sk = KLLSketch()
+            for x in xs:
+                sk.update(float(x))
+            conn.execute(
+                "INSERT OR REPLACE INTO vendor_amount_stats (vendor_name, n, mean, m2) VALUES (?, ?, ?, ?)",
+                (names[v], int(xs.size), float(xs.mean()), float(((xs - xs.mean()) ** 2).sum())),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO vendor_amount_sketches (vendor_norm, n, sketch) VALUES (?, ?, ?)",
+                (norm_key(names[v]), sk.n, sk.to_bytes()),
+            )
+    return {"rows_s": round(t_rows, 3), "total_s": round(time.perf_counter() - t0, 3)}
@@ -0,0 +1,46 @@
+# bench/stages.py
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+class StageTimer:
+    """Wall-time samples per named stage, in milliseconds."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, (time.perf_counter() - t0) * 1000)
+
+    def add(self, stage: str, ms: float) -> None:
+        self.samples.setdefault(stage, []).append(ms)
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {stage: summarize(ms) for stage, ms in self.samples.items()}
+
+
+def summarize(ms: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/mean in ms and throughput (1 / mean, per second) for one stage."""
+    if not ms:
+        return {"n": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "per_s": None}
+    arr = np.asarray(ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    mean = float(arr.mean())
+    return {
+        "n": int(arr.size),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(mean, 3),
+        "per_s": round(1000.0 / mean, 1) if mean > 0 else None,
+    }
@@ -0,0 +1,206 @@
+# bench/stress.py
+"""
+Concurrent-write stress test: several processes, each with several threads, insert
+invoices for a handful of vendors (so they fight over the same stats rows), then the
+per-vendor stats are checked against the invoices that actually landed.
+
+    python -m bench.stress --procs 4 --threads 8 --ops 500
+    python -m bench.stress --modes queue --vendors 1
+    python -m bench.stress --synchronous FULL     # fsync per commit, as on durable setups
+
+Modes:
+  direct - every thread writes on its own connection and commits each write
+           (insert_invoice, upsert_embedding, update_vendor_amount_stats with
+           commit=True), like independent analyze() calls
+  queue  - one writer.WriteQueue per process; threads submit the same writes and
+           they are committed in groups
+
+A run reports throughput, failed writes ("database is locked" and the like), and lost
+updates: stats or sketch counts that are lower than the number of successful updates.
+It also reports the largest relative error of the stored Welford mean/variance against
+the amounts in invoices. Exits 1 if any mode lost an update.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import numpy as np
+
+from bench.history import vendor_names
+from store import (
+    Store,
+    connect,
+    get_vendor_amount_sketch,
+    insert_invoice,
+    update_vendor_amount_stats,
+    upsert_embedding,
+)
+from utils import norm_key
+from writer import WriteQueue
+
+MODES = ("direct", "queue")
+MODEL = "stress-model"
+DIM = 384
+
+
+def _record(vendor: str, amount: float, proc: int, n: int) -> Dict[str, Any]:
+    return {
+        "vendor_name": vendor,
+        "invoice_number": f"P{proc}-{n:06d}",
+        "invoice_date": "2024-01-15",
+        "total_amount": amount,
+        "currency": "USD",
+        "source_file": "stress",
+        "raw_text": f"{vendor}\nInvoice No: P{proc}-{n:06d}\nTotal: {amount:.2f}",
+    }
+
+
+def _write(conn, rec: Dict[str, Any], emb: np.ndarray, commit: bool) -> None:
+    """The writes of one analyze() call: invoice, embedding, vendor stats + sketch."""
+    invoice_id = insert_invoice(conn, rec, commit=commit)
+    upsert_embedding(conn, invoice_id, emb, MODEL, commit=commit)
+    update_vendor_amount_stats(conn, rec["vendor_name"], rec["total_amount"], commit=commit)
+
+
+def _worker(db_path: str, mode: str, proc: int, threads: int, ops: int, vendors: List[str], start, results) -> None:
+    """One process: `threads` threads x `ops` writes; reports successful updates per vendor."""
+    store = Store(db_path)
+    writes = WriteQueue(db_path) if mode == "queue" else None
+    ok: Counter = Counter()
+    errors: Counter = Counter()
+    lock = threading.Lock()
+
+    def run(t: int) -> None:
+        rng = random.Random(proc * 1000 + t)
+        vecs = np.random.default_rng(proc * 1000 + t).standard_normal((ops, DIM)).astype(np.float32)
+        for i in range(ops):
+            rec = _record(rng.choice(vendors), round(rng.uniform(10, 5000), 2), proc, t * ops + i)
+            try:
+                if writes is not None:
+                    writes.call(_write, rec, vecs[i], False)
+                else:
+                    _write(store.conn, rec, vecs[i], True)
+            except sqlite3.Error as e:
+                if store.conn.in_transaction and writes is None:
+                    store.conn.rollback()
+                with lock:
+                    errors[str(e)] += 1
+                continue
+            with lock:
+                ok[rec["vendor_name"]] += 1
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    start.wait()
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    if writes is not None:
+        writes.close()
+    store.close()
+    results.put((dict(ok), dict(errors)))
+
+
+def check(db_path: str, ok: Counter) -> Dict[str, Any]:
+    """Stored stats vs successful updates and vs the invoices table."""
+    conn = connect(db_path)
+    lost_stats = lost_sketch = 0
+    max_rel_err = 0.0
+    for vendor, n_ok in ok.items():
+        row = conn.execute("SELECT n, mean, m2 FROM vendor_amount_stats WHERE vendor_name = ?", (vendor,)).fetchone()
+        sk = get_vendor_amount_sketch(conn, norm_key(vendor))
+        lost_stats += n_ok - (row["n"] if row else 0)
+        lost_sketch += n_ok - (sk.n if sk else 0)
+        amounts = np.array(
+            [r[0] for r in conn.execute("SELECT total_amount FROM invoices WHERE vendor_name = ?", (vendor,))],
+            dtype=np.float64,
+        )
+        if row and amounts.size == row["n"]:
+            want_m2 = float(((amounts - amounts.mean()) ** 2).sum())
+            for got, want in ((row["mean"], amounts.mean()), (row["m2"], want_m2)):
+                max_rel_err = max(max_rel_err, abs(got - want) / max(abs(want), 1e-12))
+    conn.close()
+    return {"lost_stats_updates": lost_stats, "lost_sketch_updates": lost_sketch, "max_rel_err": max_rel_err}
+
+
+def run_mode(mode: str, procs: int, threads: int, ops: int, n_vendors: int, workdir: str) -> Dict[str, Any]:
+    db_path = os.path.join(workdir, f"stress-{mode}.db")
+    connect(db_path).close()  # create the schema before the workers race for it
+    vendors = vendor_names(n_vendors)
+    ctx = mp.get_context("spawn")
+    start, results = ctx.Event(), ctx.Queue()
+    workers = [
+        ctx.Process(target=_worker, args=(db_path, mode, p, threads, ops, vendors, start, results))
+        for p in range(procs)
+    ]
+    for w in workers:
+        w.start()
+    time.sleep(1.0)  # let every process import and open its connections
+    t0 = time.perf_counter()
+    start.set()
+    ok: Counter = Counter()
+    errors: Counter = Counter()
+    for _ in workers:
+        got_ok, got_errors = results.get()
+        ok.update(got_ok)
+        errors.update(got_errors)
+    elapsed = time.perf_counter() - t0
+    for w in workers:
+        w.join()
+
+    done = sum(ok.values())
+    return {
+        "mode": mode,
+        "writes": done,
+        "failed": sum(errors.values()),
+        "errors": dict(errors),
+        "seconds": round(elapsed, 3),
+        "writes_per_s": round(done / elapsed, 1),
+        **check(db_path, ok),
+    }
+
+
+def main_cli():
+    ap = argparse.ArgumentParser(description="Multi-process write stress test for vendor stats")
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--threads", type=int, default=8, help="Writer threads per process")
+    ap.add_argument("--ops", type=int, default=300, help="Writes per thread")
+    ap.add_argument("--vendors", type=int, default=3, help="Distinct vendors (fewer = more contention)")
+    ap.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    ap.add_argument("--synchronous", choices=("OFF", "NORMAL", "FULL"), default=None, help="PRAGMA synchronous for the workers")
+    ap.add_argument("--dir", default=None, help="Where to put the scratch DBs (default: a temp dir)")
+    ap.add_argument("--out", default=None, help="Write the results as JSON")
+    args = ap.parse_args()
+    if args.synchronous:
+        os.environ["INVOICE_GUARD_SYNCHRONOUS"] = args.synchronous  # inherited by the spawned workers
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="invoice_guard_stress_")
+    rows = []
+    for mode in args.modes:
+        r = run_mode(mode, args.procs, args.threads, args.ops, args.vendors, workdir)
+        rows.append(r)
+        print(
+            f"{mode:<7} {r['writes']:>7,} writes  {r['seconds']:>7.2f}s  {r['writes_per_s']:>8,.0f}/s  "
+            f"failed {r['failed']:>5}  lost stats {r['lost_stats_updates']}  lost sketch {r['lost_sketch_updates']}  "
+            f"max rel err {r['max_rel_err']:.1e}"
+        )
+        for msg, n in r["errors"].items():
+            print(f"          {n} x {msg}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"procs": args.procs, "threads": args.threads, "ops": args.ops, "results": rows}, f, indent=2)
+    raise SystemExit(1 if any(r["lost_stats_updates"] or r["lost_sketch_updates"] for r in rows) else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,72 @@
+# bench/stubs.py
+"""Offline stand-ins for the embedding model and the price-check LLM."""
+from __future__ import annotations
+
+import hashlib
+import sys
+from typing import Optional
+
+import numpy as np
+
+import llm_price_check
+from ml import embeddings
+from ml.embeddings import DEFAULT_MODEL, Embedder, get_embedder
+from scripts.stub_llm_server import start_stub
+
+STUB_DIM = 384  # same width as all-MiniLM-L6-v2, so stored rows look like the real thing
+
+
+class StubEmbedder(Embedder):
+    """
+    Hashed bag-of-words vectors: no weights, deterministic, and texts sharing words are
+    similar, so neighbour search and duplicate scores still behave plausibly.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, dim: int = STUB_DIM):
+        super().__init__(model_name)
+        self.dim = dim
+
+    def _vec(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for word in (text or "").lower().split():
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def embed_text(self, text: str) -> np.ndarray:
+        return self._vec(text)
+
+    def embed_texts(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._vec(t) for t in texts])
+
+
+def use_embedder(mode: str = "auto") -> str:
+    """
+    mode: model | stub | auto (the real model if it loads, else the stub). Installs the
+    choice as the shared DEFAULT_MODEL embedder and returns "model" or "stub".
+    """
+    if mode != "stub":
+        try:
+            get_embedder().embed_text("warm up")
+            return "model"
+        except Exception as e:
+            if mode == "model":
+                raise
+            print(f"bench: embedding model unavailable ({type(e).__name__}: {e}); using stub", file=sys.stderr)
+    embeddings._EMBEDDERS[DEFAULT_MODEL] = StubEmbedder()
+    return "stub"
+
+
+def use_stub_llm(latency_ms: float = 50.0, max_concurrency: Optional[int] = None):
+    """Route price checks to a local stub server (no rate limit) -> the server (.requests counts calls)."""
+    srv, url = start_stub(0, latency_ms)
+    llm_price_check._SERVICE = llm_price_check.PriceCheckService(
+        api_key="stub",
+        base_url=url,
+        max_concurrency=max_concurrency or llm_price_check.PRICE_MAX_CONCURRENCY,
+        rate_per_s=0,
+    )
+    return srv
@@ -2,8 +2,12 @@
 from __future__ import annotations
 import re
 from dataclasses import dataclass, asdict
+from datetime import date
 from dateutil import parser as dateparser
 
+# Bump when extraction output can change for the same OCR text (invalidates cached fields)
+EXTRACTOR_VERSION = 1
+
 MONEY_RE = re.compile(r"(?:(?:USD|\$)\s*)?([0-9]{1,3}(?:,[0-9]{3})*(?:\.[0-9]{2})?|[0-9]+(?:\.[0-9]{2})?)")
 INVOICE_NO_RE = re.compile(r"(?:invoice\s*(?:no\.?|number|#)\s*[:\-]?\s*)([A-Z0-9][A-Z0-9\-\_/]{2,})", re.IGNORECASE)
 DATE_HINT_RE = re.compile(r"(?:invoice\s*date|date)\s*[:\-]?\s*(.+)", re.IGNORECASE)
@@ -15,6 +19,34 @@ VENDOR_LABEL_RE = re.compile(
 # Sometimes OCR gives: "Seller: <name>   Client: <name>"
 SELLER_INLINE_RE = re.compile(r"seller\s*[:\-]\s*(.+?)(?:\s{2,}|client\s*[:\-]|bill\s*to\s*[:\-]|ship\s*to\s*[:\-]|$)", re.IGNORECASE)
 
+BAD_TOKENS = [
+    "invoice", "bill to", "ship to", "date", "due", "total", "balance",
+    "tax id", "tin", "vat", "gst", "ssn", "po", "purchase order",
+    "amount", "payment", "terms", "remit", "account", "routing"
+]
+BAD_TOKENS_RE = re.compile("|".join(re.escape(t) for t in BAD_TOKENS))
+GENERIC_LABELS = {"seller", "client", "seller:", "client:", "seller: client:"}
+VENDOR_HEADINGS = {"seller:", "seller", "vendor:", "vendor", "from:", "from", "supplier:", "supplier"}
+
+DATE_CANDIDATE_RE = re.compile(r"\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})\b")
+
+# Dates dateutil would read the same way, parsed without it (4-digit years from 1000 only:
+# dateutil shifts some years < 100 into the current century). "of issue:" is the
+# "Date of issue: 04/13/2013" label that DATE_HINT_RE leaves in front of the date.
+_MONTHS = {
+    name: i + 1
+    for i, names in enumerate(dateparser.parserinfo.MONTHS)
+    for name in (n.lower() for n in names)
+}
+FAST_DATE_RE = re.compile(
+    r"(?:of\s+issue\s*:\s*)?"
+    r"(?:(?P<iy>[1-9][0-9]{3})(?P<isep>[-/])(?P<im>[0-9]{1,2})(?P=isep)(?P<id>[0-9]{1,2})"
+    r"|(?P<ua>[0-9]{1,2})(?P<usep>[-/])(?P<ub>[0-9]{1,2})(?P=usep)(?P<uy>[1-9][0-9]{3})"
+    r"|(?P<mname>[A-Za-z]{3,9})\.?\s+(?P<md>[0-9]{1,2}),?\s+(?P<my>[1-9][0-9]{3})"
+    r"|(?P<dd>[0-9]{1,2})\s+(?P<dname>[A-Za-z]{3,9})\.?,?\s+(?P<dy>[1-9][0-9]{3}))",
+    re.IGNORECASE,
+)
+
 @dataclass
 class InvoiceRecord:
     vendor_name: str | None
@@ -24,85 +56,106 @@ class InvoiceRecord:
     currency: str | None
     raw_text: str
 
-def _clean_vendor_guess(lines: list[str]) -> str | None:
-    bad_tokens = [
-        "invoice", "bill to", "ship to", "date", "due", "total", "balance",
-        "tax id", "tin", "vat", "gst", "ssn", "po", "purchase order",
-        "amount", "payment", "terms", "remit", "account", "routing"
-    ]
-    def looks_like_metadata(s: str) -> bool:
-        s_low = s.lower()
-        if any(tok in s_low for tok in bad_tokens):
-            return True
-        if "@" in s_low or "www." in s_low:
-            return True
-        # too numeric
-        if sum(c.isdigit() for c in s) > max(3, len(s)//3):
-            return True
+def _looks_like_metadata(s: str) -> bool:
+    s_low = s.lower()
+    if BAD_TOKENS_RE.search(s_low):
+        return True
+    if "@" in s_low or "www." in s_low:
+        return True
+    # too numeric
+    if sum(c.isdigit() for c in s) > max(3, len(s)//3):
+        return True
+    return False
+
+
+def _vendor_candidate(cand: str, meta: dict) -> bool:
+    if cand.lower().strip() in GENERIC_LABELS or not cand or not 3 <= len(cand) <= 60:
         return False
-    GENERIC_LABELS = {
-    "seller", "client", "seller:", "client:", "seller: client:"
-}
-    
+    if cand not in meta:
+        meta[cand] = _looks_like_metadata(cand)
+    return not meta[cand]
 
-    # 1) Keyword-driven extraction (best)
-    for ln in lines[:30]:
-        s = ln.strip()
-        if not s:
-            continue
-
-        # inline: "Seller: X   Client: Y"
-        m_inline = SELLER_INLINE_RE.search(s)
-        if m_inline:
-            cand = m_inline.group(1).strip(" -—–\t")
-            if cand.lower().strip() in GENERIC_LABELS:
-                continue
-            if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
-                return cand[:80]
-            
-
-        # line starts with Seller/Vendor/From:
-        m = VENDOR_LABEL_RE.match(s)
-        if m:
-            cand = m.group(1).strip(" -—–\t")
-            if cand.lower().strip() in GENERIC_LABELS:
-                continue
-            if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
-                return cand[:80]
 
-    # 2) If we see a line that is JUST "Seller:" then next non-empty line is likely the name
+def _labelled_vendor(s: str, meta: dict) -> str | None:
+    # inline: "Seller: X   Client: Y" (ASCII lines without "seller" can't match)
+    m_inline = SELLER_INLINE_RE.search(s) if "seller" in s.lower() or not s.isascii() else None
+    if m_inline:
+        cand = m_inline.group(1).strip(" -—–\t")
+        if cand.lower().strip() in GENERIC_LABELS:
+            return None
+        if _vendor_candidate(cand, meta):
+            return cand[:80]
+
+    # line starts with Seller/Vendor/From:
+    m = VENDOR_LABEL_RE.match(s)
+    if m:
+        cand = m.group(1).strip(" -—–\t")
+        if _vendor_candidate(cand, meta):
+            return cand[:80]
+    return None
+
+
+def _clean_vendor_guess(lines: list[str]) -> str | None:
+    """
+    Rules in priority order: 1) "Seller: X" / "Vendor: X" on a line, 2) the line after a bare
+    "Seller:" heading, 3) the first name-like line. One pass over the first 30 lines keeps the
+    first candidate of rules 2 and 3 and returns on the first rule-1 match.
+    """
+    meta: dict = {}  # candidate -> looks_like_metadata, shared by the rules
+    after_heading = None
+    fallback = None
+
     for i, ln in enumerate(lines[:30]):
-        s = ln.strip().lower().strip(" -—–")
-        if s in ("seller:", "seller", "vendor:", "vendor", "from:", "from", "supplier:", "supplier"):
-            # grab next meaningful line
+        s = ln.strip()
+
+        # 1) Keyword-driven extraction (best)
+        labelled = _labelled_vendor(s, meta) if s else None
+        if labelled:
+            return labelled
+
+        # 2) If we see a line that is JUST "Seller:" then next non-empty line is likely the name
+        if after_heading is None and s.lower().strip(" -—–") in VENDOR_HEADINGS:
             for j in range(i + 1, min(i + 6, len(lines))):
                 cand = lines[j].strip(" -—–\t")
-                if cand.lower().strip() in GENERIC_LABELS:
-                    continue
-                if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
-                    return cand[:80]
-    
-
-    # 3) Fallback: first plausible “name-like” line
-    for ln in lines[:30]:
-        cand = ln.strip(" -—–\t")
-        if not cand or len(cand) < 3:
-            continue
-        if looks_like_metadata(cand):
-            continue
-        if 4 <= len(cand) <= 40:
-            # avoid generic labels
-            if cand.lower().strip() in GENERIC_LABELS:
-                continue
-            if cand.lower() in ("seller", "client", "seller: client:", "seller: client:"):
-                continue
-            return cand[:80]
+                if _vendor_candidate(cand, meta):
+                    after_heading = cand[:80]
+                    break
 
-    return None
+        # 3) Fallback: first plausible “name-like” line
+        if fallback is None and after_heading is None:
+            cand = ln.strip(" -—–\t")
+            if 4 <= len(cand) <= 40 and _vendor_candidate(cand, meta):
+                fallback = cand[:80]
 
+    return after_heading or fallback
+
+
+def _fast_date(text: str) -> str | None:
+    m = FAST_DATE_RE.fullmatch(text.strip())
+    if m is None:
+        return None
+    g = m.groupdict()
+    try:
+        if g["iy"]:
+            y, mo, d = int(g["iy"]), int(g["im"]), int(g["id"])
+        elif g["uy"]:
+            # month first unless that can't be a month (dateutil's dayfirst=False rule)
+            a, b, y = int(g["ua"]), int(g["ub"]), int(g["uy"])
+            mo, d = (a, b) if a <= 12 else (b, a)
+        elif g["my"]:
+            mo, d, y = _MONTHS[g["mname"].lower()], int(g["md"]), int(g["my"])
+        else:
+            mo, d, y = _MONTHS[g["dname"].lower()], int(g["dd"]), int(g["dy"])
+        return date(y, mo, d).isoformat()
+    except (KeyError, ValueError):
+        return None
 
 
 def _parse_date(text: str) -> str | None:
+    # Compiled patterns cover the usual formats; anything else (or invalid) goes to dateutil
+    fast = _fast_date(text)
+    if fast:
+        return fast
     try:
         dt = dateparser.parse(text, fuzzy=True)
         if dt:
@@ -111,28 +164,45 @@ def _parse_date(text: str) -> str | None:
         return None
     return None
 
+def _search_from(rx: re.Pattern, text: str, lowered: str, keyword: str) -> re.Match | None:
+    """
+    rx.search(text), trying rx only where keyword occurs. For ASCII text lower() keeps offsets
+    and equals IGNORECASE matching, so str.find locates the candidates instead of the regex
+    engine scanning every position.
+    """
+    if not text.isascii():
+        return rx.search(text)
+    pos = lowered.find(keyword)
+    while pos != -1:
+        m = rx.match(text, pos)
+        if m:
+            return m
+        pos = lowered.find(keyword, pos + 1)
+    return None
+
+
 def extract_fields(ocr_text: str) -> InvoiceRecord:
     lines = [l.strip() for l in ocr_text.splitlines()]
     lines = [l for l in lines if l]
+    lowered = ocr_text.lower()
 
     vendor_name = _clean_vendor_guess(lines)
 
     invoice_number = None
-    m = INVOICE_NO_RE.search(ocr_text)
+    m = _search_from(INVOICE_NO_RE, ocr_text, lowered, "invoice")
     if m:
         invoice_number = m.group(1).strip().upper()
 
     invoice_date = None
-    # Try date line hint first
-    m = DATE_HINT_RE.search(ocr_text)
+    # Try date line hint first ("invoice date: X" and "date: X" capture the same X)
+    m = _search_from(DATE_HINT_RE, ocr_text, lowered, "date")
     if m:
         invoice_date = _parse_date(m.group(1))
 
     # Fallback: pick first parsable date from text
     if invoice_date is None:
         # common formats like 01/02/2025, 2025-01-02
-        date_candidates = re.findall(r"\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})\b", ocr_text)
-        for dc in date_candidates[:5]:
+        for dc in DATE_CANDIDATE_RE.findall(ocr_text)[:5]:
             invoice_date = _parse_date(dc)
             if invoice_date:
                 break
@@ -140,7 +210,6 @@ def extract_fields(ocr_text: str) -> InvoiceRecord:
     # Total amount: prefer lines near "Total" / "Amount Due"
     total_amount = None
     currency = None
-    lowered = ocr_text.lower()
 
     def find_amount_near(keyword: str) -> float | None:
         idx = lowered.find(keyword)
@@ -177,3 +246,48 @@ def extract_fields(ocr_text: str) -> InvoiceRecord:
 
 def to_dict(rec: InvoiceRecord) -> dict:
     return asdict(rec)
+
+
+def extract_dict(ocr_text: str) -> dict:
+    """extract_fields as the plain dict that is cached and stored (no raw_text)."""
+    rec = to_dict(extract_fields(ocr_text))
+    rec.pop("raw_text", None)
+    return rec
+
+
+# Plausibility bounds for extraction_problems
+MIN_YEAR = 1990
+MAX_TOTAL = 1e9
+_VENDOR_CHARS_RE = re.compile(r"[A-Za-z0-9 &.,'()\-]")
+
+
+def extraction_problems(fields: dict) -> list[str]:
+    """
+    Key fields that are missing or implausible (empty list = looks complete). Used by the
+    OCR cascade (ocr.ocr_cascade) to decide whether a cheap low-res pass can be trusted:
+      vendor_name    - at least 3 letters, mostly ordinary name characters (not OCR debris)
+      invoice_number - 3-32 characters with at least one digit
+      invoice_date   - an ISO date between MIN_YEAR and next year
+      total_amount   - positive and below MAX_TOTAL
+    """
+    problems = []
+    vendor = fields.get("vendor_name") or ""
+    letters = sum(c.isalpha() for c in vendor)
+    if letters < 3 or len(_VENDOR_CHARS_RE.findall(vendor)) < 0.8 * len(vendor):
+        problems.append("vendor_name")
+
+    number = fields.get("invoice_number") or ""
+    if not (3 <= len(number) <= 32 and any(c.isdigit() for c in number)):
+        problems.append("invoice_number")
+
+    try:
+        year = date.fromisoformat(fields.get("invoice_date") or "").year
+    except ValueError:
+        year = 0
+    if not MIN_YEAR <= year <= date.today().year + 1:
+        problems.append("invoice_date")
+
+    total = fields.get("total_amount")
+    if total is None or not 0 < total < MAX_TOTAL:
+        problems.append("total_amount")
+    return problems
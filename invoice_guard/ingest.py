@@ -0,0 +1,674 @@
+# ingest.py
+"""
+Long-running ingestion: watch a folder (or tail a JSONL queue file) and push every new
+invoice through the pipeline as bounded stages, each with its own workers:
+
+  source -> hash -> ocr + extract (process pool) -> embed (batched) -> store (one writer)
+
+Every hand-off is a bounded queue. When a stage falls behind (usually OCR) its inbox
+fills, the stages before it block on put(), and the source stops listing new files
+instead of holding the backlog in memory. Files already checkpointed, and OCR-cache hits,
+skip straight past the stages they don't need.
+
+The store stage runs risk, neighbour search and the insert (main.analyze) in arrival
+order, so two copies of an invoice in flight at once still see each other. It commits in
+groups, collecting each group (and running its price checks) before taking the write
+lock. Each file's checkpoint row (content SHA-256, path, size, mtime, invoice id or
+error) and the queue read offset are written in the same transaction as the invoices. A
+restart therefore resumes exactly after the last commit: committed files are skipped
+(without re-hashing when path, size and mtime match) and uncommitted ones are redone. A
+failed file is recorded with its error and picked up again on later runs (a restart, or
+the next --once) until it has failed INGEST_ATTEMPTS times; a queue line is consumed
+either way, so failed queue entries are retried only when they are queued again.
+
+    python ingest.py --db data/invoices.db --watch /mnt/scans
+    python ingest.py --db data/invoices.db --queue inbox.jsonl --ocr-workers 6
+    python ingest.py --db data/invoices.db --watch /mnt/scans --once   # drain and exit
+
+Queue lines are {"image_path": "...", "id": ...} objects, JSON strings or bare paths;
+relative paths resolve against the queue file's folder. Results go to stdout as NDJSON
+(the shape of main.py --batch). Every --status seconds a line with queue depths and
+per-stage throughput goes to stderr. SIGINT/SIGTERM stop the source and drain what is in
+flight.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import main
+from batch import IMAGE_EXTS, _ocr_pool_init, _ocr_worker
+from llm_price_check import acached_price_check
+from ml.embeddings import get_embedder
+from ocr import available_cores, image_sha256
+from product_extraction import pick_product_desc
+from store import Store, _statements, get_cached_ocr, put_cached_ocr, unit_of_work
+from tracing import count
+from utils import lazy_module
+
+futures = lazy_module("concurrent.futures")
+
+INGEST_SCHEMA = """
+-- One row per distinct image (by content), written in the same transaction as its invoice
+CREATE TABLE IF NOT EXISTS ingest_files (
+  image_sha256 TEXT PRIMARY KEY,
+  path TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  invoice_id INTEGER,  -- NULL while processing has only failed; retried up to INGEST_ATTEMPTS times
+  error TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,  -- failed attempts so far
+  processed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingest_files_path ON ingest_files(path, size, mtime_ns);
+
+-- Read position per JSONL queue file: every line before offset is committed
+CREATE TABLE IF NOT EXISTS ingest_sources (
+  source TEXT PRIMARY KEY,
+  offset INTEGER NOT NULL
+);
+"""
+
+QUEUE_SIZE = int(os.getenv("INVOICE_GUARD_INGEST_QUEUE", "64"))
+# A file that failed this many times is left alone (its last error stays in ingest_files)
+INGEST_ATTEMPTS = int(os.getenv("INVOICE_GUARD_INGEST_ATTEMPTS", "3"))
+
+# Checkpoint rows that mean "don't process these bytes again"
+_SETTLED = f"(invoice_id IS NOT NULL OR attempts >= {max(1, INGEST_ATTEMPTS)})"
+
+_STOP = object()
+
+
+class Item:
+    """One file moving through the stages; each stage fills in its part."""
+
+    __slots__ = (
+        "seq", "path", "source", "offset", "req_id", "size", "mtime_ns",
+        "sha256", "text", "fields", "tier", "emb", "error", "skip", "prior_id",
+    )
+
+    def __init__(self, path: Optional[str], source: Optional[str] = None, offset: Optional[int] = None, req_id: Any = None):
+        self.seq = -1
+        self.path = path
+        self.source = source  # JSONL queue file this came from (None for watched folders)
+        self.offset = offset  # byte offset just past its line
+        self.req_id = req_id
+        self.size = self.mtime_ns = 0
+        self.sha256: Optional[str] = None
+        self.text: Optional[str] = None
+        self.fields: Optional[Dict[str, Any]] = None
+        self.tier: Optional[str] = None  # "cache", or the OCR cascade tier: "fast" / "full"
+        self.emb = None
+        self.error: Optional[str] = None
+        self.skip: Optional[str] = None
+        self.prior_id: Optional[int] = None
+
+
+class Stage:
+    """A bounded inbox and the workers draining it."""
+
+    def __init__(self, name: str, workers: int, maxsize: int):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.inbox: "queue.Queue" = queue.Queue(maxsize)
+        self.alive = 0
+        self.items = 0
+        self.busy_s = 0.0
+
+
+# -------------------------
+# Sources
+# -------------------------
+def watch_folder(
+    folder: str, stop: threading.Event, conn, recursive: bool = False, poll_s: float = 2.0,
+    settle_s: float = 2.0, once: bool = False,
+) -> Iterator[Item]:
+    """
+    New or changed images under folder. A file is picked up once its size and mtime are
+    unchanged across two polls and it is settle_s old (scanners write in pieces); files
+    whose (path, size, mtime) is already checkpointed are skipped without hashing.
+
+    In memory it only tracks files still in the folder: the version of each path already
+    handed on (so it isn't queued twice while in flight) and the ones settling.
+    """
+    seen: Dict[str, tuple] = {}
+    waiting: Dict[str, tuple] = {}
+    while not stop.is_set():
+        paths = _scan(folder, recursive)
+        present = set(paths)
+        for tracked in (seen, waiting):
+            for gone in [p for p in tracked if p not in present]:
+                del tracked[gone]
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (path, st.st_size, st.st_mtime_ns)
+            if seen.get(path) == key:
+                continue
+            if not once and (waiting.get(path) != key or time.time() - st.st_mtime < settle_s):
+                waiting[path] = key
+                continue
+            waiting.pop(path, None)
+            seen[path] = key
+            if conn.execute(f"SELECT 1 FROM ingest_files WHERE path = ? AND size = ? AND mtime_ns = ? AND {_SETTLED}", key).fetchone():
+                continue
+            yield Item(path)
+            if stop.is_set():
+                return
+        if once:
+            return
+        stop.wait(poll_s)
+
+
+def _scan(folder: str, recursive: bool) -> List[str]:
+    if recursive:
+        paths = [os.path.join(d, f) for d, _, files in os.walk(folder) for f in files]
+    else:
+        paths = [e.path for e in os.scandir(folder) if e.is_file()]
+    return sorted(p for p in paths if os.path.splitext(p)[1].lower() in IMAGE_EXTS)
+
+
+def jsonl_queue(path: str, stop: threading.Event, offset: int = 0, poll_s: float = 1.0, once: bool = False) -> Iterator[Item]:
+    """Complete lines appended to path from byte offset on (a partial last line waits for its newline)."""
+    source = os.path.abspath(path)
+    base = os.path.dirname(source)
+    while not stop.is_set():
+        size = os.path.getsize(source) if os.path.exists(source) else 0
+        if size < offset:
+            print(f"ingest: {path} shrank below offset {offset}; reading from the start", file=sys.stderr)
+            offset = 0
+        if size > offset:
+            with open(source, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    item = _parse_line(line.decode("utf-8", "replace").strip(), base, source, offset)
+                    if item is not None:
+                        yield item
+                    if stop.is_set():
+                        return
+        if once:
+            return
+        stop.wait(poll_s)
+
+
+def _parse_line(line: str, base: str, source: str, offset: int) -> Optional[Item]:
+    if not line or line.startswith("#"):
+        return None
+    req_id, image_path = None, line
+    if line[0] in "{\"":
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            item = Item(None, source, offset)
+            item.error = f"Bad request: {e}"
+            return item
+        if isinstance(obj, dict):
+            req_id, image_path = obj.get("id"), obj.get("image_path")
+        else:
+            image_path = obj
+    item = Item(None, source, offset, req_id)
+    if not isinstance(image_path, str) or not image_path:
+        item.error = "Bad request: missing image_path"
+    else:
+        item.path = image_path if os.path.isabs(image_path) else os.path.join(base, image_path)
+    return item
+
+
+# -------------------------
+# Pipeline
+# -------------------------
+class Pipeline:
+    def __init__(
+        self,
+        db_path: str,
+        ocr_workers: Optional[int] = None,
+        embed_workers: int = 1,
+        embed_batch: int = 32,
+        queue_size: int = QUEUE_SIZE,
+        commit_every: int = 32,
+        commit_wait_ms: float = 200.0,
+        use_ml: bool = True,
+        price_check: bool = False,
+        exact_search: bool = False,
+        nprobe: Optional[int] = None,
+        out_stream=None,
+    ):
+        self.db_path = db_path
+        self.store = Store(db_path)
+        self.use_ml = use_ml
+        self.price_check = price_check
+        self.search_kwargs = {"exact": exact_search, "nprobe": nprobe}
+        self.embed_batch = max(1, embed_batch)
+        self.commit_every = max(1, commit_every)
+        self.commit_wait = commit_wait_ms / 1000.0
+        self.out = out_stream or sys.stdout
+        self.version = main._cache_version()
+        self.stop = threading.Event()
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._price_cache = None  # lookup thread for --price-check, started on first use
+
+        self.hash = Stage("hash", 1, queue_size)
+        self.ocr = Stage("ocr", ocr_workers or available_cores(), queue_size)
+        self.embed = Stage("embed", embed_workers, queue_size)
+        self.write = Stage("store", 1, queue_size)
+        self.stages = [self.hash, self.ocr] + ([self.embed] if use_ml else []) + [self.write]
+
+        with unit_of_work(self.store.conn) as conn:
+            for stmt in _statements(INGEST_SCHEMA):
+                conn.execute(stmt)
+            if "attempts" not in {r["name"] for r in conn.execute("PRAGMA table_info(ingest_files)")}:
+                # Older checkpoints: failures get their retries
+                conn.execute("ALTER TABLE ingest_files ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def queue_offset(self, source: str) -> int:
+        row = self.store.conn.execute("SELECT offset FROM ingest_sources WHERE source = ?", (os.path.abspath(source),)).fetchone()
+        return int(row[0]) if row else 0
+
+    # -------------------------
+    # Running
+    # -------------------------
+    def run(self, source: Callable[[], Iterator[Item]], status_s: float = 10.0) -> Counter:
+        """Feed source() through the stages until it ends or stop is set; returns result counts."""
+        after_ocr = self.embed if self.use_ml else self.write
+        threads = [threading.Thread(target=self._feed, args=(source,), name="ingest-source")]
+        threads += self._start(self.hash, self._hash_one, lambda it: after_ocr if it.tier == "cache" else self.ocr, self.ocr)
+        threads.append(threading.Thread(target=self._ocr_stage, args=(after_ocr,), name="ingest-ocr"))
+        if self.use_ml:
+            threads += self._start(self.embed, self._embed_many, lambda it: self.write, self.write, batch=self.embed_batch)
+        writer = threading.Thread(target=self._store_stage, name="ingest-store")
+        threads.append(writer)
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        last = time.monotonic()
+        while writer.is_alive():
+            writer.join(timeout=0.5)
+            if status_s and time.monotonic() - last >= status_s:
+                last = time.monotonic()
+                print(self.status_line(), file=sys.stderr, flush=True)
+        if self._price_cache is not None:
+            self._price_cache.shutdown(wait=True)
+        self.store.close()
+        return self.counts
+
+    def status_line(self) -> str:
+        queues = " ".join(f"{s.name} {s.inbox.qsize()}/{s.inbox.maxsize}" for s in self.stages)
+        rates = " ".join(
+            f"{s.name} {s.items / s.busy_s:.1f}/s" for s in self.stages if s.busy_s > 0
+        )
+        done = ", ".join(f"{k} {v}" for k, v in sorted(self.counts.items()))
+        return f"ingest: queues [{queues}] per-worker [{rates}] {done or 'idle'}"
+
+    def _feed(self, source: Callable[[], Iterator[Item]]) -> None:
+        seq = 0
+        try:
+            for item in source():
+                item.seq = seq
+                seq += 1
+                self.hash.inbox.put(item)  # blocks while the pipeline is full: backpressure
+        finally:
+            self.hash.inbox.put(_STOP)
+
+    def _start(self, stage: Stage, handle, route, downstream: Stage, batch: int = 1) -> List[threading.Thread]:
+        stage.alive = stage.workers
+        return [
+            threading.Thread(target=self._worker, args=(stage, handle, route, downstream, batch), name=f"ingest-{stage.name}-{i}")
+            for i in range(stage.workers)
+        ]
+
+    def _worker(self, stage: Stage, handle, route, downstream: Stage, batch: int) -> None:
+        while True:
+            item = stage.inbox.get()
+            if item is _STOP:
+                stage.inbox.put(_STOP)  # for this stage's other workers
+                break
+            items = [item]
+            while len(items) < batch:
+                try:
+                    nxt = stage.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stage.inbox.put(_STOP)
+                    break
+                items.append(nxt)
+
+            todo = [it for it in items if it.error is None]
+            t0 = time.perf_counter()
+            try:
+                if todo:
+                    handle(todo)
+            except Exception as e:
+                for it in todo:
+                    it.error = it.error or f"{type(e).__name__}: {e}"
+            with self._lock:
+                stage.busy_s += time.perf_counter() - t0
+                stage.items += len(items)
+            for it in items:
+                dest = self.write if it.error is not None or it.skip else route(it)
+                dest.inbox.put(it)
+        self._stage_done(stage, downstream)
+
+    def _stage_done(self, stage: Stage, downstream: Stage) -> None:
+        with self._lock:
+            stage.alive -= 1
+            last = stage.alive == 0
+        if last:
+            downstream.inbox.put(_STOP)
+
+    # -------------------------
+    # Stages
+    # -------------------------
+    def _hash_one(self, items: List[Item]) -> None:
+        conn = self.store.conn
+        for it in items:
+            try:
+                st = os.stat(it.path)
+                it.size, it.mtime_ns = st.st_size, st.st_mtime_ns
+                it.sha256 = image_sha256(it.path)
+            except OSError as e:
+                it.error = f"{type(e).__name__}: {e}"
+                continue
+            if self._settled(conn, it):
+                continue
+            cached = get_cached_ocr(conn, it.sha256, self.version, touch=False)
+            if cached:
+                it.text, it.fields = cached
+                it.tier = "cache"
+
+    def _ocr_stage(self, downstream: Stage) -> None:
+        """
+        OCR cascade + extraction in a process pool, at most 2 files per worker in flight;
+        the rest wait in the inbox. When the pool breaks (a worker killed, e.g. by the OOM
+        killer) it is replaced and the files that were in flight are retried one at a time,
+        so only the file that brings the pool down again fails. Failed files still go on to
+        the store stage, which never waits on a missing sequence number.
+        """
+        stage, limit = self.ocr, 2 * self.ocr.workers
+        pending: Dict[Any, tuple] = {}
+        retry: List[Item] = []
+        crashed = set()  # seqs already in flight once when the pool broke
+        stopping = broken = False
+        pool = futures.ProcessPoolExecutor(max_workers=stage.workers, initializer=_ocr_pool_init)
+        try:
+            while not stopping or pending or retry:
+                while not broken and len(pending) < (1 if retry else limit):
+                    if retry:
+                        item = retry.pop(0)
+                    elif stopping:
+                        break
+                    else:
+                        try:
+                            item = stage.inbox.get(timeout=0.05 if pending else None)
+                        except queue.Empty:
+                            break
+                        if item is _STOP:
+                            stopping = True
+                            break
+                    try:
+                        pending[pool.submit(_ocr_worker, item.path)] = (item, time.perf_counter())
+                    except futures.BrokenExecutor:
+                        broken = True
+                        retry.insert(0, item)
+                if broken and not pending:
+                    print("ingest: OCR pool broke; starting a new one", file=sys.stderr, flush=True)
+                    pool.shutdown(wait=False)
+                    pool = futures.ProcessPoolExecutor(max_workers=stage.workers, initializer=_ocr_pool_init)
+                    broken = False
+                    continue
+                if not pending:
+                    continue
+                done, _ = futures.wait(pending, timeout=0.05, return_when=futures.FIRST_COMPLETED)
+                for fut in done:
+                    item, t0 = pending.pop(fut)
+                    try:
+                        _, item.text, item.fields, item.tier, item.error = fut.result()
+                    except futures.BrokenExecutor as e:
+                        broken = True
+                        if item.seq not in crashed:
+                            crashed.add(item.seq)
+                            retry.append(item)
+                            continue
+                        item.error = f"{type(e).__name__}: {e}"
+                    except Exception as e:
+                        item.error = f"{type(e).__name__}: {e}"
+                    crashed.discard(item.seq)
+                    if item.error is None:
+                        count("ocr_tier", tier=item.tier)
+                    with self._lock:
+                        stage.busy_s += time.perf_counter() - t0
+                        stage.items += 1
+                    (self.write if item.error is not None else downstream).inbox.put(item)
+        finally:
+            pool.shutdown(wait=True)
+            downstream.inbox.put(_STOP)
+
+    def _embed_many(self, items: List[Item]) -> None:
+        embs = get_embedder().embed_texts([it.text for it in items], batch_size=len(items))
+        for it, emb in zip(items, embs):
+            it.emb = emb
+
+    def _store_stage(self) -> None:
+        """
+        Single writer: restores source order and collects up to commit_every items (or what
+        arrived within commit_wait), then writes them in one short transaction. Waiting on a
+        file still in OCR never holds the write lock, so the API and the embedding backfill
+        keep writing alongside.
+        """
+        conn = self.store.conn
+        held: Dict[int, Item] = {}
+        next_seq = 0
+        stopped = False
+        while not stopped:
+            ready: List[Item] = []
+            item = self.write.inbox.get()
+            while True:
+                if item is _STOP:
+                    stopped = True
+                    break
+                held[item.seq] = item
+                while next_seq in held:
+                    ready.append(held.pop(next_seq))
+                    next_seq += 1
+                if len(ready) >= self.commit_every:
+                    break
+                try:
+                    item = self.write.inbox.get(timeout=self.commit_wait)
+                except queue.Empty:
+                    break
+            if not ready:
+                continue
+
+            t0 = time.perf_counter()
+            todo = [it for it in ready if it.error is None and not it.skip]
+            # Reads and the LLM round trips happen before the write lock is taken
+            index = main._neighbor_index(conn, self.db_path, **self.search_kwargs) if self.use_ml and todo else None
+            prices = self._price_checks(todo) if self.price_check and todo else {}
+            results: List[Dict[str, Any]] = []
+            offsets: Dict[str, int] = {}
+            with unit_of_work(conn):
+                for it in ready:
+                    results.append(self._store_one(conn, it, index, prices.get(it.seq)))
+                    if it.source is not None:
+                        offsets[it.source] = it.offset
+                conn.executemany(
+                    "INSERT INTO ingest_sources (source, offset) VALUES (?, ?) "
+                    "ON CONFLICT(source) DO UPDATE SET offset = excluded.offset",
+                    offsets.items(),
+                )
+            with self._lock:
+                self.write.busy_s += time.perf_counter() - t0
+                self.write.items += len(results)
+            for r in results:  # only after the commit, so every reported invoice is durable
+                self.out.write(json.dumps(r) + "\n")
+            self.out.flush()
+
+    def _price_checks(self, items: List[Item]) -> Dict[int, tuple]:
+        """
+        Price checks for a batch, run concurrently through the shared service -> seq ->
+        (desc, result, save). Cache lookups run on one long-lived thread (and its store
+        connection) rather than a fresh executor per batch.
+        """
+        if not os.getenv("GEMINI_API_KEY"):
+            return {}
+        if self._price_cache is None:
+            self._price_cache = futures.ThreadPoolExecutor(1, thread_name_prefix="ingest-price-cache")
+
+        async def one(it: Item):
+            desc = pick_product_desc(it.text)
+            result, save = await acached_price_check(
+                self.store,
+                product_desc=desc,
+                vendor_name=it.fields.get("vendor_name"),
+                total_amount=it.fields.get("total_amount"),
+                currency=it.fields.get("currency") or "USD",
+                semantic=self.use_ml,
+                executor=self._price_cache,
+            )
+            return it.seq, (desc, result, save)
+
+        async def run():
+            return await asyncio.gather(*(one(it) for it in items))
+
+        with contextlib.redirect_stdout(sys.stderr):
+            return dict(asyncio.run(run()))
+
+    def _store_one(self, conn, it: Item, index, price=None) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"image_path": it.path}
+        if it.req_id is not None:
+            out["id"] = it.req_id
+        if it.error is None and not it.skip:
+            self._settled(conn, it)  # same bytes under another name earlier in this run
+        if it.skip:
+            self._count("skipped")
+            return {**out, "skipped": it.skip, "invoice_id": it.prior_id}
+
+        if it.error is None:
+            try:
+                # Savepoint: a failure undoes this invoice's partial writes only
+                with unit_of_work(conn), contextlib.redirect_stdout(sys.stderr):
+                    if it.tier == "cache":
+                        get_cached_ocr(conn, it.sha256, self.version, commit=False)  # hit count + LRU
+                    else:
+                        put_cached_ocr(conn, it.sha256, self.version, it.text, it.fields, commit=False)
+                    result = main.analyze(
+                        conn, self.db_path, it.text, os.path.basename(it.path), index,
+                        new_emb=it.emb, fields=it.fields, price_check=self.price_check, commit=False,
+                        use_ml=self.use_ml, price=price,
+                    )
+                    self._checkpoint(conn, it, result["invoice_id"])
+                self._count("ingested")
+                return {**out, **result, "ocr_cache": "hit" if it.tier == "cache" else "miss", "ocr_tier": it.tier}
+            except Exception as e:
+                it.error = f"{type(e).__name__}: {e}"
+
+        if it.sha256 is not None:
+            self._checkpoint(conn, it, None)
+        self._count("errors")
+        return {**out, "error": it.error}
+
+    def _settled(self, conn, it: Item) -> bool:
+        """Mark it skipped if its bytes were ingested or have used up their attempts."""
+        row = conn.execute(
+            f"SELECT invoice_id, attempts FROM ingest_files WHERE image_sha256 = ? AND {_SETTLED}", (it.sha256,)
+        ).fetchone()
+        if row is None:
+            return False
+        if row["invoice_id"] is not None:
+            it.skip, it.prior_id = "already ingested", row["invoice_id"]
+        else:
+            it.skip = f"failed {row['attempts']} times"
+        return True
+
+    def _checkpoint(self, conn, it: Item, invoice_id: Optional[int]) -> None:
+        """Success settles the file; a failure bumps its attempt count."""
+        conn.execute(
+            "INSERT INTO ingest_files (image_sha256, path, size, mtime_ns, invoice_id, error, attempts, processed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(image_sha256) DO UPDATE SET path = excluded.path, size = excluded.size, "
+            "mtime_ns = excluded.mtime_ns, invoice_id = excluded.invoice_id, error = excluded.error, "
+            "attempts = ingest_files.attempts + excluded.attempts, processed_at = excluded.processed_at",
+            (it.sha256, it.path, it.size, it.mtime_ns, invoice_id, it.error, 0 if invoice_id is not None else 1, time.time()),
+        )
+
+    def _count(self, status: str) -> None:
+        self.counts[status] += 1
+        count("ingest_files", status=status)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="InvoiceGuard ingestion daemon (watch folder / JSONL queue)")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--watch", metavar="DIR", help="Folder to watch for new invoice images")
+    src.add_argument("--queue", metavar="FILE", help="JSONL file to tail for image paths")
+    parser.add_argument("--db", required=True, help="Path to SQLite DB file")
+    parser.add_argument("--recursive", action="store_true", help="Watch subfolders too")
+    parser.add_argument("--once", action="store_true", help="Process what is there now, then exit")
+    parser.add_argument("--poll", type=float, default=2.0, help="Seconds between folder scans / queue reads")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds a file must be unchanged before pickup")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="OCR processes (default: CPUs)")
+    parser.add_argument("--embed-workers", type=int, default=1)
+    parser.add_argument("--embed-batch", type=int, default=32, help="Texts per encode call")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Items each stage may have waiting")
+    parser.add_argument("--commit-every", type=int, default=32, help="Invoices per transaction")
+    parser.add_argument("--status", type=float, default=10.0, help="Seconds between status lines on stderr (0 = off)")
+    parser.add_argument("--price-check", action="store_true", help="Run the LLM price check per invoice")
+    parser.add_argument("--exact", action="store_true", help="Exact nearest-neighbour search instead of IVF")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF clusters scanned per query")
+    parser.add_argument("--no-ml", "--rules-only", dest="no_ml", action="store_true", help="Skip embeddings and neighbour search")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(
+        args.db,
+        ocr_workers=args.ocr_workers,
+        embed_workers=args.embed_workers,
+        embed_batch=args.embed_batch,
+        queue_size=args.queue_size,
+        commit_every=args.commit_every,
+        use_ml=not args.no_ml,
+        price_check=args.price_check,
+        exact_search=args.exact,
+        nprobe=args.nprobe,
+    )
+    if args.watch:
+        def source():
+            return watch_folder(
+                args.watch, pipeline.stop, pipeline.store.conn, recursive=args.recursive,
+                poll_s=args.poll, settle_s=args.settle, once=args.once,
+            )
+    else:
+        start = pipeline.queue_offset(args.queue)
+
+        def source():
+            return jsonl_queue(args.queue, pipeline.stop, offset=start, poll_s=args.poll, once=args.once)
+
+    def _graceful(signum, frame):
+        print("ingest: stopping; draining in-flight files", file=sys.stderr, flush=True)
+        pipeline.stop.set()
+
+    signal.signal(signal.SIGINT, _graceful)
+    signal.signal(signal.SIGTERM, _graceful)
+    counts = pipeline.run(source, status_s=args.status)
+    print(pipeline.status_line(), file=sys.stderr)
+    sys.exit(1 if args.once and counts["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,15 +1,242 @@
 # llm_price_check.py
 from __future__ import annotations
 
-import json
+import asyncio
+import math
 import os
-from typing import Any, Dict, Optional
+import re
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from google import genai
-from google.genai import types
+import numpy as np
+
+from ml.embeddings import DEFAULT_MODEL, get_embedder
+from store import fetch_price_check_vectors, find_cached_price_check, get_reusable_price_check
+from tracing import count
+from utils import lazy_module
+
+# Imported on the first price check, not at startup
+genai = lazy_module("google.genai")
+types = lazy_module("google.genai.types")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+# Point at a local stub (scripts/stub_llm_server.py) to test/measure offline
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
+
+PRICE_MAX_CONCURRENCY = int(os.getenv("INVOICE_GUARD_PRICE_CONCURRENCY", "8"))
+PRICE_RATE_PER_S = float(os.getenv("INVOICE_GUARD_PRICE_RATE", "5"))
+PRICE_BURST = int(os.getenv("INVOICE_GUARD_PRICE_BURST", "10"))
+PRICE_CACHE_TTL_S = float(os.getenv("INVOICE_GUARD_PRICE_TTL_S", str(7 * 24 * 3600)))
+# Amounts within this ratio of each other share a cache bucket (1.1 -> ~10% wide)
+AMOUNT_BUCKET_RATIO = 1.1
+# Semantic cache: reuse an answer for a differently-worded description when the embeddings
+# are at least this similar and the amounts are within PRICE_AMOUNT_TOL of each other
+PRICE_SIM_THRESHOLD = float(os.getenv("INVOICE_GUARD_PRICE_SIM", "0.92"))
+PRICE_AMOUNT_TOL = float(os.getenv("INVOICE_GUARD_PRICE_AMOUNT_TOL", "0.10"))
+
+
+# -------------------------
+# Cache key
+# -------------------------
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_desc(product_desc: Optional[str]) -> str:
+    """Case, punctuation and spacing differences from OCR don't change the question."""
+    return _NON_WORD_RE.sub(" ", (product_desc or "").lower()).strip()
+
+
+def amount_bucket(total_amount: Optional[float]) -> str:
+    if total_amount is None or total_amount <= 0:
+        return "na"
+    return str(int(math.floor(math.log(float(total_amount)) / math.log(AMOUNT_BUCKET_RATIO))))
+
+
+def cache_key(product_desc: Optional[str], total_amount: Optional[float], currency: Optional[str]) -> str:
+    return f"{normalize_desc(product_desc)}|{(currency or 'USD').upper()}|{amount_bucket(total_amount)}"
+
+
+# -------------------------
+# Prompt / parsing
+# -------------------------
+def _prompt(product_desc: str, total_amount: Optional[float], currency: Optional[str]) -> str:
+    currency = currency or "USD"
+    total_str = "UNKNOWN" if total_amount is None else f"{float(total_amount):.2f}"
+
+    # ULTRA SHORT prompt
+    return f"""Price: {total_str} {currency}
+Items: {(product_desc or '')[:100]}
+
+OK or overpriced? Answer in 3 words then stop."""
+
+
+def _result(text: str) -> Dict[str, Any]:
+    # Parse simple text response
+    assessment = "UNKNOWN"
+    if any(word in text.lower() for word in ["ok", "reasonable", "fair", "good"]):
+        assessment = "OK"
+    elif any(word in text.lower() for word in ["overpriced", "expensive", "high", "too much"]):
+        assessment = "OVERPRICED"
+    elif any(word in text.lower() for word in ["possibly", "maybe", "slightly"]):
+        assessment = "POSSIBLY_OVERPRICED"
+
+    return {
+        "estimated_market_low": None,
+        "estimated_market_high": None,
+        "assessment": assessment,
+        "confidence": "LOW",
+        "explanation": text[:200],
+        "model": GEMINI_MODEL,
+    }
+
+
+def _failed(explanation: str) -> Dict[str, Any]:
+    return {
+        "estimated_market_low": None,
+        "estimated_market_high": None,
+        "assessment": "UNKNOWN",
+        "confidence": "LOW",
+        "explanation": explanation,
+        "model": GEMINI_MODEL,
+    }
+
+
+def is_failure(result: Dict[str, Any]) -> bool:
+    """Failed checks (no key, API/network error) are returned but never cached."""
+    expl = result.get("explanation") or ""
+    return expl.startswith("Error:") or expl == "GEMINI_API_KEY not set."
+
+
+# -------------------------
+# Service
+# -------------------------
+class TokenBucket:
+    """rate tokens/s, up to burst saved up; acquire() waits for one token."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:  # FIFO: waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PriceCheckService:
+    """
+    One genai client shared by every caller in the process, driven from a private event
+    loop thread. That loop owns the concurrency limit and rate limiter, so sync callers
+    (check) and asyncio callers on any loop (acheck) are throttled together and reuse
+    the same HTTP connections.
+    """
+
+    def __init__(
+        self,
+        api_key: str = GEMINI_API_KEY,
+        model: str = GEMINI_MODEL,
+        base_url: str = GEMINI_BASE_URL,
+        max_concurrency: int = PRICE_MAX_CONCURRENCY,
+        rate_per_s: float = PRICE_RATE_PER_S,
+        burst: int = PRICE_BURST,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.calls = 0
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="price-check", daemon=True).start()
+                self._loop = loop
+                self._sem = asyncio.Semaphore(self.max_concurrency)
+                self._bucket = TokenBucket(self.rate_per_s, self.burst)
+        return self._loop
+
+    @property
+    def client(self):
+        if self._client is None:
+            http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+            self._client = genai.Client(api_key=self.api_key, http_options=http_options)
+        return self._client
+
+    async def _ask(self, prompt: str) -> str:
+        async with self._sem:
+            await self._bucket.acquire()
+            self.calls += 1
+            response = await self.client.aio.models.generate_content(
+                model=self.model,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    temperature=0.1,
+                    max_output_tokens=100,  # Very short
+                ),
+            )
+            return (response.text or "").strip()
+
+    async def _check(
+        self, product_desc: str, vendor_name: Optional[str], total_amount: Optional[float], currency: Optional[str]
+    ) -> Dict[str, Any]:
+        if not self.api_key:
+            return _failed("GEMINI_API_KEY not set.")
+        try:
+            text = await self._ask(_prompt(product_desc, total_amount, currency))
+            print(f"DEBUG: Response: {text}", file=sys.stderr)
+            return _result(text)
+        except Exception as e:
+            print(f"DEBUG: Error: {e}", file=sys.stderr)
+            return _failed(f"Error: {str(e)[:100]}")
+
+    def submit(
+        self, product_desc: str, vendor_name: Optional[str], total_amount: Optional[float], currency: Optional[str] = "USD"
+    ):
+        """concurrent.futures.Future for one check, run on the service loop."""
+        coro = self._check(product_desc, vendor_name, total_amount, currency)
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def check(
+        self, product_desc: str, vendor_name: Optional[str], total_amount: Optional[float], currency: Optional[str] = "USD"
+    ) -> Dict[str, Any]:
+        return self.submit(product_desc, vendor_name, total_amount, currency).result()
+
+    async def acheck(
+        self, product_desc: str, vendor_name: Optional[str], total_amount: Optional[float], currency: Optional[str] = "USD"
+    ) -> Dict[str, Any]:
+        return await asyncio.wrap_future(self.submit(product_desc, vendor_name, total_amount, currency))
+
+
+_SERVICE: Optional[PriceCheckService] = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_price_service() -> PriceCheckService:
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = PriceCheckService()
+        return _SERVICE
 
 
 def run_price_check(
@@ -18,67 +245,285 @@ def run_price_check(
     total_amount: Optional[float],
     currency: Optional[str] = "USD",
 ) -> Dict[str, Any]:
-    if not GEMINI_API_KEY:
-        return {
-            "estimated_market_low": None,
-            "estimated_market_high": None,
-            "assessment": "UNKNOWN",
-            "confidence": "LOW",
-            "explanation": "GEMINI_API_KEY not set.",
-            "model": GEMINI_MODEL,
-        }
-
-    vendor_name = vendor_name or "UNKNOWN"
-    currency = currency or "USD"
-    total_str = "UNKNOWN" if total_amount is None else f"{float(total_amount):.2f}"
+    return get_price_service().check(product_desc, vendor_name, total_amount, currency)
 
-    # ULTRA SHORT prompt
-    prompt = f"""Price: {total_str} {currency}
-Items: {product_desc[:100]}
 
-OK or overpriced? Answer in 3 words then stop."""
+# -------------------------
+# Semantic cache
+# -------------------------
+class PriceCacheMetrics:
+    """Counters behind price_cache_stats(); saved latency is estimated from the mean LLM call."""
 
-    try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        
-        # Simple call - no schema
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.1,
-                max_output_tokens=100,  # Very short
-            )
+    def __init__(self):
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.llm_ms = 0.0
+        self.semantic_ms = 0.0  # embedding + search time spent on exact misses
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, llm_ms: float = 0.0, semantic_ms: float = 0.0) -> None:
+        count("price_cache", result=kind)
+        with self._lock:
+            self.lookups += 1
+            if kind == "exact":
+                self.exact_hits += 1
+            elif kind == "semantic":
+                self.semantic_hits += 1
+            else:
+                self.misses += 1
+                self.llm_ms += llm_ms
+            self.semantic_ms += semantic_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            avg_llm = self.llm_ms / self.misses if self.misses else None
+            saved = hits * avg_llm - self.semantic_ms if avg_llm is not None else None
+            return {
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / self.lookups, 4) if self.lookups else None,
+                "semantic_hit_rate": round(self.semantic_hits / self.lookups, 4) if self.lookups else None,
+                "avg_llm_ms": round(avg_llm, 2) if avg_llm is not None else None,
+                "semantic_lookup_ms": round(self.semantic_ms, 2),
+                "est_saved_ms": round(saved, 2) if saved is not None else None,
+            }
+
+
+class DescIndex:
+    """
+    In-memory copy of the price_checks description embeddings for one database, topped up
+    from rows with a higher rowid on each lookup (same pattern as EmbeddingMatrix).
+    """
+
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self.model = model
+        self.last_rowid = 0
+        # Row-aligned buffers with spare capacity; only the first `size` rows are live
+        self.size = 0
+        self._vecs = np.zeros((0, 0), dtype=np.float32)
+        self._invoice_ids = np.zeros(0, dtype=np.int64)
+        self._amounts = np.zeros(0, dtype=np.float64)
+        self._currencies = np.zeros(0, dtype=object)
+        self._checked_at = np.zeros(0, dtype=np.float64)
+        self.lock = threading.Lock()
+
+    def refresh(self, conn) -> None:
+        rows = fetch_price_check_vectors(conn, self.model, self.last_rowid)
+        if not rows:
+            return
+        new = np.stack([np.frombuffer(r["desc_embedding"], dtype=np.float32) for r in rows])
+        if self.size == 0:
+            self._vecs = np.zeros((0, new.shape[1]), dtype=np.float32)
+        if self.size + len(rows) > self._vecs.shape[0]:
+            self._grow(self.size + len(rows))
+        lo, hi = self.size, self.size + len(rows)
+        self._vecs[lo:hi] = new
+        self._invoice_ids[lo:hi] = [int(r["invoice_id"]) for r in rows]
+        self._amounts[lo:hi] = [np.nan if r["total_amount"] is None else float(r["total_amount"]) for r in rows]
+        self._currencies[lo:hi] = [(r["currency"] or "USD").upper() for r in rows]
+        self._checked_at[lo:hi] = [float(r["checked_at"] or 0.0) for r in rows]
+        self.size = hi
+        self.last_rowid = int(rows[-1]["rowid"])
+
+    def _grow(self, need: int) -> None:
+        cap = max(1024, self._vecs.shape[0] * 2, need)
+        vecs = np.zeros((cap, self._vecs.shape[1]), dtype=np.float32)
+        vecs[: self.size] = self._vecs[: self.size]
+        self._vecs = vecs
+        for name in ("_invoice_ids", "_amounts", "_currencies", "_checked_at"):
+            old = getattr(self, name)
+            buf = np.zeros(cap, dtype=old.dtype)
+            buf[: self.size] = old[: self.size]
+            setattr(self, name, buf)
+
+    @property
+    def vecs(self) -> np.ndarray:
+        return self._vecs[: self.size]
+
+    def search(
+        self, query: np.ndarray, total_amount: Optional[float], currency: Optional[str], ttl_s: float
+    ) -> Optional[Tuple[int, float]]:
+        """Most similar fresh row with the same currency and a comparable amount -> (invoice_id, sim)."""
+        if self.size == 0:
+            return None
+        n = self.size
+        ok = self._checked_at[:n] >= time.time() - ttl_s
+        ok &= self._currencies[:n] == (currency or "USD").upper()
+        amounts = self._amounts[:n]
+        if total_amount is None:
+            ok &= np.isnan(amounts)
+        else:
+            amt = float(total_amount)
+            with np.errstate(invalid="ignore"):
+                ok &= np.abs(amounts - amt) <= PRICE_AMOUNT_TOL * np.maximum(np.abs(amounts), abs(amt))
+        if not ok.any():
+            return None
+        sims = np.where(ok, self.vecs @ query, -np.inf)
+        best = int(np.argmax(sims))
+        if sims[best] < PRICE_SIM_THRESHOLD:
+            return None
+        return int(self._invoice_ids[best]), float(sims[best])
+
+
+_METRICS = PriceCacheMetrics()
+_DESC_INDEXES: Dict[Tuple[str, str], DescIndex] = {}
+_DESC_LOCK = threading.Lock()
+
+
+def _desc_index(conn, model: str) -> DescIndex:
+    path = conn.execute("PRAGMA database_list").fetchone()[2] or f"memory:{id(conn)}"
+    with _DESC_LOCK:
+        idx = _DESC_INDEXES.get((path, model))
+        if idx is None:
+            idx = _DESC_INDEXES[(path, model)] = DescIndex(model)
+        return idx
+
+
+def price_cache_stats() -> Dict[str, Any]:
+    return _METRICS.stats()
+
+
+def _semantic_lookup(
+    conn, query: np.ndarray, total_amount: Optional[float], currency: Optional[str], ttl_s: float, model: str
+) -> Optional[Dict[str, Any]]:
+    idx = _desc_index(conn, model)
+    with idx.lock:
+        idx.refresh(conn)
+        found = idx.search(query, total_amount, currency, ttl_s)
+    if found is None:
+        return None
+    invoice_id, sim = found
+    # Re-read the row: the index may hold rows from a rolled-back transaction
+    hit = get_reusable_price_check(conn, invoice_id)
+    if hit is None:
+        return None
+    hit["desc_similarity"] = round(sim, 4)
+    return hit
+
+
+def _exact_hit(conn, key: str, ttl_s: float, row_info: Dict[str, Any]):
+    hit = find_cached_price_check(conn, key, ttl_s)
+    if not hit:
+        return None
+    _METRICS.record("exact")
+    hit.pop("invoice_id")
+    checked_at = hit.pop("checked_at")
+    return {**hit, "cached": True, "cache_match": "exact"}, {"cache_key": key, "checked_at": checked_at, **row_info}
+
+
+def _semantic_hit(
+    conn, query: np.ndarray, key: str, ttl_s: float, row_info: Dict[str, Any], semantic_ms: float
+):
+    hit = _semantic_lookup(conn, query, row_info["total_amount"], row_info["currency"], ttl_s, DEFAULT_MODEL)
+    if not hit:
+        return None
+    _METRICS.record("semantic", semantic_ms=semantic_ms)
+    checked_at = hit.pop("checked_at")
+    hit["similar_to_invoice_id"] = hit.pop("invoice_id")
+    save = {
+        "cache_key": key, "checked_at": checked_at,
+        "desc_model": DEFAULT_MODEL, "desc_embedding": query, **row_info,
+    }
+    return {**hit, "cached": True, "cache_match": "semantic"}, save
+
+
+def _llm_answer(result: Dict[str, Any], key: str, query: Optional[np.ndarray], row_info: Dict[str, Any]):
+    if is_failure(result):
+        return {**result, "cached": False}, {"cache_key": None, "checked_at": None, **row_info}
+    save = {"cache_key": key, "checked_at": time.time(), **row_info}
+    if query is not None:
+        save.update(desc_model=DEFAULT_MODEL, desc_embedding=query)
+    return {**result, "cached": False}, save
+
+
+def cached_price_check(
+    conn,
+    product_desc: str,
+    vendor_name: Optional[str],
+    total_amount: Optional[float],
+    currency: Optional[str] = "USD",
+    ttl_s: float = PRICE_CACHE_TTL_S,
+    semantic: bool = True,
+    embed: Optional[Callable[[str], np.ndarray]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    run_price_check behind the price_checks cache -> (result, save_kwargs).
+
+    Lookup order: exact cache key, then (semantic=True) the nearest earlier description by
+    embedding, then the LLM. result["cached"] says whether the answer was reused and
+    result["cache_match"] how ("exact" | "semantic"; a semantic hit also carries
+    similar_to_invoice_id and desc_similarity). Pass save_kwargs on to
+    store.save_price_check; failures get cache_key=None so they are not reused.
+    """
+    key = cache_key(product_desc, total_amount, currency)
+    row_info = {"total_amount": total_amount, "currency": (currency or "USD").upper()}
+    found = _exact_hit(conn, key, ttl_s, row_info)
+    if found:
+        return found
+
+    query = None
+    semantic_ms = 0.0
+    if semantic:
+        t0 = time.perf_counter()
+        query = (embed or get_embedder().embed_text)(normalize_desc(product_desc))
+        semantic_ms = (time.perf_counter() - t0) * 1000
+        found = _semantic_hit(conn, query, key, ttl_s, row_info, semantic_ms)
+        if found:
+            return found
+
+    t0 = time.perf_counter()
+    result = run_price_check(product_desc, vendor_name, total_amount, currency)
+    _METRICS.record("miss", llm_ms=(time.perf_counter() - t0) * 1000, semantic_ms=semantic_ms)
+    return _llm_answer(result, key, query, row_info)
+
+
+async def acached_price_check(
+    store,
+    product_desc: str,
+    vendor_name: Optional[str],
+    total_amount: Optional[float],
+    currency: Optional[str] = "USD",
+    ttl_s: float = PRICE_CACHE_TTL_S,
+    semantic: bool = True,
+    aembed: Optional[Callable[[str], Awaitable[np.ndarray]]] = None,
+    executor=None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    cached_price_check for asyncio callers. The cache lookups (SQLite reads, the
+    DescIndex refresh and similarity search) run on executor, each on that thread's
+    store.Store connection, so the loop only awaits. The description is embedded with
+    aembed (e.g. MicroBatcher.aembed_text) and a miss goes through
+    PriceCheckService.acheck. Run it before taking any write lock.
+    """
+    loop = asyncio.get_running_loop()
+    key = cache_key(product_desc, total_amount, currency)
+    row_info = {"total_amount": total_amount, "currency": (currency or "USD").upper()}
+    found = await loop.run_in_executor(executor, lambda: _exact_hit(store.conn, key, ttl_s, row_info))
+    if found:
+        return found
+
+    query = None
+    semantic_ms = 0.0
+    if semantic:
+        t0 = time.perf_counter()
+        desc = normalize_desc(product_desc)
+        if aembed is not None:
+            query = await aembed(desc)
+        else:
+            query = await loop.run_in_executor(executor, get_embedder().embed_text, desc)
+        found = await loop.run_in_executor(
+            executor, lambda: _semantic_hit(store.conn, query, key, ttl_s, row_info, (time.perf_counter() - t0) * 1000)
         )
-        
-        text = response.text.strip()
-        print(f"DEBUG: Response: {text}")
-        
-        # Parse simple text response
-        assessment = "UNKNOWN"
-        if any(word in text.lower() for word in ["ok", "reasonable", "fair", "good"]):
-            assessment = "OK"
-        elif any(word in text.lower() for word in ["overpriced", "expensive", "high", "too much"]):
-            assessment = "OVERPRICED"
-        elif any(word in text.lower() for word in ["possibly", "maybe", "slightly"]):
-            assessment = "POSSIBLY_OVERPRICED"
-        
-        return {
-            "estimated_market_low": None,
-            "estimated_market_high": None,
-            "assessment": assessment,
-            "confidence": "LOW",
-            "explanation": text[:200],
-            "model": GEMINI_MODEL,
-        }
-
-    except Exception as e:
-        print(f"DEBUG: Error: {e}")
-        return {
-            "estimated_market_low": None,
-            "estimated_market_high": None,
-            "assessment": "UNKNOWN",
-            "confidence": "LOW",
-            "explanation": f"Error: {str(e)[:100]}",
-            "model": GEMINI_MODEL,
-        }
\ No newline at end of file
+        semantic_ms = (time.perf_counter() - t0) * 1000
+        if found:
+            return found
+
+    t0 = time.perf_counter()
+    result = await get_price_service().acheck(product_desc, vendor_name, total_amount, currency)
+    _METRICS.record("miss", llm_ms=(time.perf_counter() - t0) * 1000, semantic_ms=semantic_ms)
+    return _llm_answer(result, key, query, row_info)
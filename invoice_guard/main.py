@@ -1,54 +1,114 @@
 # main.py
 from __future__ import annotations
 
+import sys
+
+import startup
+
+# Before the imports below, so their cost shows up in the report
+if "--startup-profile" in sys.argv[1:]:
+    startup.enable()
+
 import argparse
+import contextlib
+import functools
 import json
 import os
-from dataclasses import asdict
-from typing import Any, Dict, List
+import signal
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
 from product_extraction import pick_product_desc
 
 
-from ocr import ocr_text  # your ocr.py has ocr_text()
-from extract_fields import extract_fields  # should return a dataclass or dict
+from ocr import image_sha256, ocr_cascade, ocr_version
+from batch import collect_inputs, ocr_many
+from extract_fields import EXTRACTOR_VERSION, extract_dict
 
 from store import (
-    connect,
+    Store,
+    unit_of_work,
+    after_commit,
     insert_invoice,
-    fetch_all_invoices,
-    fetch_invoice_by_id,
     upsert_embedding,
-    fetch_embeddings,
+    embedding_table_state,
     update_vendor_amount_stats,
     get_vendor_amount_stats,
     save_price_check,
+    get_cached_ocr,
+    put_cached_ocr,
 )
 
-from risk import score_invoice
-from ml.embeddings import Embedder, cosine_sim, DEFAULT_MODEL
+from risk import score_invoice_indexed, score_invoice_sharded
+from ml.embeddings import DEFAULT_MODEL, get_embedder
+from ml.neighbors import EmbeddingMatrix, nearest_neighbors
+from ml.quantize import MATRIX_CODEC
+from ml.ann import ANN_MIN_ROWS, IVFIndex, catch_up, maybe_save, open_index, replaced_on_disk, sidecar_path
 from ml.anomaly import amount_anomaly_score
 
-from llm_price_check import run_price_check
-
-
-# Load embedder ONCE per process (fixes repeated "Loading weights")
-EMBEDDER = Embedder(DEFAULT_MODEL)
-
-
-def _to_dict(obj: Any) -> Dict[str, Any]:
-    """Convert dataclass-like invoice record to dict safely."""
-    if obj is None:
-        return {}
-    if isinstance(obj, dict):
-        return obj
-    try:
-        return asdict(obj)
-    except Exception:
-        # best effort fallback
-        try:
-            return dict(obj)
-        except Exception:
-            return {}
+from llm_price_check import cached_price_check
+from sharding import ShardedIndex, ShardedStore
+from tracing import collect, count, span
+
+
+# Neighbour indexes and stores per DB path; warm workers reuse them across invoices
+_MATRICES: Dict[str, EmbeddingMatrix] = {}
+_ANN_INDEXES: Dict[str, IVFIndex] = {}
+_STORES: Dict[str, Store] = {}
+
+
+def get_store(db_path: str) -> Store:
+    key = os.path.abspath(db_path)
+    store = _STORES.get(key)
+    if store is None:
+        store = _STORES[key] = Store(db_path)
+    return store
+
+
+def _embedding_matrix(conn, db_path: str) -> EmbeddingMatrix:
+    """Cached matrix for db_path, topped up with rows other processes wrote since last use."""
+    key = os.path.abspath(db_path)
+    matrix = _MATRICES.get(key)
+    if matrix is None:
+        with startup.step("neighbors.load"):
+            matrix = _MATRICES[key] = EmbeddingMatrix.load(conn, DEFAULT_MODEL, codec=MATRIX_CODEC)
+    else:
+        matrix.refresh(conn)
+    return matrix
+
+
+def _neighbor_index(conn, db_path: str, exact: bool = False, nprobe: Optional[int] = None):
+    """
+    Exact EmbeddingMatrix for small histories (or when exact=True), otherwise the IVF
+    sidecar index. Both expose search(q, k) and add(invoice_id, vec).
+    """
+    if exact:
+        return _embedding_matrix(conn, db_path)
+
+    key = os.path.abspath(db_path)
+    index = _ANN_INDEXES.get(key)
+    if index is None:
+        matrix = _MATRICES.get(key)
+        if matrix is not None:
+            matrix.refresh(conn)
+            if matrix.size < ANN_MIN_ROWS:
+                return matrix
+        elif not os.path.exists(sidecar_path(db_path, DEFAULT_MODEL)):
+            if embedding_table_state(conn, DEFAULT_MODEL)[0] < ANN_MIN_ROWS:
+                return _embedding_matrix(conn, db_path)
+        with startup.step("ann.load"):
+            index = _ANN_INDEXES[key] = open_index(conn, db_path, DEFAULT_MODEL)
+        _MATRICES.pop(key, None)  # don't hold both copies in memory
+    elif replaced_on_disk(index, sidecar_path(db_path, DEFAULT_MODEL)):
+        # Rebuilt elsewhere (backfill_embeddings.py): switch to the new build rather than
+        # saving the old one over it
+        with startup.step("ann.load"):
+            index = _ANN_INDEXES[key] = open_index(conn, db_path, DEFAULT_MODEL)
+    else:
+        catch_up(conn, index)
+
+    if nprobe:
+        index.nprobe = nprobe
+    return index
 
 
 def _dup_prob(top_sim: float) -> float:
@@ -60,67 +120,212 @@ def _dup_prob(top_sim: float) -> float:
     return 0.0
 
 
-def run(image_path: str, db_path: str, price_check: bool = False) -> Dict[str, Any]:
-    conn = connect(db_path)
+def _cache_version() -> str:
+    return f"{ocr_version()}|ex{EXTRACTOR_VERSION}"
+
+
+def _extract(raw_text: str) -> Dict[str, Any]:
+    return extract_dict(raw_text)
+
+
+def run(
+    image_path: str,
+    db_path: str,
+    price_check: bool = False,
+    conn=None,
+    exact_search: bool = False,
+    nprobe: Optional[int] = None,
+    use_ml: bool = True,
+    timings: bool = False,
+    sharded: Optional[ShardedStore] = None,
+) -> Dict[str, Any]:
+    """
+    timings=True adds a "timings" block: milliseconds per stage (see tracing.py).
+
+    With a ShardedStore, db_path and conn are unused: the OCR cache is the catalog's and
+    the invoice is analyzed and written on its vendor's shard (see sharding.py).
+    """
+    # Warm workers pass their long-lived connection in; otherwise this thread's store connection
+    if sharded is not None:
+        conn = sharded.catalog.conn
+    elif conn is None:
+        conn = get_store(db_path).conn
+
+    with collect(timings) as trace:
+        raw_text, fields, tier = read_invoice(conn, image_path)
+        if sharded is not None:
+            shard = sharded.owner(fields.get("vendor_name"))
+            conn, db_path = shard.conn, shard.db_path
+
+        with span("index"):
+            if not use_ml:
+                index = None
+            elif sharded is not None:
+                index = ShardedIndex(sharded, lambda c, path: _neighbor_index(c, path, exact=exact_search, nprobe=nprobe))
+            else:
+                index = _neighbor_index(conn, db_path, exact=exact_search, nprobe=nprobe)
+        # Invoice row, embedding, vendor stats and price check commit together (one fsync)
+        with unit_of_work(conn):
+            out = analyze(
+                conn, db_path, raw_text, os.path.basename(image_path), index,
+                fields=fields, price_check=price_check, commit=False, use_ml=use_ml, sharded=sharded,
+            )
+    out["ocr_cache"] = "hit" if tier == "cache" else "miss"
+    out["ocr_tier"] = tier
+    if trace is not None:
+        out["timings"] = trace
+    return out
 
-    # OCR
-    raw_text = ocr_text(image_path)
 
-    # Extract structured fields
-    rec_obj = extract_fields(raw_text)
-    rec = _to_dict(rec_obj)
+def read_invoice(conn, image_path: str) -> Tuple[str, Dict[str, Any], str]:
+    """
+    OCR + field extraction -> (raw_text, fields, tier). tier is "cache" when these bytes
+    were read before (both steps skipped), else the cascade tier that served: "fast" or
+    "full" (see ocr.ocr_cascade). Commits the OCR-cache write on conn.
+    """
+    digest, raw_text, fields, tier = ocr_invoice(conn, image_path)
+    cache_ocr(conn, digest, raw_text, fields, tier)
+    return raw_text, fields, tier
+
+
+def ocr_invoice(conn, image_path: str) -> Tuple[str, str, Dict[str, Any], str]:
+    """
+    read_invoice without the cache write -> (digest, raw_text, fields, tier). Only reads
+    conn, so OCR threads never take the write lock; pass the result to cache_ocr in the
+    invoice's write transaction.
+    """
+    with span("ocr_cache"):
+        digest = image_sha256(image_path)
+        cached = get_cached_ocr(conn, digest, _cache_version(), touch=False)
+    count("ocr_cache", result="hit" if cached else "miss")
+    if cached:
+        raw_text, fields = cached
+        return digest, raw_text, fields, "cache"
+
+    with span("ocr"):  # includes extraction: the cascade judges each tier by its fields
+        raw_text, fields, tier = ocr_cascade(image_path, _extract)
+    count("ocr_tier", tier=tier)
+    return digest, raw_text, fields, tier
+
+
+def cache_ocr(conn, digest: str, raw_text: str, fields: Dict[str, Any], tier: str, commit: bool = True) -> None:
+    """Record an ocr_invoice result: a hit bumps the entry's LRU stamp, a fresh OCR is stored."""
+    with span("ocr_cache"):
+        if tier == "cache":
+            get_cached_ocr(conn, digest, _cache_version(), commit=commit)
+        else:
+            put_cached_ocr(conn, digest, _cache_version(), raw_text, fields, commit=commit)
+
+
+def analyze(
+    conn,
+    db_path: str,
+    raw_text: str,
+    source_file: str,
+    index,
+    new_emb=None,
+    fields: Optional[Dict[str, Any]] = None,
+    price_check: bool = False,
+    commit: bool = True,
+    use_ml: bool = True,
+    sharded: Optional[ShardedStore] = None,
+    price: Optional[Tuple[str, Dict[str, Any], Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Everything after OCR: extraction, risk, neighbours, anomaly, then storage.
+
+    Callers pass commit=False inside a unit_of_work so all writes land in one transaction
+    (batch mode groups a whole chunk); uncommitted rows are visible to later lookups on the
+    same connection. Batch mode also passes a precomputed embedding.
+
+    use_ml=False (--rules-only) skips the embedding, neighbour search and embedding write;
+    index may then be None. Rule-based risk and the amount anomaly still run.
+
+    With sharded, conn must be the vendor's shard and index a ShardedIndex: risk and
+    neighbour search fan out over all shards and the invoice id comes from the catalog.
+
+    price is a price check already answered by the caller, (product_desc, result,
+    save_kwargs) as from llm_price_check.acached_price_check: callers that run analyze
+    inside a shared write transaction (the API's WriteQueue) do the lookup and LLM call
+    first, so the lock is never held across the network.
+    """
+    # Extract structured fields (callers holding cached fields pass them in)
+    if fields is not None:
+        rec = dict(fields)
+    else:
+        with span("extract"):
+            rec = _extract(raw_text)
 
     # Attach raw text + source file
     rec["raw_text"] = raw_text
-    rec["source_file"] = os.path.basename(image_path)
+    rec["source_file"] = source_file
 
-    # Risk scoring uses HISTORY BEFORE inserting current invoice
-    history = fetch_all_invoices(conn)
-    risk = score_invoice(rec, history)
-
-    # ML embedding + nearest neighbors
-    new_emb = EMBEDDER.embed_text(raw_text)
-    existing = fetch_embeddings(conn, DEFAULT_MODEL)
+    # Risk scoring uses HISTORY BEFORE inserting current invoice (indexed lookups, no full scan)
+    with span("risk"):
+        risk = score_invoice_sharded(rec, sharded) if sharded is not None else score_invoice_indexed(rec, conn)
 
+    # ML embedding + nearest neighbors (exact matrix or IVF index, see _neighbor_index)
     neighbors: List[Dict[str, Any]] = []
-    top_sim = 0.0
-
-    for row in existing:
-        sim = float(cosine_sim(new_emb, row["embedding"]))
-        inv = fetch_invoice_by_id(conn, int(row["invoice_id"]))
-        if not inv:
-            continue
-        neighbors.append(
-            {
-                "invoice_id": int(row["invoice_id"]),
-                "similarity": round(sim, 4),
-                "vendor_name": inv.get("vendor_name"),
-                "invoice_number": inv.get("invoice_number"),
-                "total_amount": inv.get("total_amount"),
-                "invoice_date": inv.get("invoice_date"),
-            }
-        )
-
-    neighbors.sort(key=lambda x: x["similarity"], reverse=True)
-    if neighbors:
-        top_sim = float(neighbors[0]["similarity"])
-    neighbors = neighbors[:3]
-
-    ml_dup_prob = _dup_prob(top_sim)
+    ml_dup_prob = None
+    if use_ml:
+        if new_emb is None:
+            with span("embed"):
+                new_emb = get_embedder().embed_text(raw_text)
+
+        with span("neighbors"):
+            if isinstance(index, ShardedIndex):
+                neighbors = index.nearest(new_emb, k=3)
+            else:
+                neighbors = nearest_neighbors(conn, index, new_emb, k=3)
+        count("neighbors_scanned", getattr(index, "last_scanned", 0))
+        top_sim = float(neighbors[0]["similarity"]) if neighbors else 0.0
+
+        ml_dup_prob = _dup_prob(top_sim)
 
     # Amount anomaly
     vendor = rec.get("vendor_name")
     amount = rec.get("total_amount")
-    stats = get_vendor_amount_stats(conn, vendor) if vendor else None
-    anomaly = amount_anomaly_score(amount, stats)
-
-    # Insert invoice AFTER scoring
-    invoice_id = insert_invoice(conn, rec)
-
-    # Store embedding + vendor stats
-    upsert_embedding(conn, invoice_id, new_emb, DEFAULT_MODEL)
-    if vendor and amount is not None:
-        update_vendor_amount_stats(conn, vendor, float(amount))
+    with span("anomaly"):
+        stats = get_vendor_amount_stats(conn, vendor) if vendor else None
+        anomaly = amount_anomaly_score(amount, stats)
+
+    # The LLM call runs before any write so the DB write lock isn't held across the network
+    # Repeat questions (same or similarly worded product line, similar amount) are answered
+    # from price_checks; --rules-only keeps to the exact-key cache (no embedding)
+    price_out = None
+    if price is not None:
+        product_desc, price_out, price_save = price
+    elif price_check and os.getenv("GEMINI_API_KEY"):
+        with span("price_check"):
+            product_desc = pick_product_desc(raw_text)
+            price_out, price_save = cached_price_check(
+                conn,
+                product_desc=product_desc,
+                vendor_name=rec.get("vendor_name"),
+                total_amount=rec.get("total_amount"),
+                currency=rec.get("currency") or "USD",
+                semantic=use_ml,
+            )
+
+    with span("db_write"):
+        # Insert invoice AFTER scoring
+        invoice_id = insert_invoice(
+            conn, rec, commit=commit, invoice_id=sharded.next_id() if sharded is not None else None
+        )
+        count("db_rows_written", table="invoices")
+
+        # Store embedding + vendor stats
+        if use_ml:
+            upsert_embedding(conn, invoice_id, new_emb, DEFAULT_MODEL, commit=commit)
+            count("db_rows_written", table="invoice_embeddings")
+            index.add(invoice_id, new_emb)
+            if isinstance(index, IVFIndex):
+                # Only once the rows are committed: the sidecar must not hold rolled-back
+                # vectors or a max_rowid past rowids that will be reused
+                after_commit(conn, functools.partial(maybe_save, conn, index, db_path))
+        if vendor and amount is not None:
+            update_vendor_amount_stats(conn, vendor, float(amount), commit=commit)
+            count("db_rows_written", table="vendor_amount_stats")
 
     out: Dict[str, Any] = {
         "invoice_id": invoice_id,
@@ -134,7 +339,7 @@ def run(image_path: str, db_path: str, price_check: bool = False) -> Dict[str, A
         },
         "risk": risk,
         "ml": {
-            "duplicate_probability": round(ml_dup_prob, 3),
+            "duplicate_probability": round(ml_dup_prob, 3) if ml_dup_prob is not None else None,
             "nearest_neighbors": neighbors,
             "amount_anomaly": anomaly,
         },
@@ -142,39 +347,272 @@ def run(image_path: str, db_path: str, price_check: bool = False) -> Dict[str, A
 
     
     if price_check:
-        if not os.getenv("GEMINI_API_KEY"):
+        if price_out is None:
             out["price_check_error"] = "api is not set. Export api before using --price-check."
             return out
 
-        product_desc = pick_product_desc(raw_text)
-        price_out = run_price_check(
-            product_desc=product_desc,
-            vendor_name=rec.get("vendor_name"),
-            total_amount=rec.get("total_amount"),
-            currency=rec.get("currency") or "USD",
-        )
-        save_price_check(conn, invoice_id, product_desc, price_out)
+        with span("db_write"):
+            save_price_check(conn, invoice_id, product_desc, price_out, commit=commit, **price_save)
+        count("db_rows_written", table="price_checks")
         out["price_check"] = {"product_desc": product_desc, **price_out}
 
     return out
 
 
+def run_batch(
+    spec: str,
+    db_path: str,
+    price_check: bool = False,
+    workers: Optional[int] = None,
+    chunk_size: int = 256,
+    embed_batch: int = 64,
+    out_stream=None,
+    exact_search: bool = False,
+    nprobe: Optional[int] = None,
+    use_ml: bool = True,
+) -> int:
+    """
+    Ingest a directory / glob / file list: OCR runs in a process pool, each chunk of
+    chunk_size invoices is embedded in batched encode calls and committed as one
+    transaction. Prints one NDJSON result per file, in input order. Returns the error count.
+    """
+    out_stream = out_stream or sys.stdout
+    store = get_store(db_path)
+    conn = store.conn
+    paths = collect_inputs(spec)
+    errors = 0
+
+    def _emit(obj: Dict[str, Any]) -> None:
+        out_stream.write(json.dumps(obj) + "\n")
+        out_stream.flush()
+
+    def _flush(chunk: List[Tuple[str, str, Dict[str, Any], str]]) -> None:
+        nonlocal errors
+        if not chunk:
+            return
+        if use_ml:
+            index = _neighbor_index(conn, db_path, exact=exact_search, nprobe=nprobe)
+            embs = get_embedder().embed_texts([text for _, text, _, _ in chunk], batch_size=embed_batch)
+        else:
+            index, embs = None, [None] * len(chunk)
+        with unit_of_work(conn):  # one commit per chunk
+            for (path, text, fields, tier), emb in zip(chunk, embs):
+                try:
+                    # Nested unit = savepoint: a failure undoes this invoice's partial writes only
+                    with unit_of_work(conn), contextlib.redirect_stdout(sys.stderr):
+                        result = analyze(
+                            conn, db_path, text, os.path.basename(path), index,
+                            new_emb=emb, fields=fields, price_check=price_check, commit=False,
+                            use_ml=use_ml,
+                        )
+                    _emit({"image_path": path, **result, "ocr_cache": "hit" if tier == "cache" else "miss", "ocr_tier": tier})
+                except Exception as e:
+                    errors += 1
+                    _emit({"image_path": path, "error": f"{type(e).__name__}: {e}"})
+
+    # Cache lookups happen up front so only misses are sent to the OCR pool
+    version = _cache_version()
+    digests: Dict[str, Optional[str]] = {}
+    hits: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for path in paths:
+        try:
+            digests[path] = image_sha256(path)
+        except OSError:
+            digests[path] = None  # unreadable; OCR reports the error
+            continue
+        cached = get_cached_ocr(conn, digests[path], version, commit=False)
+        if cached:
+            hits[path] = cached
+    conn.commit()
+
+    def _ocr_results():
+        misses = iter(ocr_many([p for p in paths if p not in hits], workers=workers))
+        for path in paths:
+            if path in hits:
+                text, fields = hits[path]
+                yield path, text, fields, "cache", None
+            else:
+                _, text, fields, tier, err = next(misses)
+                yield path, text, fields, tier, err
+
+    chunk: List[Tuple[str, str, Dict[str, Any], str]] = []
+    try:
+        for path, text, fields, tier, err in _ocr_results():
+            if err is not None:
+                errors += 1
+                _emit({"image_path": path, "error": err})
+                continue
+            if tier != "cache":
+                count("ocr_tier", tier=tier)
+                if digests[path]:
+                    put_cached_ocr(conn, digests[path], version, text, fields, commit=False)
+            chunk.append((path, text, fields, tier))
+            if len(chunk) >= chunk_size:
+                _flush(chunk)
+                chunk = []
+        _flush(chunk)
+    finally:
+        store.close()
+    return errors
+
+
+def _handle_request(req: Dict[str, Any], db_path: str, conn, **run_kwargs) -> Dict[str, Any]:
+    """Process one JSON-lines request. Errors are reported per request, never fatal."""
+    req_id = req.get("id")
+    op = req.get("op", "analyze")
+    try:
+        if op == "ping":
+            return {"id": req_id, "ok": True, "result": {"pong": True}}
+        if op != "analyze":
+            raise ValueError(f"Unknown op: {op}")
+        image_path = req.get("image_path")
+        if not image_path:
+            raise ValueError("Missing image_path")
+        result = run(
+            image_path, db_path, price_check=bool(req.get("price_check")), conn=conn,
+            timings=bool(req.get("timings")), **run_kwargs
+        )
+        return {"id": req_id, "ok": True, "result": result}
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return {"id": req_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def serve(db_path: str, instream=None, outstream=None, **run_kwargs) -> None:
+    """
+    Warm worker: model + SQLite connection are loaded once, then requests are read as
+    JSON lines from stdin and answered as JSON lines on stdout.
+
+      -> {"id": "r1", "image_path": "/path/inv.jpg", "price_check": true, "timings": false}
+      <- {"id": "r1", "ok": true, "result": {...same as run()...}}
+      <- {"id": "r1", "ok": false, "error": "FileNotFoundError: ..."}
+
+    {"op": "ping"} checks liveness; {"op": "shutdown"} or EOF on stdin exits cleanly.
+    """
+    instream = instream or sys.stdin
+    outstream = outstream or sys.stdout
+    sharded = run_kwargs.get("sharded")
+    store = sharded if sharded is not None else get_store(db_path)
+    conn = sharded.catalog.conn if sharded is not None else store.conn
+
+    def _emit(obj: Dict[str, Any]) -> None:
+        outstream.write(json.dumps(obj) + "\n")
+        outstream.flush()
+
+    _emit({"event": "ready", "pid": os.getpid(), "model": DEFAULT_MODEL})
+    try:
+        for line in instream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                req = json.loads(line)
+                if not isinstance(req, dict):
+                    raise ValueError("Request must be a JSON object")
+            except ValueError as e:
+                _emit({"id": None, "ok": False, "error": f"Bad request: {e}"})
+                continue
+
+            if req.get("op") == "shutdown":
+                _emit({"id": req.get("id"), "ok": True, "result": {"shutdown": True}})
+                break
+
+            # Stray prints (e.g. llm_price_check DEBUG lines) must not corrupt the protocol
+            with contextlib.redirect_stdout(sys.stderr):
+                resp = _handle_request(req, db_path, conn, **run_kwargs)
+            _emit(resp)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="InvoiceGuard CLI (OCR + risk + embeddings + optional HF price check)"
     )
-    parser.add_argument("image_path", help="Path to invoice image (jpg/png)")
-    parser.add_argument("--db", required=True, help="Path to SQLite DB file")
+    parser.add_argument("image_path", nargs="?", help="Path to invoice image (jpg/png)")
+    parser.add_argument(
+        "--batch",
+        metavar="DIR|GLOB|FILELIST",
+        help="Ingest many invoices; prints one NDJSON result per file",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="OCR processes for --batch (default: CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Invoices per transaction for --batch")
+    parser.add_argument("--embed-batch", type=int, default=64, help="Texts per encode call for --batch")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--db", help="Path to SQLite DB file")
+    where.add_argument("--shards", metavar="DIR", help="Vendor-sharded store root (see sharding.py)")
     parser.add_argument(
         "--price-check",
         action="store_true",
         help="Run HuggingFace LLM price reasonableness check",
     )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a warm worker reading JSON-lines requests on stdin",
+    )
+
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Use exact nearest-neighbour search instead of the IVF index",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="IVF clusters scanned per query (higher = better recall, slower)",
+    )
+    parser.add_argument(
+        "--no-ml",
+        "--rules-only",
+        dest="no_ml",
+        action="store_true",
+        help="Rule-based risk only: skip embeddings and neighbour search (no model load)",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Add per-stage milliseconds to the output as a timings block",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Report per-module import and init-step times on stderr at exit",
+    )
 
     args = parser.parse_args()
-    result = run(args.image_path, args.db, price_check=args.price_check)
+    search_kwargs = {"exact_search": args.exact, "nprobe": args.nprobe, "use_ml": not args.no_ml}
+    if args.shards:
+        if args.batch:
+            parser.error("--batch needs --db; --shards works with single invoices and --serve")
+        search_kwargs["sharded"] = ShardedStore(args.shards)
+    if args.serve:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        serve(args.db, **search_kwargs)
+        return
+    if args.batch:
+        errors = run_batch(
+            args.batch,
+            args.db,
+            price_check=args.price_check,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            embed_batch=args.embed_batch,
+            **search_kwargs,
+        )
+        sys.exit(1 if errors else 0)
+    if not args.image_path:
+        parser.error("image_path is required unless --serve or --batch is given")
+    result = run(args.image_path, args.db, price_check=args.price_check, timings=args.timings, **search_kwargs)
     print(json.dumps(result, indent=2))
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        if startup.profiler():
+            print(startup.profiler().report(), file=sys.stderr)
@@ -0,0 +1,334 @@
+# ml/ann.py
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from store import embedding_table_state, fetch_embedding_matrix
+
+# Recall/latency knob: how many clusters are scanned per query (higher = better recall, slower)
+DEFAULT_NPROBE = int(os.getenv("INVOICE_GUARD_NPROBE", "8"))
+# Below this many rows exact search is already cheap, so the ANN index isn't used
+ANN_MIN_ROWS = int(os.getenv("INVOICE_GUARD_ANN_MIN_ROWS", "20000"))
+# Persist after this many incremental inserts; smaller deltas are replayed from SQLite on load
+SAVE_EVERY = int(os.getenv("INVOICE_GUARD_ANN_SAVE_EVERY", "1000"))
+# Re-cluster when the index has grown this much since the centroids were trained
+RETRAIN_GROWTH = 4.0
+
+FORMAT_VERSION = 1
+
+
+def sidecar_path(db_path: str, model_name: str) -> str:
+    """<db>.<model-slug>.ivf.npz next to the SQLite file."""
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name).strip("_")
+    return f"{os.path.abspath(db_path)}.{slug}.ivf.npz"
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _assign(centroids: np.ndarray, mat: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """Nearest centroid (by dot product) per row, chunked to bound the temp matrix."""
+    out = np.empty(mat.shape[0], dtype=np.int32)
+    for start in range(0, mat.shape[0], chunk):
+        out[start:start + chunk] = np.argmax(mat[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(mat: np.ndarray, nlist: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of at most 64 points per list."""
+    rng = np.random.default_rng(seed)
+    sample = mat
+    if mat.shape[0] > nlist * 64:
+        sample = mat[rng.choice(mat.shape[0], nlist * 64, replace=False)]
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        assign = _assign(centroids, sample)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points so no list is wasted
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index: a coarse quantizer (k-means centroids) plus one contiguous
+    vector list per centroid. A query scans only the nprobe closest lists.
+
+    Supports incremental add() as upsert_embedding runs; the centroids are retrained
+    on the next rebuild once the index has grown RETRAIN_GROWTH times.
+    """
+
+    def __init__(self, model_name: str, centroids: np.ndarray, trained_on: int):
+        self.model_name = model_name
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.dim = int(self.centroids.shape[1])
+        self.trained_on = int(trained_on)
+        self.max_rowid = 0  # last invoice_embeddings rowid reflected in the index
+        self.dirty = 0  # inserts since the last save
+        # Which build this is: a rebuild (anywhere) gets a new one, incremental saves keep it
+        self.generation = uuid.uuid4().hex
+        self.sidecar_mtime_ns = 0  # of the file as this process last saved/loaded/checked it
+        self.nprobe = DEFAULT_NPROBE
+        self.last_scanned = 0  # vectors scored by the last search (for metrics)
+
+        nlist = self.nlist
+        self._vecs: List[np.ndarray] = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self._ids: List[np.ndarray] = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._lens = np.zeros(nlist, dtype=np.int64)
+        self._where: Dict[int, int] = {}
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @property
+    def size(self) -> int:
+        return int(self._lens.sum())
+
+    # -------------------------
+    # Build / insert
+    # -------------------------
+    @classmethod
+    def build(
+        cls,
+        model_name: str,
+        ids: np.ndarray,
+        mat: np.ndarray,
+        nlist: Optional[int] = None,
+        iters: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        n = int(ids.size)
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(int(nlist), n))
+        centroids = train_centroids(mat, nlist, iters=iters, seed=seed)
+        index = cls(model_name, centroids, trained_on=n)
+        index.add_many(ids, mat)
+        index.dirty = 0
+        return index
+
+    def add_many(self, ids: np.ndarray, mat: np.ndarray) -> None:
+        if ids.size == 0:
+            return
+        assign = _assign(self.centroids, mat)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        for c in range(self.nlist):
+            rows = order[bounds[c]:bounds[c + 1]]
+            if rows.size:
+                self._append(c, ids[rows], mat[rows])
+
+    def add(self, invoice_id: int, embedding: np.ndarray) -> None:
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        if vec.size != self.dim:
+            return
+        c = int(np.argmax(self.centroids @ vec))
+        self._append(c, np.array([int(invoice_id)], dtype=np.int64), vec[None, :])
+
+    def _append(self, c: int, ids: np.ndarray, vecs: np.ndarray) -> None:
+        # Re-embedded invoices are overwritten in place in whichever list already holds them
+        fresh = np.ones(ids.size, dtype=bool)
+        for j, i in enumerate(ids.tolist()):
+            old = self._where.get(i)
+            if old is not None:
+                pos = np.flatnonzero(self._ids[old][: self._lens[old]] == i)
+                if pos.size:
+                    self._vecs[old][pos[0]] = vecs[j]
+                    fresh[j] = False
+        ids, vecs = ids[fresh], vecs[fresh]
+        if ids.size == 0:
+            return
+
+        n, need = int(self._lens[c]), int(self._lens[c]) + int(ids.size)
+        if need > self._vecs[c].shape[0]:
+            cap = max(16, need, self._vecs[c].shape[0] * 2)
+            v = np.zeros((cap, self.dim), dtype=np.float32)
+            d = np.zeros(cap, dtype=np.int64)
+            v[:n], d[:n] = self._vecs[c][:n], self._ids[c][:n]
+            self._vecs[c], self._ids[c] = v, d
+        self._vecs[c][n:need] = vecs
+        self._ids[c][n:need] = ids
+        self._lens[c] = need
+        for i in ids.tolist():
+            self._where[i] = c
+        self.dirty += int(ids.size)
+
+    # -------------------------
+    # Search
+    # -------------------------
+    def search(self, query: np.ndarray, k: int = 3, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        q = np.asarray(query, dtype=np.float32).ravel()
+        if self.size == 0 or k <= 0 or q.size != self.dim:
+            return []
+        nprobe = max(1, min(int(nprobe or self.nprobe), self.nlist))
+        csims = self.centroids @ q
+        probes = np.argpartition(-csims, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+
+        sims_parts, id_parts = [], []
+        for c in probes.tolist():
+            n = int(self._lens[c])
+            if n:
+                sims_parts.append(self._vecs[c][:n] @ q)
+                id_parts.append(self._ids[c][:n])
+        self.last_scanned = sum(p.size for p in sims_parts)
+        if not sims_parts:
+            return []
+        sims = np.concatenate(sims_parts)
+        ids = np.concatenate(id_parts)
+        k = min(k, sims.size)
+        top = np.argpartition(-sims, k - 1)[:k] if k < sims.size else np.arange(sims.size)
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(int(ids[r]), float(sims[r])) for r in top]
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def save(self, path: str) -> None:
+        lens = self._lens
+        meta = {
+            "format": FORMAT_VERSION,
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "trained_on": self.trained_on,
+            "max_rowid": self.max_rowid,
+            "generation": self.generation,
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                centroids=self.centroids,
+                lens=lens,
+                ids=np.concatenate([self._ids[c][: lens[c]] for c in range(self.nlist)]),
+                vecs=np.concatenate([self._vecs[c][: lens[c]] for c in range(self.nlist)]),
+            )
+        os.replace(tmp, path)  # atomic: readers never see a half-written index
+        self.dirty = 0
+        self.sidecar_mtime_ns = os.stat(path).st_mtime_ns
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFIndex"]:
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            with np.load(path, allow_pickle=False) as z:
+                meta = json.loads(str(z["meta"]))
+                if meta.get("format") != FORMAT_VERSION:
+                    return None
+                index = cls(meta["model_name"], z["centroids"], meta["trained_on"])
+                lens, ids, vecs = z["lens"], z["ids"], z["vecs"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        offsets = np.concatenate([[0], np.cumsum(lens)])
+        for c in range(index.nlist):
+            a, b = int(offsets[c]), int(offsets[c + 1])
+            index._vecs[c], index._ids[c] = vecs[a:b].copy(), ids[a:b].copy()
+            index._lens[c] = b - a
+            for i in index._ids[c].tolist():
+                index._where[i] = c
+        index.max_rowid = int(meta["max_rowid"])
+        index.generation = meta.get("generation", "")
+        index.sidecar_mtime_ns = mtime_ns
+        return index
+
+
+def sidecar_generation(path: str) -> Optional[str]:
+    """The generation stamped in a sidecar (reads only its meta entry); None if unreadable."""
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            return json.loads(str(z["meta"])).get("generation", "")
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def replaced_on_disk(index: IVFIndex, path: str) -> bool:
+    """
+    True when the sidecar at path is a different build than index, e.g. rebuilt by
+    backfill_embeddings.py or another process's open_index. Costs one stat() unless the
+    file changed; incremental saves of the same build only refresh the recorded mtime.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    if mtime_ns == index.sidecar_mtime_ns:
+        return False
+    generation = sidecar_generation(path)
+    if generation is None:
+        return False
+    if generation != index.generation:
+        return True
+    index.sidecar_mtime_ns = mtime_ns
+    return False
+
+
+def open_index(conn: sqlite3.Connection, db_path: str, model_name: str) -> IVFIndex:
+    """
+    Load the sidecar index for model_name, replaying rows stored since it was saved.
+    Rebuilds from invoice_embeddings when the file is missing, belongs to another model,
+    has more rows than the table (rows were deleted), or has outgrown its centroids.
+    """
+    path = sidecar_path(db_path, model_name)
+    count, max_rowid = embedding_table_state(conn, model_name)
+
+    index = IVFIndex.load(path) if os.path.exists(path) else None
+    stale = (
+        index is None
+        or index.model_name != model_name
+        or index.max_rowid > max_rowid
+        or index.size > count
+        or count > index.trained_on * RETRAIN_GROWTH
+    )
+
+    if stale:
+        ids, mat, max_rowid = fetch_embedding_matrix(conn, model_name)
+        if ids.size == 0:
+            raise ValueError(f"No embeddings stored for {model_name}")
+        index = IVFIndex.build(model_name, ids, mat)
+        index.max_rowid = max_rowid
+        index.save(path)
+        return index
+
+    catch_up(conn, index)
+    return index
+
+
+def catch_up(conn: sqlite3.Connection, index: IVFIndex) -> None:
+    """Add rows written since index.max_rowid (other processes, or unsaved inserts)."""
+    ids, mat, max_rowid = fetch_embedding_matrix(conn, index.model_name, index.max_rowid)
+    index.add_many(ids, mat)
+    index.max_rowid = max_rowid
+
+
+def maybe_save(conn: sqlite3.Connection, index: IVFIndex, db_path: str) -> bool:
+    """
+    Persist once SAVE_EVERY inserts have accumulated; smaller deltas are cheap to replay.
+    Never writes over a newer build of the sidecar: the holder should reopen it instead
+    (main._neighbor_index does on its next call).
+    """
+    if index.dirty < SAVE_EVERY:
+        return False
+    path = sidecar_path(db_path, index.model_name)
+    if replaced_on_disk(index, path):
+        return False
+    catch_up(conn, index)  # advance max_rowid past the rows we added in-process
+    index.save(path)
+    return True
@@ -3,7 +3,9 @@ from __future__ import annotations
 
 def amount_anomaly_score(amount: float | None, stats: dict | None) -> dict:
     """
-    Returns an explainable anomaly score using z-score against vendor mean/std.
+    Returns an explainable anomaly score. Uses a robust z-score (distance from the vendor
+    median in IQR-derived sigmas) when the stats carry sketch quantiles, since invoice
+    amounts are heavily right-skewed; otherwise the z-score against vendor mean/std.
     Works even with small data (but only meaningful once n>=5).
     """
     if amount is None or stats is None:
@@ -13,11 +15,21 @@ def amount_anomaly_score(amount: float | None, stats: dict | None) -> dict:
     mean = stats["mean"]
     std = stats["std"]
 
+    median, q25, q75 = stats.get("median"), stats.get("q25"), stats.get("q75")
+    if median is not None and q25 is not None and q75 is not None and q75 > q25:
+        # IQR / 1.349 estimates sigma for normal data
+        sigma = (q75 - q25) / 1.349
+        z = abs((amount - median) / sigma)
+        return _result(z, f"Robust z-score={z:.2f} vs vendor median={median:.2f}, IQR={q75 - q25:.2f} (n={n}).")
+
     if n < 2 or std == 0.0:
         return {"score": 0.0, "level": "UNKNOWN", "reason": f"Insufficient vendor history (n={n})."}
 
     z = abs((amount - mean) / std)
+    return _result(z, f"Amount z-score={z:.2f} vs vendor mean={mean:.2f}, std={std:.2f} (n={n}).")
+
 
+def _result(z: float, reason: str) -> dict:
     # Map z to 0..1-ish
     score = min(1.0, z / 6.0)
 
@@ -31,5 +43,5 @@ def amount_anomaly_score(amount: float | None, stats: dict | None) -> dict:
     return {
         "score": float(score),
         "level": level,
-        "reason": f"Amount z-score={z:.2f} vs vendor mean={mean:.2f}, std={std:.2f} (n={n})."
+        "reason": reason
     }
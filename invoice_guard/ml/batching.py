@@ -0,0 +1,144 @@
+# ml/batching.py
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAX_BATCH = int(os.getenv("INVOICE_GUARD_EMBED_MAX_BATCH", "32"))
+MAX_WAIT_MS = float(os.getenv("INVOICE_GUARD_EMBED_MAX_WAIT_MS", "5"))
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Groups concurrent embed requests into one encode() call.
+
+    A single background thread owns the model: it blocks for the first request, then
+    keeps collecting until max_batch requests are queued or max_wait_ms has passed
+    since that first one, encodes the group, and resolves each caller's future with
+    its row. A lone request waits at most max_wait_ms extra.
+
+      batcher = MicroBatcher(embedder)
+      vec = batcher.embed_text(text)            # sync, any thread
+      vec = await batcher.aembed_text(text)     # asyncio
+    """
+
+    def __init__(self, embedder, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.embedder = embedder
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._waits_ms: deque = deque(maxlen=10000)
+        self._encode_ms: deque = deque(maxlen=10000)
+        self._requests = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        if self._closed:
+            fut.set_exception(RuntimeError("MicroBatcher is closed"))
+            return fut
+        self._queue.put((text, fut, time.perf_counter()))
+        return fut
+
+    def embed_text(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aembed_text(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self) -> None:
+        """Stop the worker after the requests already queued are served."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch-size histogram and queue-wait / encode-time percentiles (ms)."""
+        with self._lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+            waits = np.asarray(self._waits_ms, dtype=np.float64)
+            encodes = np.asarray(self._encode_ms, dtype=np.float64)
+            requests = self._requests
+        batches = sum(sizes.values())
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_size_hist": sizes,
+            "queue_wait_ms": _percentiles(waits),
+            "encode_ms": _percentiles(encodes),
+            "queue_depth": self._queue.qsize(),
+        }
+
+    # -------------------------
+    # Worker
+    # -------------------------
+    def _collect(self) -> Tuple[List[Tuple[str, Future, float]], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _loop(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            # Callers that gave up (cancelled asyncio tasks) don't need a row
+            batch = [b for b in batch if b[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                embs = self.embedder.embed_texts([b[0] for b in batch], batch_size=len(batch))
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            done = time.perf_counter()
+            for i, (_, fut, _) in enumerate(batch):
+                fut.set_result(embs[i])
+
+            with self._lock:
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._waits_ms.extend((started - t) * 1000.0 for _, _, t in batch)
+                self._encode_ms.append((done - started) * 1000.0)
+
+
+def _percentiles(samples: np.ndarray) -> Optional[Dict[str, float]]:
+    if samples.size == 0:
+        return None
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
@@ -1,14 +1,32 @@
 # ml/embeddings.py
 from __future__ import annotations
+import threading
+from typing import Dict
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from startup import step
 
 DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
 class Embedder:
+    """Model weights (and torch) load on the first encode, not at construction."""
+
     def __init__(self, model_name: str = DEFAULT_MODEL):
         self.model_name = model_name
-        self.model = SentenceTransformer(model_name)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    with step("embedder.load"):
+                        from sentence_transformers import SentenceTransformer
+
+                        self._model = SentenceTransformer(self.model_name)
+        return self._model
 
     def embed_text(self, text: str) -> np.ndarray:
         # Normalize whitespace to reduce OCR jitter
@@ -16,6 +34,23 @@ class Embedder:
         emb = self.model.encode([norm], normalize_embeddings=True)[0]
         return np.asarray(emb, dtype=np.float32)
 
+    def embed_texts(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        """Encode many texts with batch_size strings per forward pass -> float32[n, dim]."""
+        norms = [" ".join((t or "").split()) for t in texts]
+        embs = self.model.encode(norms, batch_size=batch_size, normalize_embeddings=True)
+        return np.asarray(embs, dtype=np.float32)
+
+
+_EMBEDDERS: Dict[str, Embedder] = {}
+
+
+def get_embedder(model_name: str = DEFAULT_MODEL) -> Embedder:
+    """One shared Embedder per model per process (fixes repeated "Loading weights")."""
+    emb = _EMBEDDERS.get(model_name)
+    if emb is None:
+        emb = _EMBEDDERS.setdefault(model_name, Embedder(model_name))
+    return emb
+
 def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
     # embeddings are already normalized; dot == cosine
     return float(np.dot(a, b))
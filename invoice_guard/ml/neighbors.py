@@ -0,0 +1,190 @@
+# ml/neighbors.py
+from __future__ import annotations
+
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ml import quantize
+from store import (
+    fetch_embedding_codes,
+    fetch_embedding_matrix,
+    fetch_embedding_vectors,
+    fetch_invoices_by_ids,
+)
+
+
+class EmbeddingMatrix:
+    """
+    In-memory copy of invoice_embeddings for one model: a contiguous matrix plus a
+    parallel invoice-id array. Top-k is one mat-vec product + argpartition.
+
+    codec picks the in-memory representation (ml/quantize.py): f32 (default), f16, or
+    i8 with a per-row scale (about 1/4 of the float32 memory). Quantized matrices are
+    scored directly; nearest_neighbors() can re-rank their top candidates in float32.
+
+    Keep it in sync by calling add() right after store.upsert_embedding(); refresh()
+    picks up rows written by other processes (rowid > last seen).
+    """
+
+    def __init__(self, model_name: str, dim: int = 0, codec: str = "f32"):
+        self.model_name = model_name
+        self.codec = quantize.check_codec(codec)
+        self.dim = int(dim)
+        self.size = 0
+        self._mat = np.zeros((0, self.dim), dtype=quantize.dtype_of(codec))
+        self._scales = np.zeros(0, dtype=np.float32) if codec == "i8" else None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._row_of: Dict[int, int] = {}
+        self._last_rowid = 0
+        self.last_scanned = 0  # rows scored by the last search (for metrics)
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection, model_name: str, codec: str = "f32") -> "EmbeddingMatrix":
+        m = cls(model_name, codec=codec)
+        m.refresh(conn)
+        return m
+
+    # -------------------------
+    # Sync
+    # -------------------------
+    def refresh(self, conn: sqlite3.Connection) -> int:
+        """Append rows stored since the last load. Returns how many rows were read."""
+        if self.codec == "f32":
+            ids, mat, max_rowid = fetch_embedding_matrix(conn, self.model_name, self._last_rowid)
+            scales = None
+        else:
+            ids, mat, scales, max_rowid = fetch_embedding_codes(
+                conn, self.model_name, self.codec, self._last_rowid
+            )
+        self._last_rowid = max_rowid
+        if ids.size and self.size == 0 and not self._row_of:
+            # Fast path for the initial load: adopt the decoded matrix as-is
+            self.dim = mat.shape[1]
+            self._mat, self._scales, self._ids, self.size = mat, scales, ids.copy(), int(ids.size)
+            self._row_of = {int(i): r for r, i in enumerate(ids.tolist())}
+            return int(ids.size)
+        for r, i in enumerate(ids.tolist()):
+            self._put(i, mat[r], scales[r] if scales is not None else None)
+        return int(ids.size)
+
+    def add(self, invoice_id: int, embedding: np.ndarray) -> None:
+        """Insert or overwrite one row (mirrors upsert_embedding semantics)."""
+        codes, scales = quantize.quantize(np.asarray(embedding, dtype=np.float32).ravel(), self.codec)
+        self._put(invoice_id, codes, scales[0] if scales is not None else None)
+
+    def _put(self, invoice_id: int, codes: np.ndarray, scale: Optional[float]) -> None:
+        if self.dim == 0:
+            self.dim = int(codes.size)
+            self._mat = np.zeros((0, self.dim), dtype=self._mat.dtype)
+        if codes.size != self.dim:
+            return  # different model/dim; the DB row is still stored, just not searchable here
+
+        invoice_id = int(invoice_id)
+        row = self._row_of.get(invoice_id)
+        if row is None:
+            if self.size == self._mat.shape[0]:
+                self._grow()
+            row = self.size
+            self._ids[row] = invoice_id
+            self._row_of[invoice_id] = row
+            self.size += 1
+        self._mat[row] = codes
+        if self._scales is not None:
+            self._scales[row] = scale
+
+    def _grow(self) -> None:
+        cap = max(1024, self._mat.shape[0] * 2)
+        mat = np.zeros((cap, self.dim), dtype=self._mat.dtype)
+        ids = np.zeros(cap, dtype=np.int64)
+        mat[: self.size] = self._mat[: self.size]
+        ids[: self.size] = self._ids[: self.size]
+        self._mat, self._ids = mat, ids
+        if self._scales is not None:
+            scales = np.zeros(cap, dtype=np.float32)
+            scales[: self.size] = self._scales[: self.size]
+            self._scales = scales
+
+    # -------------------------
+    # Search
+    # -------------------------
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._mat[: self.size]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self.size]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the live rows (codes + scales + ids)."""
+        n = self.matrix.nbytes + self.ids.nbytes
+        return n + (self._scales[: self.size].nbytes if self._scales is not None else 0)
+
+    def search(self, query: np.ndarray, k: int = 3) -> List[Tuple[int, float]]:
+        """Top-k by cosine (embeddings are normalized, so dot == cosine); exact for f32."""
+        if self.size == 0 or k <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32).ravel()
+        if q.size != self.dim:
+            return []
+        sims = quantize.scores(self.matrix, self._scales, q)
+        self.last_scanned = self.size
+        k = min(k, self.size)
+        top = np.argpartition(-sims, k - 1)[:k] if k < self.size else np.arange(self.size)
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(int(self._ids[r]), float(sims[r])) for r in top]
+
+
+def nearest_neighbors(
+    conn: sqlite3.Connection,
+    matrix: EmbeddingMatrix,
+    query: np.ndarray,
+    k: int = 3,
+    rerank: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Top-k neighbours with invoice metadata from one batched IN (...) query.
+    Over-fetches a little so orphaned embeddings (no invoice row) don't shrink the result.
+
+    For a quantized EmbeddingMatrix the top k * 2 * rerank candidates are re-scored
+    against the stored vectors (float32 when stored as f32); rerank=0 disables it.
+    """
+    rerank = quantize.RERANK if rerank is None else rerank
+    if getattr(matrix, "codec", "f32") != "f32" and rerank > 0:
+        hits = rerank_stored(conn, matrix.model_name, query, matrix.search(query, k * 2 * rerank), k * 2)
+    else:
+        hits = matrix.search(query, k * 2)
+    meta = fetch_invoices_by_ids(conn, [i for i, _ in hits])
+
+    out: List[Dict[str, Any]] = []
+    for invoice_id, sim in hits:
+        inv = meta.get(invoice_id)
+        if not inv:
+            continue
+        out.append(
+            {
+                "invoice_id": invoice_id,
+                "similarity": round(sim, 4),
+                "vendor_name": inv.get("vendor_name"),
+                "invoice_number": inv.get("invoice_number"),
+                "total_amount": inv.get("total_amount"),
+                "invoice_date": inv.get("invoice_date"),
+            }
+        )
+        if len(out) >= k:
+            break
+    return out
+
+
+def rerank_stored(
+    conn: sqlite3.Connection, model_name: str, query: np.ndarray, hits: List[Tuple[int, float]], k: int
+) -> List[Tuple[int, float]]:
+    """Re-score candidate (invoice_id, sim) pairs against the vectors in the DB; keep the top k."""
+    q = np.asarray(query, dtype=np.float32).ravel()
+    vecs = fetch_embedding_vectors(conn, model_name, [i for i, _ in hits])
+    rescored = [(i, float(vecs[i] @ q) if i in vecs and vecs[i].size == q.size else s) for i, s in hits]
+    rescored.sort(key=lambda h: -h[1])
+    return rescored[:k]
@@ -0,0 +1,103 @@
+# ml/quantize.py
+from __future__ import annotations
+
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Embedding storage codecs:
+#   f32  - float32, 4 bytes/dim (lossless)
+#   f16  - float16, 2 bytes/dim
+#   i8   - int8 symmetric scalar quantization, 1 byte/dim + one float32 scale per vector:
+#          v ~= codes * scale, scale = max|v| / 127
+# Normalized sentence embeddings have small, evenly spread components, so i8 keeps
+# cosine ranking nearly intact at a quarter of the memory (see ml/scripts/quant_recall.py).
+
+CODECS = ("f32", "f16", "i8")
+_DTYPES = {"f32": np.float32, "f16": np.float16, "i8": np.int8}
+
+# Codec for newly written invoice_embeddings rows (existing rows keep theirs)
+STORAGE_CODEC = os.getenv("INVOICE_GUARD_EMBED_CODEC", "f32")
+# Codec of the in-memory search matrix; anything but f32 trades a little recall for memory
+MATRIX_CODEC = os.getenv("INVOICE_GUARD_MATRIX_CODEC", "f32")
+# With a quantized matrix, re-score the top k * RERANK candidates against stored vectors (0 = off)
+RERANK = int(os.getenv("INVOICE_GUARD_RERANK", "4"))
+
+# Rows widened per BLAS call when scoring a quantized matrix; small enough to stay in cache
+SCORE_CHUNK = 1024
+
+
+def check_codec(codec: str) -> str:
+    if codec not in _DTYPES:
+        raise ValueError(f"Unknown embedding codec {codec!r}; expected one of {CODECS}")
+    return codec
+
+
+def dtype_of(codec: str):
+    return _DTYPES[check_codec(codec)]
+
+
+def bytes_per_vector(codec: str, dim: int) -> int:
+    """Blob size for one vector (the i8 scale lives in its own column)."""
+    return int(dim) * np.dtype(dtype_of(codec)).itemsize
+
+
+def quantize(mat: np.ndarray, codec: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """float32[n, dim] -> (codes[n, dim], scales float32[n] for i8 else None)."""
+    mat = np.asarray(mat, dtype=np.float32)
+    if codec == "i8":
+        squeeze = mat.ndim == 1
+        m = mat.reshape(1, -1) if squeeze else mat
+        scales = np.abs(m).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(m / scales[:, None]), -127, 127).astype(np.int8)
+        scales = scales.astype(np.float32)
+        return (codes[0], scales[:1]) if squeeze else (codes, scales)
+    return mat.astype(dtype_of(codec), copy=False), None
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    out = np.asarray(codes).astype(np.float32)
+    if scales is not None:
+        out *= np.asarray(scales, dtype=np.float32).reshape(-1, 1) if out.ndim == 2 else scales[0]
+    return out
+
+
+def encode(vec: np.ndarray, codec: str) -> Tuple[bytes, Optional[float]]:
+    """One vector -> (blob, scale or None)."""
+    codes, scales = quantize(np.asarray(vec, dtype=np.float32).ravel(), codec)
+    return codes.tobytes(order="C"), (float(scales[0]) if scales is not None else None)
+
+
+def decode(blob: bytes, codec: str, scale: Optional[float] = None) -> np.ndarray:
+    """Blob -> float32 vector. f32 blobs come back as a read-only view, no copy."""
+    arr = np.frombuffer(blob, dtype=dtype_of(codec))
+    if codec == "f32":
+        return arr
+    out = arr.astype(np.float32)
+    if codec == "i8":
+        out *= np.float32(scale if scale is not None else 1.0)
+    return out
+
+
+def scores(codes: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """
+    codes[n, dim] @ query -> float32[n], without materializing a float32 copy of the
+    matrix: rows are widened SCORE_CHUNK at a time into one reused scratch block for the
+    BLAS call, and i8 rows are rescaled afterwards (the scale factors out of the dot product).
+    """
+    q = np.asarray(query, dtype=np.float32).ravel()
+    if codes.dtype == np.float32:
+        return codes @ q
+    n = codes.shape[0]
+    out = np.empty(n, dtype=np.float32)
+    scratch = np.empty((min(n, SCORE_CHUNK), codes.shape[1]), dtype=np.float32)
+    for start in range(0, n, SCORE_CHUNK):
+        stop = min(n, start + SCORE_CHUNK)
+        block = scratch[: stop - start]
+        block[...] = codes[start:stop]
+        np.dot(block, q, out=out[start:stop])
+    if scales is not None:
+        out *= scales[:n]
+    return out
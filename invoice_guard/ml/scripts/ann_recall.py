@@ -0,0 +1,88 @@
+# ml/scripts/ann_recall.py
+"""
+Recall/latency check: IVF index vs exact EmbeddingMatrix search.
+
+    python ml/scripts/ann_recall.py --db data/invoices.db
+    python ml/scripts/ann_recall.py --synthetic 200000 --nprobe 1 4 8 16 32
+
+With --db the stored vectors for --model are used and queries are perturbed copies of
+stored rows (like a re-scan of a known invoice). --synthetic uses clustered random vectors.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from store import connect, fetch_embedding_matrix  # noqa: E402
+from ml.ann import IVFIndex  # noqa: E402
+from ml.embeddings import DEFAULT_MODEL  # noqa: E402
+from ml.neighbors import EmbeddingMatrix  # noqa: E402
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def synthetic(n: int, dim: int, clusters: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = _unit(rng.standard_normal((clusters, dim)))
+    labels = rng.integers(0, clusters, n)
+    mat = _unit(centers[labels] + 0.35 * rng.standard_normal((n, dim)) / np.sqrt(dim) * 8)
+    return np.arange(1, n + 1, dtype=np.int64), mat
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare IVF recall and latency against exact search")
+    ap.add_argument("--db")
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--synthetic", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = ap.parse_args()
+
+    if args.db:
+        ids, mat, _ = fetch_embedding_matrix(connect(args.db), args.model)
+        if ids.size == 0:
+            sys.exit(f"No embeddings for {args.model} in {args.db}")
+    else:
+        ids, mat = synthetic(args.synthetic, args.dim, clusters=max(8, args.synthetic // 500))
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(ids.size, min(args.queries, ids.size), replace=False)
+    queries = _unit(mat[picks] + 0.02 * rng.standard_normal(mat[picks].shape).astype(np.float32))
+
+    exact = EmbeddingMatrix("recall-check")
+    exact._mat, exact._ids, exact.dim, exact.size = mat, ids, mat.shape[1], int(ids.size)
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(args.model, ids, mat)
+    print(f"n={ids.size:,} dim={mat.shape[1]} nlist={index.nlist} build={time.perf_counter() - t0:.2f}s")
+
+    truth, t_exact = [], 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        truth.append({i for i, _ in exact.search(q, args.k)})
+        t_exact += time.perf_counter() - t0
+    print(f"exact        p_avg={t_exact / len(queries) * 1000:8.3f}ms  recall@{args.k}=1.000")
+
+    for nprobe in args.nprobe:
+        hit, t_ann = 0, 0.0
+        for q, want in zip(queries, truth):
+            t0 = time.perf_counter()
+            got = {i for i, _ in index.search(q, args.k, nprobe=nprobe)}
+            t_ann += time.perf_counter() - t0
+            hit += len(got & want)
+        recall = hit / sum(len(t) for t in truth)
+        print(f"nprobe={nprobe:<4}  p_avg={t_ann / len(queries) * 1000:8.3f}ms  recall@{args.k}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
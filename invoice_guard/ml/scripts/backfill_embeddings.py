@@ -0,0 +1,256 @@
+# ml/scripts/backfill_embeddings.py
+"""
+Embed every invoice that has no vector for --model yet: history ingested with
+--rules-only, or all of it after a model switch (invoice_embeddings is keyed by
+model_name, so a new DEFAULT_MODEL starts with no vectors at all).
+
+    python ml/scripts/backfill_embeddings.py --db data/invoices.db
+    python ml/scripts/backfill_embeddings.py --db data/invoices.db --model sentence-transformers/all-mpnet-base-v2
+
+To migrate models, backfill the new one first, then change DEFAULT_MODEL.
+
+invoices.raw_text is read in id order, --chunk rows at a time. Reading, encoding
+(--batch-size texts per forward pass) and writing overlap in three threads. Each chunk
+is written with one executemany upsert. The chunk's last id goes into
+embedding_backfill in the same short transaction, so an interrupted run resumes after
+the last committed chunk. Reads don't hold a snapshot between chunks, and writes wait
+on busy_timeout, so live ingestion keeps running alongside. Rows inserted during the
+run are picked up by the last chunks.
+
+When done, the IVF sidecar for the model is rebuilt, but only once the table is big
+enough for main.py to use it. Running processes pick the new and re-embedded (--force)
+rows up incrementally, and switch to the rebuilt sidecar on their next lookup: it is
+stamped with a new generation, and an older in-memory build is never saved over it.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from store import (  # noqa: E402
+    _statements,
+    connect,
+    embedding_table_state,
+    fetch_embedding_matrix,
+    unit_of_work,
+    upsert_embeddings,
+)
+from ml.ann import ANN_MIN_ROWS, IVFIndex, sidecar_path  # noqa: E402
+from ml.embeddings import DEFAULT_MODEL, get_embedder  # noqa: E402
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embedding_backfill (
+  model_name TEXT PRIMARY KEY,
+  last_id INTEGER NOT NULL,  -- every invoice with id <= last_id has been handled
+  rows_done INTEGER NOT NULL DEFAULT 0,
+  updated_at REAL NOT NULL
+);
+"""
+
+BUSY_TIMEOUT_MS = 30000  # wait this long for a live writer's transaction instead of failing
+
+_DONE = object()
+
+
+def read_chunks(conn, model: str, after_id: int, chunk: int, force: bool = False) -> Iterator[Tuple[int, int, List[int], List[str]]]:
+    """(last id scanned, rows scanned, ids to embed, their raw_text) per id-ordered chunk."""
+    while True:
+        rows = conn.execute(
+            """
+            SELECT i.id, i.raw_text,
+                   EXISTS (SELECT 1 FROM invoice_embeddings e WHERE e.invoice_id = i.id AND e.model_name = ?) AS has_vec
+            FROM invoices i
+            WHERE i.id > ?
+            ORDER BY i.id
+            LIMIT ?
+            """,
+            (model, after_id, chunk),
+        ).fetchall()
+        if not rows:
+            return
+        after_id = int(rows[-1]["id"])
+        todo = [r for r in rows if force or not r["has_vec"]]
+        yield after_id, len(rows), [int(r["id"]) for r in todo], [r["raw_text"] or "" for r in todo]
+
+
+def load_checkpoint(conn, model: str) -> Tuple[int, int]:
+    row = conn.execute("SELECT last_id, rows_done FROM embedding_backfill WHERE model_name = ?", (model,)).fetchone()
+    return (int(row[0]), int(row[1])) if row else (0, 0)
+
+
+def _save_checkpoint(conn, model: str, last_id: int, rows_done: int) -> None:
+    conn.execute(
+        "INSERT INTO embedding_backfill (model_name, last_id, rows_done, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(model_name) DO UPDATE SET last_id = excluded.last_id, rows_done = excluded.rows_done, "
+        "updated_at = excluded.updated_at",
+        (model, last_id, rows_done, time.time()),
+    )
+
+
+class _Progress:
+    def __init__(self, total: int, every_s: float):
+        self.total = total
+        self.every_s = every_s
+        self.scanned = self.embedded = 0
+        self.t0 = self._last = time.perf_counter()
+
+    def update(self, scanned: int, embedded: int, force: bool = False) -> None:
+        self.scanned += scanned
+        self.embedded += embedded
+        now = time.perf_counter()
+        if not force and now - self._last < self.every_s:
+            return
+        self._last = now
+        elapsed = max(now - self.t0, 1e-9)
+        left = max(self.total - self.scanned, 0)
+        eta = left / (self.scanned / elapsed) if self.scanned else float("inf")
+        print(
+            f"scanned {self.scanned:,}/{self.total:,}  embedded {self.embedded:,}  "
+            f"{self.embedded / elapsed:,.0f} rows/s  ETA {_fmt_eta(eta)}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def _fmt_eta(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "?"
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}"
+
+
+def backfill(
+    db_path: str,
+    model: str = DEFAULT_MODEL,
+    chunk: int = 2048,
+    batch_size: int = 256,
+    codec: Optional[str] = None,
+    restart: bool = False,
+    force: bool = False,
+    progress_s: float = 5.0,
+) -> int:
+    """Returns the number of vectors written; resumes from the model's checkpoint unless restart."""
+    conn = connect(db_path)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    with unit_of_work(conn):
+        for stmt in _statements(CHECKPOINT_SCHEMA):
+            conn.execute(stmt)
+        if restart:
+            conn.execute("DELETE FROM embedding_backfill WHERE model_name = ?", (model,))
+    start_id, rows_done = load_checkpoint(conn, model)
+    total = conn.execute("SELECT COUNT(*) FROM invoices WHERE id > ?", (start_id,)).fetchone()[0]
+    if start_id:
+        print(f"resuming {model} after invoice id {start_id} ({rows_done:,} vectors written before)", file=sys.stderr)
+
+    embedder = get_embedder(model)
+    progress = _Progress(total, progress_s)
+    to_encode: "queue.Queue" = queue.Queue(maxsize=2)
+    to_write: "queue.Queue" = queue.Queue(maxsize=2)
+    errors: List[BaseException] = []
+
+    def reader() -> None:
+        rconn = connect(db_path)
+        try:
+            for item in read_chunks(rconn, model, start_id, chunk, force):
+                to_encode.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            rconn.close()
+            to_encode.put(_DONE)
+
+    def writer() -> None:
+        nonlocal rows_done
+        wconn = connect(db_path)
+        wconn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        try:
+            while True:
+                item = to_write.get()
+                if item is _DONE:
+                    return
+                last_id, scanned, ids, mat = item
+                with unit_of_work(wconn):  # one short write transaction per chunk
+                    if ids:
+                        upsert_embeddings(wconn, ids, mat, model, commit=False, codec=codec)
+                    rows_done += len(ids)
+                    _save_checkpoint(wconn, model, last_id, rows_done)
+                progress.update(scanned, len(ids))
+        except BaseException as e:
+            errors.append(e)
+            while to_write.get() is not _DONE:  # unblock the encoder
+                pass
+        finally:
+            wconn.close()
+
+    threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=writer, daemon=True)]
+    written_before = rows_done
+    for t in threads:
+        t.start()
+    try:
+        while not errors:
+            item = to_encode.get()
+            if item is _DONE:
+                break
+            last_id, scanned, ids, texts = item
+            mat = embedder.embed_texts(texts, batch_size=batch_size) if texts else None
+            to_write.put((last_id, scanned, ids, mat))
+    finally:
+        to_write.put(_DONE)
+        threads[1].join()
+    if errors:
+        raise errors[0]
+    progress.update(0, 0, force=True)
+
+    rebuild_index(conn, db_path, model)
+    conn.close()
+    return rows_done - written_before
+
+
+def rebuild_index(conn, db_path: str, model: str) -> None:
+    """Retrain the model's IVF sidecar from scratch (the backfill changed the data it was fit on)."""
+    n, _ = embedding_table_state(conn, model)
+    path = sidecar_path(db_path, model)
+    if n < ANN_MIN_ROWS and not os.path.exists(path):
+        print(f"{n:,} vectors for {model}: below ANN_MIN_ROWS, exact search is used; no index built", file=sys.stderr)
+        return
+    t0 = time.perf_counter()
+    ids, mat, max_rowid = fetch_embedding_matrix(conn, model)
+    index = IVFIndex.build(model, ids, mat)
+    index.max_rowid = max_rowid
+    index.save(path)
+    print(f"rebuilt {path}: n={ids.size:,} nlist={index.nlist} in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Backfill invoice embeddings for a model (resumable)")
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--chunk", type=int, default=2048, help="Invoices read and committed per step")
+    ap.add_argument("--batch-size", type=int, default=256, help="Texts per encode forward pass")
+    ap.add_argument("--codec", choices=("f32", "f16", "i8"), default=None, help="Storage codec (default: INVOICE_GUARD_EMBED_CODEC)")
+    ap.add_argument("--restart", action="store_true", help="Ignore the checkpoint and scan from the first invoice")
+    ap.add_argument("--force", action="store_true", help="Re-embed rows that already have a vector (e.g. to change codec)")
+    ap.add_argument("--progress", type=float, default=5.0, help="Seconds between progress lines")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        n = backfill(
+            args.db, args.model, chunk=args.chunk, batch_size=args.batch_size, codec=args.codec,
+            restart=args.restart, force=args.force, progress_s=args.progress,
+        )
+    except KeyboardInterrupt:
+        sys.exit("interrupted; run again to resume after the last committed chunk")
+    print(f"wrote {n:,} vectors for {args.model} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
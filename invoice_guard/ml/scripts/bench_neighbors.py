@@ -0,0 +1,123 @@
+# ml/scripts/bench_neighbors.py
+"""
+Benchmark nearest-neighbour search: legacy per-row loop vs EmbeddingMatrix.
+
+    python ml/scripts/bench_neighbors.py --sizes 10000 100000 1000000
+
+Each size gets a throwaway SQLite DB filled with random unit vectors. The legacy path
+(fetch_embeddings + cosine_sim + fetch_invoice_by_id per row) is skipped above --legacy-max
+because it takes minutes at 1M rows.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from store import connect, fetch_embeddings, fetch_invoice_by_id, _to_blob  # noqa: E402
+from ml.neighbors import EmbeddingMatrix, nearest_neighbors  # noqa: E402
+
+MODEL = "bench-model"
+
+
+def _fill(conn, n: int, dim: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    chunk = 50_000
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        vecs = rng.standard_normal((m, dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        ids = range(start + 1, start + m + 1)
+        conn.executemany(
+            "INSERT INTO invoices (id, vendor_name, invoice_number, total_amount) VALUES (?, ?, ?, ?)",
+            ((i, f"Vendor {i % 500}", f"INV-{i:07d}", float(i % 997)) for i in ids),
+        )
+        conn.executemany(
+            "INSERT INTO invoice_embeddings (invoice_id, model_name, dim, embedding) VALUES (?, ?, ?, ?)",
+            ((i, MODEL, dim, _to_blob(v)) for i, v in zip(ids, vecs)),
+        )
+        conn.commit()
+
+
+def _legacy(conn, q: np.ndarray) -> list:
+    neighbors = []
+    for row in fetch_embeddings(conn, MODEL):
+        sim = float(np.dot(q, row["embedding"]))
+        inv = fetch_invoice_by_id(conn, int(row["invoice_id"]))
+        if inv:
+            neighbors.append((int(row["invoice_id"]), sim))
+    neighbors.sort(key=lambda x: x[1], reverse=True)
+    return neighbors[:3]
+
+
+def bench(n: int, dim: int, queries: int, legacy_max: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = connect(os.path.join(tmp, "bench.db"))
+        _fill(conn, n, dim)
+
+        rng = np.random.default_rng(1)
+        qs = rng.standard_normal((queries, dim)).astype(np.float32)
+        qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+        t0 = time.perf_counter()
+        matrix = EmbeddingMatrix.load(conn, MODEL)
+        load_s = time.perf_counter() - t0
+
+        search_ms = []
+        for q in qs:
+            t0 = time.perf_counter()
+            nearest_neighbors(conn, matrix, q, k=3)
+            search_ms.append((time.perf_counter() - t0) * 1000)
+
+        out = {
+            "n": n,
+            "dim": dim,
+            "matrix_mb": round(matrix.matrix.nbytes / 1e6, 1),
+            "load_s": round(load_s, 3),
+            "search_ms_p50": round(statistics.median(search_ms), 3),
+            "search_ms_max": round(max(search_ms), 3),
+            "legacy_ms": None,
+        }
+        if n <= legacy_max:
+            t0 = time.perf_counter()
+            legacy = _legacy(conn, qs[0])
+            out["legacy_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            fast = matrix.search(qs[0], 3)
+            out["same_top3"] = [i for i, _ in legacy] == [i for i, _ in fast]
+        conn.close()
+        return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark vectorized neighbour search")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=20)
+    ap.add_argument("--legacy-max", type=int, default=100_000)
+    ap.add_argument("--json", help="Write results to this file")
+    args = ap.parse_args()
+
+    results = []
+    for n in args.sizes:
+        r = bench(n, args.dim, args.queries, args.legacy_max)
+        results.append(r)
+        print(
+            f"n={r['n']:>9,}  matrix={r['matrix_mb']:>7.1f}MB  load={r['load_s']:>7.3f}s  "
+            f"search p50={r['search_ms_p50']:>8.3f}ms  legacy={r['legacy_ms']}ms"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# ml/scripts/quant_recall.py
+"""
+Memory/recall check: quantized EmbeddingMatrix codecs (f16, i8) vs the float32 path.
+
+    python ml/scripts/quant_recall.py --synthetic 100000
+    python ml/scripts/quant_recall.py --db data/invoices.db --rerank 0 4
+
+Vectors are written to a scratch SQLite DB as f32 rows (so re-ranking has the originals),
+then loaded with each matrix codec. Queries are perturbed copies of stored rows.
+Reports matrix memory, load time, per-query latency and recall@k against exact float32.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from store import connect, fetch_embedding_matrix, _to_blob  # noqa: E402
+from ml.embeddings import DEFAULT_MODEL  # noqa: E402
+from ml.neighbors import EmbeddingMatrix, rerank_stored  # noqa: E402
+from ml.quantize import CODECS, bytes_per_vector  # noqa: E402
+from ml.scripts.ann_recall import _unit, synthetic  # noqa: E402
+
+
+def _scratch_db(ids: np.ndarray, mat: np.ndarray, model: str) -> str:
+    path = os.path.join(tempfile.mkdtemp(prefix="quant_recall_"), "vectors.db")
+    conn = connect(path)
+    conn.executemany(
+        "INSERT INTO invoice_embeddings (invoice_id, model_name, dim, embedding, codec) VALUES (?, ?, ?, ?, 'f32')",
+        ((int(i), model, mat.shape[1], _to_blob(v)) for i, v in zip(ids, mat)),
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare quantized embedding matrices against float32")
+    ap.add_argument("--db")
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--synthetic", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--rerank", type=int, nargs="+", default=[0, 4])
+    args = ap.parse_args()
+
+    if args.db:
+        ids, mat, _ = fetch_embedding_matrix(connect(args.db), args.model)
+        if ids.size == 0:
+            sys.exit(f"No embeddings for {args.model} in {args.db}")
+    else:
+        ids, mat = synthetic(args.synthetic, args.dim, clusters=max(8, args.synthetic // 500))
+    path = _scratch_db(ids, mat, args.model)
+    conn = connect(path)
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(ids.size, min(args.queries, ids.size), replace=False)
+    queries = _unit(mat[picks] + 0.02 * rng.standard_normal(mat[picks].shape).astype(np.float32))
+
+    dim = mat.shape[1]
+    print(f"n={ids.size:,} dim={dim} k={args.k}")
+    truth = None
+    for codec in CODECS:
+        t0 = time.perf_counter()
+        matrix = EmbeddingMatrix.load(conn, args.model, codec=codec)
+        t_load = time.perf_counter() - t0
+        if truth is None:
+            truth = [{i for i, _ in matrix.search(q, args.k)} for q in queries]
+
+        for rerank in args.rerank if codec != "f32" else [0]:
+            hit, t_q = 0, 0.0
+            for q, want in zip(queries, truth):
+                t0 = time.perf_counter()
+                if rerank:
+                    hits = rerank_stored(conn, args.model, q, matrix.search(q, args.k * rerank), args.k)
+                else:
+                    hits = matrix.search(q, args.k)
+                t_q += time.perf_counter() - t0
+                hit += len({i for i, _ in hits} & want)
+            recall = hit / sum(len(t) for t in truth)
+            print(
+                f"{codec:<4} rerank={rerank:<2} mem={matrix.nbytes / 2**20:8.1f}MiB "
+                f"blob={bytes_per_vector(codec, dim):5d}B/row load={t_load:6.2f}s "
+                f"p_avg={t_q / len(queries) * 1000:7.3f}ms recall@{args.k}={recall:.3f}"
+            )
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# ml/sketch.py
+from __future__ import annotations
+
+import math
+import random
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang, Liberty 2016): a stack of compactors where level h
+    holds items of weight 2**h. When a level overflows it is sorted and every other item
+    is promoted. Rank error is ~1.7/k with O(k) memory, and sketches merge losslessly
+    with respect to that bound.
+
+    Nothing is compacted while n <= k, so quantiles of small vendors are exact.
+    """
+
+    C = 2.0 / 3.0
+
+    def __init__(self, k: int = 200):
+        self.k = int(k)
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+
+    # -------------------------
+    # Updates
+    # -------------------------
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return int(math.ceil(self.k * self.C ** depth)) + 1
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def update(self, x: float) -> None:
+        self.levels[0].append(float(x))
+        self.n += 1
+        if sum(len(lv) for lv in self.levels) >= self._max_size():
+            self._compress()
+
+    def _compress(self) -> None:
+        for h in range(len(self.levels)):
+            if len(self.levels[h]) >= self._capacity(h):
+                if h + 1 >= len(self.levels):
+                    self.levels.append([])
+                lv = sorted(self.levels[h])
+                keep = [lv.pop()] if len(lv) % 2 else []  # odd one out stays at this level
+                offset = random.getrandbits(1)
+                self.levels[h + 1].extend(lv[offset::2])
+                self.levels[h] = keep
+                return
+
+    @classmethod
+    def from_values(cls, values: List[float], k: int = 200) -> "KLLSketch":
+        """Sketch of a whole batch: it enters level 0 at once and is compacted by merge()."""
+        batch = cls(k)
+        batch.levels = [[float(x) for x in values]]
+        batch.n = len(batch.levels[0])
+        sk = cls(k)
+        sk.merge(batch)
+        return sk
+
+    def merge(self, other: "KLLSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, lv in enumerate(other.levels):
+            self.levels[h].extend(lv)
+        self.n += other.n
+        while sum(len(lv) for lv in self.levels) >= self._max_size():
+            before = sum(len(lv) for lv in self.levels)
+            self._compress()
+            if sum(len(lv) for lv in self.levels) >= before:
+                break
+
+    # -------------------------
+    # Queries
+    # -------------------------
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Item at weighted rank floor(q * n) in sorted order; for an exact sketch
+        quantile(0.5) == sorted(items)[n // 2], matching the old median-by-sort.
+        """
+        if self.n == 0:
+            return None
+        items = np.concatenate([np.asarray(lv, dtype=np.float64) for lv in self.levels])
+        weights = np.concatenate([np.full(len(lv), 1 << h, dtype=np.int64) for h, lv in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cum = np.cumsum(weights[order])
+        target = int(math.floor(min(max(q, 0.0), 1.0) * cum[-1]))
+        idx = int(np.searchsorted(cum, target, side="right"))
+        return float(items[order[min(idx, len(order) - 1)]])
+
+    def quantiles(self, qs: List[float]) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+    # -------------------------
+    # Serialization: <k, n, levels> header, level lengths, then float64 items
+    # -------------------------
+    def to_bytes(self) -> bytes:
+        lens = [len(lv) for lv in self.levels]
+        header = struct.pack(f"<IQI{len(lens)}I", self.k, self.n, len(lens), *lens)
+        flat = [x for lv in self.levels for x in lv]
+        return header + np.asarray(flat, dtype="<f8").tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "KLLSketch":
+        k, n, nlev = struct.unpack_from("<IQI", blob, 0)
+        off = struct.calcsize("<IQI")
+        lens = struct.unpack_from(f"<{nlev}I", blob, off)
+        off += 4 * nlev
+        flat = np.frombuffer(blob, dtype="<f8", offset=off).tolist()
+        sk = cls(k)
+        sk.n = n
+        sk.levels, pos = [], 0
+        for ln in lens:
+            sk.levels.append(flat[pos:pos + ln])
+            pos += ln
+        return sk
@@ -1,42 +1,443 @@
 # ocr.py
 from __future__ import annotations
-import cv2
+import atexit
+import functools
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
 import numpy as np
-import pytesseract
 
-def preprocess_for_ocr(image_path: str) -> np.ndarray:
-    img = cv2.imread(image_path)
-    if img is None:
+from extract_fields import extraction_problems
+from startup import step
+from utils import lazy_module
+
+# Heavy; imported on first OCR call, not when the module is imported
+cv2 = lazy_module("cv2")
+pytesseract = lazy_module("pytesseract")
+futures = lazy_module("concurrent.futures")
+shared_memory = lazy_module("multiprocessing.shared_memory")
+
+# Bump whenever preprocessing output can change (anything caching OCR results keys on it)
+PREPROCESS_VERSION = 2
+
+OCR_CONFIG = "--oem 3 --psm 6"  # LSTM, assume a block of text
+
+# Resolution normalization on the page's long side: ~A4 at 300 dpi max, ~140 dpi min
+MAX_LONG_SIDE = 3508
+MIN_LONG_SIDE = 1600
+
+# Deskew: estimated on a copy this big; angles below SKEW_MIN_DEG aren't worth a warp
+SKEW_PROBE_LONG_SIDE = 800
+SKEW_MAX_DEG = 5.0
+SKEW_MIN_DEG = 0.2
+
+# Noise sigma (grey levels) separating clean digital renders / light / heavy noise
+CLEAN_NOISE = 0.5
+HEAVY_NOISE = 3.0
+
+# Cascade: OCR a downscaled, plainly thresholded copy first and only run the full
+# preprocessing when the fields extracted from it are missing or implausible
+OCR_CASCADE = os.getenv("INVOICE_GUARD_OCR_CASCADE", "1") != "0"
+FAST_LONG_SIDE = int(os.getenv("INVOICE_GUARD_OCR_FAST_LONG_SIDE", "1400"))
+
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+class _StepTimer:
+    """Records wall time per preprocessing step (ms) into an optional dict."""
+
+    def __init__(self, timings: Optional[Dict[str, float]]):
+        self.timings = timings
+        self.t = time.perf_counter()
+
+    def lap(self, step: str) -> None:
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[step] = round((now - self.t) * 1000, 2)
+        self.t = now
+
+
+def _resize_long_side(img: np.ndarray, long_side: int) -> np.ndarray:
+    h, w = img.shape[:2]
+    scale = long_side / max(h, w)
+    interp = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=interp)
+
+
+def normalize_resolution(gray: np.ndarray) -> np.ndarray:
+    long_side = max(gray.shape[:2])
+    if long_side > MAX_LONG_SIDE:
+        return _resize_long_side(gray, MAX_LONG_SIDE)
+    if long_side < MIN_LONG_SIDE:
+        return _resize_long_side(gray, MIN_LONG_SIDE)
+    return gray
+
+
+def estimate_noise(gray: np.ndarray) -> float:
+    """
+    Noise sigma via Immerkaer's Laplacian-difference estimator, restricted to flat
+    regions (low gradient) of a half-size copy so text edges don't count as noise.
+    Clean digital renders come out near 0, scans at several grey levels.
+    """
+    small = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA).astype(np.float32)
+    lap = np.abs(cv2.filter2D(small, -1, _NOISE_KERNEL))
+    grad = np.abs(cv2.Sobel(small, cv2.CV_32F, 1, 0)) + np.abs(cv2.Sobel(small, cv2.CV_32F, 0, 1))
+    flat = grad < 20
+    if not flat.any():
+        return HEAVY_NOISE
+    return float(np.sqrt(np.pi / 2) * lap[flat].mean() / 6)
+
+
+def estimate_skew(binary: np.ndarray) -> float:
+    """
+    Projection-profile deskew on a downsampled copy: the rotation that makes text rows
+    sharpest maximizes the variance of per-row ink counts. Coarse 0.5 deg search, then
+    a 0.1 deg refinement. Returns degrees (counter-clockwise).
+    """
+    ink = 255 - binary  # text -> high
+    if max(ink.shape) > SKEW_PROBE_LONG_SIDE:
+        ink = _resize_long_side(ink, SKEW_PROBE_LONG_SIDE)
+    h, w = ink.shape
+    center = (w / 2, h / 2)
+
+    def score(angle: float) -> float:
+        M = cv2.getRotationMatrix2D(center, angle, 1.0)
+        rot = cv2.warpAffine(ink, M, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+        return float(np.var(rot.sum(axis=1, dtype=np.float64)))
+
+    coarse = np.arange(-SKEW_MAX_DEG, SKEW_MAX_DEG + 1e-9, 0.5)
+    best = max(coarse, key=score)
+    fine = np.arange(best - 0.4, best + 0.4 + 1e-9, 0.1)
+    return float(max(fine, key=score))
+
+
+def preprocess_for_ocr(image_path: str, timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    Resolution-adaptive preprocessing. Pass a dict as `timings` to get per-step ms.
+
+    load (grayscale) -> normalize resolution -> denoise picked by measured noise
+    (none for clean renders, median for light noise, bilateral for heavy) ->
+    adaptive threshold -> deskew estimated on a small copy, skipped when negligible.
+    """
+    timer = _StepTimer(timings)
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
         raise FileNotFoundError(f"Could not read image: {image_path}")
+    timer.lap("load")
+
+    gray = normalize_resolution(gray)
+    timer.lap("normalize")
 
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    noise = estimate_noise(gray)
+    if timings is not None:
+        timings["noise_sigma"] = round(noise, 3)
+    timer.lap("noise_estimate")
 
     # Denoise + improve contrast
-    gray = cv2.bilateralFilter(gray, 9, 75, 75)
+    if noise >= HEAVY_NOISE:
+        gray = cv2.bilateralFilter(gray, 9, 75, 75)
+    elif noise >= CLEAN_NOISE:
+        gray = cv2.medianBlur(gray, 3)
+    timer.lap("denoise")
 
     # Adaptive threshold for scanned docs
     thr = cv2.adaptiveThreshold(
         gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY, 31, 10
     )
+    timer.lap("threshold")
 
-    # Optional: deskew (simple)
-    coords = np.column_stack(np.where(thr < 255))
-    if coords.size > 0:
-        angle = cv2.minAreaRect(coords)[-1]
-        if angle < -45:
-            angle = -(90 + angle)
-        else:
-            angle = -angle
+    angle = estimate_skew(thr)
+    if timings is not None:
+        timings["skew_deg"] = round(angle, 2)
+    timer.lap("skew_estimate")
 
+    if abs(angle) >= SKEW_MIN_DEG:
         (h, w) = thr.shape[:2]
-        M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
         thr = cv2.warpAffine(thr, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    timer.lap("deskew")
+
+    return thr
+
+
+def preprocess_fast(image_path: str, timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    Cheap tier of the cascade: grayscale, shrunk to FAST_LONG_SIDE (never enlarged), one
+    global Otsu threshold. No noise estimate, denoise or deskew; clean renders and
+    decent scans read fine like this, and fewer pixels make Tesseract itself faster.
+    """
+    timer = _StepTimer(timings)
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise FileNotFoundError(f"Could not read image: {image_path}")
+    timer.lap("load")
+
+    if max(gray.shape[:2]) > FAST_LONG_SIDE:
+        gray = _resize_long_side(gray, FAST_LONG_SIDE)
+    timer.lap("normalize")
 
+    _, thr = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    timer.lap("threshold")
     return thr
 
-def ocr_text(image_path: str) -> str:
-    img = preprocess_for_ocr(image_path)
-    config = "--oem 3 --psm 6"  # LSTM, assume a block of text
-    text = pytesseract.image_to_string(img, config=config)
+
+def image_sha256(image_path: str) -> str:
+    h = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def ocr_version() -> str:
+    """
+    Everything that changes OCR output for the same bytes: preprocessing revision,
+    Tesseract version and config. Cached OCR results are only valid for the same string.
+    """
+    try:
+        tess = str(pytesseract.get_tesseract_version())
+    except Exception:
+        tess = "unknown"
+    cascade = f"|cascade-{FAST_LONG_SIDE}" if OCR_CASCADE else ""
+    return f"pp{PREPROCESS_VERSION}|tesseract-{tess}|{OCR_CONFIG}{cascade}"
+
+# -------------------------
+# OCR backends
+# -------------------------
+class OcrBackend:
+    """Turns a preprocessed grayscale/binary image into text."""
+
+    name = "base"
+
+    def image_to_text(self, img: np.ndarray, config: str = OCR_CONFIG) -> str:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractBackend(OcrBackend):
+    """Fallback: pytesseract writes a temp file and forks `tesseract` per call."""
+
+    name = "pytesseract"
+
+    def image_to_text(self, img: np.ndarray, config: str = OCR_CONFIG) -> str:
+        return pytesseract.image_to_string(img, config=config)
+
+
+def _parse_config(config: str) -> Tuple[int, int, str]:
+    """(oem, psm, lang) from a tesseract CLI config string."""
+    oem = re.search(r"--oem\s+(\d+)", config)
+    psm = re.search(r"--psm\s+(\d+)", config)
+    lang = re.search(r"-l\s+(\S+)", config)
+    return (
+        int(oem.group(1)) if oem else 3,
+        int(psm.group(1)) if psm else 3,
+        lang.group(1) if lang else "eng",
+    )
+
+
+class TesserocrBackend(OcrBackend):
+    """
+    In-process libtesseract via tesserocr: language data is loaded once per config and
+    the image is handed over as raw bytes, no temp file or fork. One API per thread.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        import tesserocr  # optional dependency
+
+        self._tesserocr = tesserocr
+        self._local = threading.local()
+
+    def _api(self, config: str):
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get(config)
+        if api is None:
+            oem, psm, lang = _parse_config(config)
+            api = apis[config] = self._tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=oem)
+        return api
+
+    def image_to_text(self, img: np.ndarray, config: str = OCR_CONFIG) -> str:
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        h, w = img.shape[:2]
+        bpp = 1 if img.ndim == 2 else img.shape[2]
+        api = self._api(config)
+        api.SetImageBytes(img.tobytes(), w, h, bpp, w * bpp)
+        return api.GetUTF8Text()
+
+    def close(self) -> None:
+        for api in getattr(self._local, "apis", {}).values():
+            api.End()
+
+
+def _has_tesserocr() -> bool:
+    # Probe without importing: loading libtesseract (and its OpenMP runtime) in the parent
+    # would fix the thread limit before the pool workers get to set theirs
+    return importlib.util.find_spec("tesserocr") is not None
+
+
+def _local_backend() -> OcrBackend:
+    try:
+        return TesserocrBackend()
+    except ImportError:
+        return PytesseractBackend()
+
+
+def ocr_worker_init() -> None:
+    """
+    Pool initializer for OCR worker processes: parallelism comes from the pool, so each
+    worker's Tesseract (libtesseract, or the tesseract binary it forks) uses one OpenMP
+    thread. Set here rather than in the parent so the parent's environment is untouched.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+# State inside pool worker processes
+_WORKER_BACKEND: Optional[OcrBackend] = None
+
+
+def _pool_worker_init() -> None:
+    global _WORKER_BACKEND
+    ocr_worker_init()
+    _WORKER_BACKEND = _local_backend()
+
+
+def _pool_worker_ocr(shm_name: str, shape: Tuple[int, ...], config: str) -> str:
+    shm = shared_memory.SharedMemory(name=shm_name)  # the parent owns and unlinks it
+    try:
+        # Copy out so no view pins the buffer when the block is closed
+        img = np.array(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+    finally:
+        shm.close()
+    return _WORKER_BACKEND.image_to_text(img, config)
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class PooledTesseractBackend(OcrBackend):
+    """
+    A bounded pool of long-lived OCR worker processes, each keeping its own tesserocr
+    engine warm. Images travel through shared memory instead of pickles or temp files.
+    OMP_THREAD_LIMIT=1 per worker (ocr_worker_init): parallelism comes from the pool.
+    Without tesserocr the workers fall back to pytesseract (a fork and temp file per
+    call) and a warning says so.
+    """
+
+    name = "pooled"
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or int(os.getenv("INVOICE_GUARD_OCR_WORKERS", "0")) or available_cores()
+        if not _has_tesserocr():
+            print(
+                "ocr: tesserocr is not installed; pooled OCR workers fall back to pytesseract "
+                "(pip install tesserocr for warm in-process engines)",
+                file=sys.stderr,
+            )
+        self._pool = futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_pool_worker_init)
+
+    def image_to_text(self, img: np.ndarray, config: str = OCR_CONFIG) -> str:
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+        try:
+            np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf)[...] = img
+            return self._pool.submit(_pool_worker_ocr, shm.name, img.shape, config).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+_BACKEND: Optional[OcrBackend] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_backend() -> OcrBackend:
+    """
+    Process-wide backend, chosen by INVOICE_GUARD_OCR_BACKEND
+    (pooled | tesserocr | pytesseract). Default: pooled when tesserocr is installed (it is
+    in requirements.txt), otherwise the pytesseract fallback.
+    """
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = _make_backend()
+            atexit.register(_BACKEND.close)
+        return _BACKEND
+
+
+def _make_backend() -> OcrBackend:
+    with step("ocr.backend"):
+        choice = os.getenv("INVOICE_GUARD_OCR_BACKEND", "").lower()
+        if not choice:
+            choice = "pooled" if _has_tesserocr() else "pytesseract"
+        if choice == "pooled":
+            return PooledTesseractBackend()
+        if choice == "tesserocr":
+            return TesserocrBackend()
+        return PytesseractBackend()
+
+
+def set_backend(backend: OcrBackend) -> None:
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = backend
+
+
+def ocr_text(image_path: str, timings: Optional[Dict[str, float]] = None, tier: str = "full") -> str:
+    """tier="full" runs preprocess_for_ocr, tier="fast" the cheap preprocess_fast."""
+    img = preprocess_fast(image_path, timings) if tier == "fast" else preprocess_for_ocr(image_path, timings)
+    t0 = time.perf_counter()
+    text = get_backend().image_to_text(img, OCR_CONFIG)
+    if timings is not None:
+        timings["tesseract"] = round((time.perf_counter() - t0) * 1000, 2)
     return (text or "").strip()
+
+
+def ocr_cascade(
+    image_path: str,
+    extract: Callable[[str], Dict[str, Any]],
+    timings: Optional[Dict[str, float]] = None,
+) -> Tuple[str, Dict[str, Any], str]:
+    """
+    Low-res-first OCR -> (text, fields, tier). The fast pass is kept when extract(text)
+    yields every key field plausibly (extract_fields.extraction_problems is empty).
+    Otherwise the full preprocessing path runs, and its result is used unless its fields
+    are worse than the fast pass's. tier is "fast" or "full"; with OCR_CASCADE off only
+    the full path runs. Fast-pass step timings are recorded with a "fast_" prefix.
+    """
+    fast = None
+    if OCR_CASCADE:
+        fast_timings: Optional[Dict[str, float]] = {} if timings is not None else None
+        text = ocr_text(image_path, fast_timings, tier="fast")
+        fields = extract(text)
+        problems = extraction_problems(fields)
+        if timings is not None:
+            timings.update({f"fast_{k}": v for k, v in fast_timings.items()})
+        if not problems:
+            return text, fields, "fast"
+        fast = (text, fields, len(problems))
+
+    text = ocr_text(image_path, timings)
+    fields = extract(text)
+    if fast is not None and fast[2] < len(extraction_problems(fields)):
+        return fast[0], fast[1], "fast"
+    return text, fields, "full"
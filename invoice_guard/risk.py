@@ -1,6 +1,15 @@
 # risk.py
 from __future__ import annotations
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+
+from store import (
+    fetch_invoice_keys,
+    fetch_invoices_by_ids,
+    fetch_vendor_keys,
+    find_exact_duplicate,
+    vendor_amounts_summary,
+)
+from utils import norm_key
 
 def _safe_float(x):
     try:
@@ -8,71 +17,68 @@ def _safe_float(x):
     except Exception:
         return None
 
-def score_invoice(new_rec: dict, history: list[dict]) -> dict:
+def _exact_duplicate(v_new: str, inv_new: str, candidates) -> dict | None:
+    for old in candidates:
+        v_old = norm_key(old.get("vendor_name"))
+        inv_old = norm_key(old.get("invoice_number"))
+        if v_new and inv_new and v_old == v_new and inv_old == inv_new:
+            return old
+    return None
+
+def _near_duplicate(v_new: str, inv_new: str, amt_new, date_new: str, candidates) -> dict | None:
+    for old in candidates:
+        v_old = norm_key(old.get("vendor_name"))
+        inv_old = norm_key(old.get("invoice_number"))
+        amt_old = _safe_float(old.get("total_amount"))
+        date_old = (old.get("invoice_date") or "").strip()
+
+        if not inv_new or not inv_old:
+            continue
+
+        inv_sim = fuzz.ratio(inv_new, inv_old) / 100.0
+        vendor_sim = fuzz.partial_ratio(v_new, v_old) / 100.0 if v_new and v_old else 0.0
+
+        amt_match = (amt_new is not None and amt_old is not None and abs(amt_new - amt_old) <= max(1.0, 0.01 * amt_new))
+        date_close = (date_new and date_old and date_new == date_old)
+
+        if inv_sim > 0.85 and vendor_sim > 0.80 and (amt_match or date_close):
+            return {"id": old["id"], "score": round(inv_sim, 3), "why": f"inv_sim={inv_sim:.2f}, vendor_sim={vendor_sim:.2f}, amt_match={amt_match}, date_same={date_close}"}
+    return None
+
+def _score(new_rec: dict, find_exact, find_near, vendor_median) -> dict:
     """
-    Returns:
-      {
-        "risk_score": int 0..100,
-        "reasons": [..],
-        "matches": [ {id, score, why}, ... up to 3]
-      }
+    Shared rule logic. The lookups are injected so the same rules run over an in-memory
+    history list (score_invoice) or indexed SQL queries (score_invoice_indexed).
     """
     score = 0
     reasons = []
     matches = []
 
-    v_new = (new_rec.get("vendor_name") or "").strip().lower()
-    inv_new = (new_rec.get("invoice_number") or "").strip().lower()
+    v_new = norm_key(new_rec.get("vendor_name"))
+    inv_new = norm_key(new_rec.get("invoice_number"))
     amt_new = _safe_float(new_rec.get("total_amount"))
     date_new = (new_rec.get("invoice_date") or "").strip()
 
     # 1) Exact duplicate check
-    for old in history:
-        v_old = (old.get("vendor_name") or "").strip().lower()
-        inv_old = (old.get("invoice_number") or "").strip().lower()
-        if v_new and inv_new and v_old == v_new and inv_old == inv_new:
+    if v_new and inv_new:
+        old = find_exact(v_new, inv_new)
+        if old:
             score += 60
             reasons.append("Exact duplicate: same vendor + invoice number found in history.")
             matches.append({"id": old["id"], "score": 0.99, "why": "Exact vendor+invoice_number match"})
-            break
 
     # 2) Near-duplicate: fuzzy invoice number + same vendor-ish + same amount
-    if score < 60:
-        for old in history:
-            v_old = (old.get("vendor_name") or "").strip().lower()
-            inv_old = (old.get("invoice_number") or "").strip().lower()
-            amt_old = _safe_float(old.get("total_amount"))
-            date_old = (old.get("invoice_date") or "").strip()
-
-            if not inv_new or not inv_old:
-                continue
-
-            inv_sim = fuzz.ratio(inv_new, inv_old) / 100.0
-            vendor_sim = fuzz.partial_ratio(v_new, v_old) / 100.0 if v_new and v_old else 0.0
-
-            amt_match = (amt_new is not None and amt_old is not None and abs(amt_new - amt_old) <= max(1.0, 0.01 * amt_new))
-            date_close = (date_new and date_old and date_new == date_old)
-
-            if inv_sim > 0.85 and vendor_sim > 0.80 and (amt_match or date_close):
-                score += 45
-                reasons.append("Likely duplicate: invoice number and vendor are very similar to a prior invoice.")
-                matches.append({"id": old["id"], "score": round(inv_sim, 3), "why": f"inv_sim={inv_sim:.2f}, vendor_sim={vendor_sim:.2f}, amt_match={amt_match}, date_same={date_close}"})
-                break
+    if score < 60 and inv_new:
+        near = find_near(v_new, inv_new, amt_new, date_new)
+        if near:
+            score += 45
+            reasons.append("Likely duplicate: invoice number and vendor are very similar to a prior invoice.")
+            matches.append(near)
 
     # 3) Amount outlier per vendor (simple baseline from history)
     if v_new and amt_new is not None:
-        vendor_amounts = []
-        for old in history:
-            v_old = (old.get("vendor_name") or "").strip().lower()
-            if v_old != v_new:
-                continue
-            a = _safe_float(old.get("total_amount"))
-            if a is not None:
-                vendor_amounts.append(a)
-
-        if len(vendor_amounts) >= 5:
-            vendor_amounts.sort()
-            med = vendor_amounts[len(vendor_amounts)//2]
+        n, med = vendor_median(v_new)
+        if n >= 5:
             if med > 0:
                 ratio = amt_new / med
                 if ratio >= 5:
@@ -99,3 +105,89 @@ def score_invoice(new_rec: dict, history: list[dict]) -> dict:
         "reasons": reasons[:5],
         "matches": matches[:3],
     }
+
+def score_invoice(new_rec: dict, history: list[dict]) -> dict:
+    """
+    Returns:
+      {
+        "risk_score": int 0..100,
+        "reasons": [..],
+        "matches": [ {id, score, why}, ... up to 3]
+      }
+    """
+    def vendor_median(v_new):
+        vendor_amounts = []
+        for old in history:
+            if norm_key(old.get("vendor_name")) != v_new:
+                continue
+            a = _safe_float(old.get("total_amount"))
+            if a is not None:
+                vendor_amounts.append(a)
+        if not vendor_amounts:
+            return 0, None
+        vendor_amounts.sort()
+        return len(vendor_amounts), vendor_amounts[len(vendor_amounts)//2]
+
+    return _score(
+        new_rec,
+        find_exact=lambda v, inv: _exact_duplicate(v, inv, history),
+        find_near=lambda v, inv, amt, date: _near_duplicate(v, inv, amt, date, history),
+        vendor_median=vendor_median,
+    )
+
+def _blocked_candidates(conn, v_new: str, inv_new: str) -> list[dict]:
+    """
+    Narrow history to rows that can still pass the near-duplicate rule, in id order:
+    vendor must clear partial_ratio > 80 (checked once per distinct vendor, not per
+    invoice) and invoice number must clear ratio > 85. Cutoffs sit slightly below the
+    rule's thresholds; _near_duplicate re-applies the exact checks.
+    """
+    if not v_new:
+        return []  # vendor_sim is 0 without a vendor, so nothing can match
+    vendor_hits = process.extract(
+        v_new, fetch_vendor_keys(conn), scorer=fuzz.partial_ratio, processor=None, score_cutoff=79.9, limit=None
+    )
+    vendors = [v for v, _, _ in vendor_hits]
+    if not vendors:
+        return []
+    keys = dict(fetch_invoice_keys(conn, vendors, inv_new))
+    hits = process.extract(inv_new, keys, scorer=fuzz.ratio, processor=None, score_cutoff=84.9, limit=None)
+    ids = sorted(k for _, _, k in hits)
+    rows = fetch_invoices_by_ids(conn, ids)
+    return [rows[i] for i in ids if i in rows]
+
+def score_invoice_indexed(new_rec: dict, conn) -> dict:
+    """
+    Same result as score_invoice(new_rec, fetch_all_invoices(conn)), but every rule is an
+    indexed lookup: exact match is a point query, fuzzy matching only scores a candidate
+    set blocked by vendor, and the vendor median comes from the vendor's amount sketch.
+    """
+    return _score(
+        new_rec,
+        find_exact=lambda v, inv: find_exact_duplicate(conn, v, inv),
+        find_near=lambda v, inv, amt, date: _near_duplicate(v, inv, amt, date, _blocked_candidates(conn, v, inv)),
+        vendor_median=lambda v: vendor_amounts_summary(conn, v),
+    )
+
+def score_invoice_sharded(new_rec: dict, sharded) -> dict:
+    """
+    score_invoice_indexed over a sharding.ShardedStore. Exact match and vendor median read
+    the vendor's own shard; fuzzy blocking runs on every shard in parallel (a similar
+    vendor spelling can hash to another shard) and candidates are merged back into
+    global id order, so the first match reported is the same as on a single store.
+    """
+    owner = sharded.owner(new_rec.get("vendor_name")).conn
+
+    def find_near(v, inv, amt, date):
+        found = {}
+        for rows in sharded.fan_out(lambda shard: _blocked_candidates(shard.conn, v, inv)):
+            for row in rows:
+                found[row["id"]] = row  # a vendor being moved can briefly sit on two shards
+        return _near_duplicate(v, inv, amt, date, [found[i] for i in sorted(found)])
+
+    return _score(
+        new_rec,
+        find_exact=lambda v, inv: find_exact_duplicate(owner, v, inv),
+        find_near=find_near,
+        vendor_median=lambda v: vendor_amounts_summary(owner, v),
+    )
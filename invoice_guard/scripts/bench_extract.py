@@ -0,0 +1,238 @@
+# scripts/bench_extract.py
+"""
+Check extract_fields against the legacy multi-pass extractor and time both per invoice.
+
+    python scripts/bench_extract.py [--images 'sample_invoices/*.jpg']
+    python scripts/bench_extract.py --texts 'ocr_dumps/*.txt'
+
+Images are OCR'd once (needs the tesseract binary); --texts reads saved OCR output instead.
+Prints per-invoice extraction time for both extractors and every invoice whose fields
+differ; exits non-zero if any do.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import re
+import statistics
+import sys
+import time
+from dataclasses import asdict
+
+from dateutil import parser as dateparser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from extract_fields import (  # noqa: E402
+    DATE_HINT_RE,
+    INVOICE_NO_RE,
+    MONEY_RE,
+    SELLER_INLINE_RE,
+    VENDOR_LABEL_RE,
+    InvoiceRecord,
+    extract_fields,
+)
+
+
+def legacy_vendor_guess(lines: list[str]) -> str | None:
+    bad_tokens = [
+        "invoice", "bill to", "ship to", "date", "due", "total", "balance",
+        "tax id", "tin", "vat", "gst", "ssn", "po", "purchase order",
+        "amount", "payment", "terms", "remit", "account", "routing"
+    ]
+    def looks_like_metadata(s: str) -> bool:
+        s_low = s.lower()
+        if any(tok in s_low for tok in bad_tokens):
+            return True
+        if "@" in s_low or "www." in s_low:
+            return True
+        # too numeric
+        if sum(c.isdigit() for c in s) > max(3, len(s)//3):
+            return True
+        return False
+    GENERIC_LABELS = {
+    "seller", "client", "seller:", "client:", "seller: client:"
+}
+    
+
+    # 1) Keyword-driven extraction (best)
+    for ln in lines[:30]:
+        s = ln.strip()
+        if not s:
+            continue
+
+        # inline: "Seller: X   Client: Y"
+        m_inline = SELLER_INLINE_RE.search(s)
+        if m_inline:
+            cand = m_inline.group(1).strip(" -—–\t")
+            if cand.lower().strip() in GENERIC_LABELS:
+                continue
+            if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
+                return cand[:80]
+            
+
+        # line starts with Seller/Vendor/From:
+        m = VENDOR_LABEL_RE.match(s)
+        if m:
+            cand = m.group(1).strip(" -—–\t")
+            if cand.lower().strip() in GENERIC_LABELS:
+                continue
+            if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
+                return cand[:80]
+
+    # 2) If we see a line that is JUST "Seller:" then next non-empty line is likely the name
+    for i, ln in enumerate(lines[:30]):
+        s = ln.strip().lower().strip(" -—–")
+        if s in ("seller:", "seller", "vendor:", "vendor", "from:", "from", "supplier:", "supplier"):
+            # grab next meaningful line
+            for j in range(i + 1, min(i + 6, len(lines))):
+                cand = lines[j].strip(" -—–\t")
+                if cand.lower().strip() in GENERIC_LABELS:
+                    continue
+                if cand and not looks_like_metadata(cand) and 3 <= len(cand) <= 60:
+                    return cand[:80]
+    
+
+    # 3) Fallback: first plausible “name-like” line
+    for ln in lines[:30]:
+        cand = ln.strip(" -—–\t")
+        if not cand or len(cand) < 3:
+            continue
+        if looks_like_metadata(cand):
+            continue
+        if 4 <= len(cand) <= 40:
+            # avoid generic labels
+            if cand.lower().strip() in GENERIC_LABELS:
+                continue
+            if cand.lower() in ("seller", "client", "seller: client:", "seller: client:"):
+                continue
+            return cand[:80]
+
+    return None
+
+
+
+def legacy_parse_date(text: str) -> str | None:
+    try:
+        dt = dateparser.parse(text, fuzzy=True)
+        if dt:
+            return dt.date().isoformat()
+    except Exception:
+        return None
+    return None
+
+def legacy_extract_fields(ocr_text: str) -> InvoiceRecord:
+    """The pre-v2 multi-pass extractor, kept here only as the reference output."""
+    lines = [l.strip() for l in ocr_text.splitlines()]
+    lines = [l for l in lines if l]
+
+    vendor_name = legacy_vendor_guess(lines)
+
+    invoice_number = None
+    m = INVOICE_NO_RE.search(ocr_text)
+    if m:
+        invoice_number = m.group(1).strip().upper()
+
+    invoice_date = None
+    # Try date line hint first
+    m = DATE_HINT_RE.search(ocr_text)
+    if m:
+        invoice_date = legacy_parse_date(m.group(1))
+
+    # Fallback: pick first parsable date from text
+    if invoice_date is None:
+        # common formats like 01/02/2025, 2025-01-02
+        date_candidates = re.findall(r"\b(?:\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4}|\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})\b", ocr_text)
+        for dc in date_candidates[:5]:
+            invoice_date = legacy_parse_date(dc)
+            if invoice_date:
+                break
+
+    # Total amount: prefer lines near "Total" / "Amount Due"
+    total_amount = None
+    currency = None
+    lowered = ocr_text.lower()
+
+    def find_amount_near(keyword: str) -> float | None:
+        idx = lowered.find(keyword)
+        if idx == -1:
+            return None
+        window = ocr_text[max(0, idx-50): idx+120]
+        amounts = MONEY_RE.findall(window)
+        if not amounts:
+            return None
+        # choose the largest amount in window (often total)
+        vals = []
+        for a in amounts:
+            try:
+                vals.append(float(a.replace(",", "")))
+            except Exception:
+                pass
+        return max(vals) if vals else None
+
+    total_amount = (find_amount_near("amount due")
+                    or find_amount_near("total")
+                    or find_amount_near("balance due"))
+
+    if "usd" in lowered or "$" in ocr_text:
+        currency = "USD"
+
+    return InvoiceRecord(
+        vendor_name=vendor_name,
+        invoice_number=invoice_number,
+        invoice_date=invoice_date,
+        total_amount=total_amount,
+        currency=currency,
+        raw_text=ocr_text
+    )
+
+
+def _time_us(fn, text: str, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def _load(args) -> list:
+    if args.texts:
+        paths = sorted(glob.glob(args.texts))
+        return [(os.path.basename(p), open(p, encoding="utf-8").read()) for p in paths]
+    from ocr import ocr_text
+
+    return [(os.path.basename(p), ocr_text(p)) for p in sorted(glob.glob(args.images))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare and time field extraction")
+    ap.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "sample_invoices", "*.jpg"))
+    ap.add_argument("--texts", default=None, help="glob of saved OCR text files (skips OCR)")
+    ap.add_argument("--repeat", type=int, default=50, help="timing repetitions per invoice")
+    args = ap.parse_args()
+
+    docs = _load(args)
+    if not docs:
+        sys.exit(f"No inputs match {args.texts or args.images}")
+
+    rows, diffs = [], []
+    print(f"{'invoice':<24} {'legacy us':>10} {'new us':>10}")
+    for name, text in docs:
+        old, new = asdict(legacy_extract_fields(text)), asdict(extract_fields(text))
+        if old != new:
+            diffs.append((name, old, new))
+        old_us, new_us = _time_us(legacy_extract_fields, text, args.repeat), _time_us(extract_fields, text, args.repeat)
+        rows.append((old_us, new_us))
+        print(f"{name:<24} {old_us:10.1f} {new_us:10.1f}")
+
+    med = lambda i: statistics.median(r[i] for r in rows)  # noqa: E731
+    print(f"{len(rows)} invoices  median legacy {med(0):.1f} us  new {med(1):.1f} us  ({med(0) / med(1):.2f}x)")
+    print(f"invoices with different fields: {len(diffs)}")
+    for name, old, new in diffs:
+        old.pop("raw_text"), new.pop("raw_text")
+        print(f"  {name}: legacy={old} new={new}")
+    sys.exit(1 if diffs else 0)
+
+
+if __name__ == "__main__":
+    main()
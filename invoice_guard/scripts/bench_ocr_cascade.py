@@ -0,0 +1,66 @@
+# scripts/bench_ocr_cascade.py
+"""
+Compare the low-res-first OCR cascade with always running the full preprocessing path.
+
+    python scripts/bench_ocr_cascade.py [--images 'sample_invoices/*.jpg']
+
+Every image is OCR'd both ways (needs the tesseract binary), with extraction included
+since the cascade needs it to choose a tier. Prints per-image time for each way and the
+tier the cascade used. The summary gives the mean OCR time, how many invoices the fast
+tier served, and every invoice whose cascade fields differ from the full path's; the
+script exits non-zero if any do.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from extract_fields import extract_dict  # noqa: E402
+from ocr import ocr_cascade, ocr_text  # noqa: E402
+
+KEY_FIELDS = ("vendor_name", "invoice_number", "invoice_date", "total_amount")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Time the OCR cascade against full-path OCR")
+    ap.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "sample_invoices", "*.jpg"))
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        sys.exit(f"No images match {args.images}")
+
+    rows, tiers, diffs = [], {"fast": 0, "full": 0}, []
+    print(f"{'invoice':<24} {'full ms':>9} {'cascade ms':>11}  tier")
+    for path in paths:
+        t0 = time.perf_counter()
+        full = extract_dict(ocr_text(path))
+        t1 = time.perf_counter()
+        _, fields, tier = ocr_cascade(path, extract_dict)
+        t2 = time.perf_counter()
+
+        rows.append(((t1 - t0) * 1000, (t2 - t1) * 1000))
+        tiers[tier] += 1
+        if any(full.get(k) != fields.get(k) for k in KEY_FIELDS):
+            diffs.append((os.path.basename(path), {k: full.get(k) for k in KEY_FIELDS}, {k: fields.get(k) for k in KEY_FIELDS}))
+        print(f"{os.path.basename(path):<24} {rows[-1][0]:9.1f} {rows[-1][1]:11.1f}  {tier}")
+
+    mean = lambda i: statistics.fmean(r[i] for r in rows)  # noqa: E731
+    print(
+        f"{len(rows)} invoices  mean full {mean(0):.1f} ms  cascade {mean(1):.1f} ms  ({mean(0) / mean(1):.2f}x)  "
+        f"fast tier {tiers['fast']}/{len(rows)}"
+    )
+    print(f"invoices whose key fields differ from the full path: {len(diffs)}")
+    for name, full, cascade in diffs:
+        print(f"  {name}: full={full} cascade={cascade}")
+    sys.exit(1 if diffs else 0)
+
+
+if __name__ == "__main__":
+    main()
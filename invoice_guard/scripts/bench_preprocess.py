@@ -0,0 +1,104 @@
+# scripts/bench_preprocess.py
+"""
+Compare the legacy OCR preprocessing with ocr.preprocess_for_ocr on sample_invoices/.
+
+    python scripts/bench_preprocess.py [--images 'sample_invoices/*.jpg'] [--ocr]
+
+Reports wall time and peak traced memory per page, plus per-step timings of the new
+pipeline. With --ocr (needs the tesseract binary) it also runs extract_fields on both
+outputs and reports pages whose fields differ.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from ocr import preprocess_for_ocr  # noqa: E402
+
+
+def legacy_preprocess(image_path: str) -> np.ndarray:
+    """The pre-v2 pipeline, kept here only as a baseline."""
+    img = cv2.imread(image_path)
+    if img is None:
+        raise FileNotFoundError(f"Could not read image: {image_path}")
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.bilateralFilter(gray, 9, 75, 75)
+    thr = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    coords = np.column_stack(np.where(thr < 255))
+    if coords.size > 0:
+        angle = cv2.minAreaRect(coords)[-1]
+        angle = -(90 + angle) if angle < -45 else -angle
+        (h, w) = thr.shape[:2]
+        M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+        thr = cv2.warpAffine(thr, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return thr
+
+
+def _measure(fn, path):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn(path)
+    ms = (time.perf_counter() - t0) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, ms, peak / 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark OCR preprocessing")
+    ap.add_argument("--images", default=os.path.join(os.path.dirname(__file__), "..", "sample_invoices", "*.jpg"))
+    ap.add_argument("--ocr", action="store_true", help="Also OCR + extract_fields both outputs")
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        sys.exit(f"No images match {args.images}")
+
+    rows, steps, diffs = [], {}, []
+    for p in paths:
+        old, old_ms, old_mb = _measure(legacy_preprocess, p)
+        timings = {}
+        new, new_ms, new_mb = _measure(lambda x: preprocess_for_ocr(x, timings), p)
+        rows.append((old_ms, old_mb, new_ms, new_mb))
+        for k, v in timings.items():
+            steps.setdefault(k, []).append(v)
+
+        if args.ocr:
+            import pytesseract
+            from extract_fields import extract_fields
+
+            def fields(img):
+                rec = asdict(extract_fields(pytesseract.image_to_string(img, config="--oem 3 --psm 6").strip()))
+                rec.pop("raw_text")
+                return rec
+
+            a, b = fields(old), fields(new)
+            if a != b:
+                diffs.append((os.path.basename(p), a, b))
+
+    med = lambda i: statistics.median(r[i] for r in rows)  # noqa: E731
+    print(f"{len(rows)} pages")
+    print(f"legacy : {med(0):8.1f} ms/page  peak {med(1):7.1f} MB")
+    print(f"new    : {med(2):8.1f} ms/page  peak {med(3):7.1f} MB")
+    print("new pipeline steps (median):")
+    for k, v in steps.items():
+        print(f"  {k:<15} {statistics.median(v):8.2f}")
+    if args.ocr:
+        print(f"pages with different extracted fields: {len(diffs)}")
+        for name, a, b in diffs:
+            print(f"  {name}: legacy={a} new={b}")
+
+
+if __name__ == "__main__":
+    main()
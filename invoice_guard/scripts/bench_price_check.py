@@ -0,0 +1,107 @@
+# scripts/bench_price_check.py
+"""
+Offline price-check throughput / cache hit rate against scripts/stub_llm_server.py.
+
+    python scripts/bench_price_check.py --invoices 500 --products 60 --threads 16
+    python scripts/bench_price_check.py --no-cache
+    python scripts/bench_price_check.py --no-semantic   # exact-key cache only
+
+Invoice lines are drawn Zipf-style from --products distinct products (OCR-ish case and
+spacing noise, amounts within a few % of the product's price), then checked from --threads
+worker threads through llm_price_check.cached_price_check with a scratch SQLite DB.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts.stub_llm_server import start_stub  # noqa: E402
+import llm_price_check  # noqa: E402
+from store import Store, save_price_check  # noqa: E402
+
+
+def _dataset(n: int, products: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = [f"Item {i} steel bolts M{i % 12 + 4} pack of {10 * (i % 5 + 1)}" for i in range(products)]
+    prices = [round(rng.uniform(20, 5000), 2) for _ in range(products)]
+    weights = [1.0 / (r + 1) for r in range(products)]
+    rows = []
+    for _ in range(n):
+        p = rng.choices(range(products), weights)[0]
+        desc = names[p]
+        if rng.random() < 0.3:
+            desc = desc.upper()
+        if rng.random() < 0.3:
+            desc = desc.replace(" ", "  ", 1) + " ."
+        if rng.random() < 0.2:  # reworded line: misses the exact key, not the semantic cache
+            desc = desc.replace("pack of", "pk") + " qty 1"
+        rows.append((desc, round(prices[p] * rng.uniform(0.98, 1.02), 2)))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure price-check throughput and cache hit rate offline")
+    ap.add_argument("--invoices", type=int, default=500)
+    ap.add_argument("--products", type=int, default=60)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--latency-ms", type=float, default=200.0)
+    ap.add_argument("--concurrency", type=int, default=llm_price_check.PRICE_MAX_CONCURRENCY)
+    ap.add_argument("--rate", type=float, default=50.0, help="LLM requests/s (token bucket)")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--no-semantic", action="store_true", help="exact-key cache only")
+    args = ap.parse_args()
+
+    srv, url = start_stub(0, args.latency_ms)
+    service = llm_price_check.PriceCheckService(
+        api_key="stub", base_url=url, max_concurrency=args.concurrency, rate_per_s=args.rate, burst=args.concurrency
+    )
+    llm_price_check._SERVICE = service
+    store = Store(os.path.join(tempfile.mkdtemp(prefix="bench_price_"), "bench.db"))
+    rows = _dataset(args.invoices, args.products)
+
+    def one(i_row):
+        i, (desc, amount) = i_row
+        t0 = time.perf_counter()
+        if args.no_cache:
+            out, save = llm_price_check.run_price_check(desc, "Vendor", amount, "USD"), {}
+        else:
+            out, save = llm_price_check.cached_price_check(
+                store.conn, desc, "Vendor", amount, "USD", semantic=not args.no_semantic
+            )
+        save_price_check(store.conn, i + 1, desc, out, **save)
+        return time.perf_counter() - t0, bool(out.get("cached"))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(one, enumerate(rows)))
+    wall = time.perf_counter() - t0
+
+    lat = sorted(r[0] * 1000 for r in results)
+    hits = sum(r[1] for r in results)
+    print(
+        f"invoices={len(rows)} products={args.products} threads={args.threads} "
+        f"concurrency={args.concurrency} rate={args.rate}/s stub_latency={args.latency_ms:.0f}ms "
+        f"cache={'off' if args.no_cache else 'exact' if args.no_semantic else 'exact+semantic'}"
+    )
+    print(f"  wall={wall:.2f}s  throughput={len(rows) / wall:.1f} checks/s")
+    print(f"  llm_requests={srv.requests}  cache_hit_rate={hits / len(rows):.3f}")
+    if not args.no_cache:
+        print(f"  {llm_price_check.price_cache_stats()}")
+    print(
+        f"  latency p50={statistics.median(lat):.1f}ms p95={lat[int(0.95 * (len(lat) - 1))]:.1f}ms "
+        f"max={lat[-1]:.1f}ms"
+    )
+    store.close()
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
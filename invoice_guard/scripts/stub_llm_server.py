@@ -0,0 +1,84 @@
+# scripts/stub_llm_server.py
+"""
+Local stand-in for the Gemini generateContent endpoint, for offline price-check tests.
+
+    python scripts/stub_llm_server.py --port 8765 --latency-ms 300
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=stub python main.py inv.jpg --db x.db --price-check
+
+Answers deterministically from the prompt text after a fixed delay, keeps connections
+alive (HTTP/1.1), and counts requests so callers can check how many reached "the LLM".
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.endswith(":generateContent"):
+            return self._send(404, {"error": {"code": 404, "message": f"no route {self.path}"}})
+        try:
+            req = json.loads(body or b"{}")
+            prompt = "".join(p.get("text", "") for c in req.get("contents", []) for p in c.get("parts", []))
+        except ValueError:
+            return self._send(400, {"error": {"code": 400, "message": "bad json"}})
+
+        srv = self.server
+        with srv.lock:
+            srv.requests += 1
+        time.sleep(srv.latency_s)
+        digest = hashlib.sha1(prompt.encode()).digest()[0]
+        text = "OK, reasonable price." if digest % 3 else "Overpriced, too expensive."
+        self._send(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(prompt.split()), "candidatesTokenCount": 3},
+        })
+
+    def _send(self, status: int, obj) -> None:
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # quiet
+        pass
+
+
+def start_stub(port: int = 0, latency_ms: float = 300.0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start in a daemon thread -> (server, base_url). server.requests counts LLM calls."""
+    srv = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    srv.daemon_threads = True
+    srv.latency_s = latency_ms / 1000.0
+    srv.requests = 0
+    srv.lock = threading.Lock()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stub Gemini generateContent server")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=300.0)
+    args = ap.parse_args()
+    srv, url = start_stub(args.port, args.latency_ms)
+    print(f"stub LLM listening on {url} (latency {args.latency_ms:.0f} ms)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    main()
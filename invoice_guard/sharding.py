@@ -0,0 +1,451 @@
+# sharding.py
+"""
+Invoice store partitioned by vendor across several SQLite files.
+
+  <root>/catalog.db      shard list, global invoice-id allocator, shared OCR cache
+  <root>/shard-00.db     ordinary store.py databases, each holding a subset of vendors
+  <root>/shard-01.db ...
+
+Each vendor (by norm_key) lives on exactly one shard, picked by rendezvous hashing
+(highest blake2b(shard, vendor) wins). Everything keyed by vendor is a single-shard
+query: exact duplicates, amount stats and sketches. An invoice's row, embedding, stats
+update and price check also commit together on that shard. Lookups that cross vendors
+are fanned out to every shard in parallel and merged: fuzzy duplicate blocking, since a
+similar vendor spelling can hash elsewhere, and neighbour search.
+
+Ids are handed out by the catalog in blocks, so they are unique across shards and keep
+their global order when rows move. Adding a shard moves only the vendors that now hash
+to it. Their rows, embeddings and price checks are copied as stored, so no image is
+OCR'd or embedded again. The bulk copy runs in short batches while the old shards keep
+taking writes; only the final catch-up and delete hold both files' write locks.
+
+    python sharding.py init data/shards --shards 4 [--from data/invoices.db]
+    python sharding.py add data/shards [--name shard-04]
+    python sharding.py status data/shards
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ml.neighbors import nearest_neighbors
+from ml.sketch import KLLSketch
+from store import Store, _statements, connect, unit_of_work
+from utils import norm_key
+
+CATALOG = "catalog.db"
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+  name TEXT PRIMARY KEY,
+  path TEXT NOT NULL,                    -- relative to the catalog's directory
+  state TEXT NOT NULL DEFAULT 'active',  -- filling (being copied into, not routed to) | active
+  added_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS id_alloc (
+  one INTEGER PRIMARY KEY CHECK (one = 1),
+  next_id INTEGER NOT NULL
+);
+"""
+
+# Ids reserved per catalog transaction; a process that exits leaves a gap, nothing else
+ID_BLOCK = int(os.getenv("INVOICE_GUARD_ID_BLOCK", "1000"))
+
+# Invoices copied per transaction in a rebalance's bulk copy; writers wait for one batch at most
+MOVE_BATCH = int(os.getenv("INVOICE_GUARD_MOVE_BATCH", "5000"))
+
+# Tables whose rows belong to one invoice, copied with it when its vendor moves
+_INVOICE_TABLES = ("invoice_embeddings", "price_checks")
+
+
+def _weight(shard: str, key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{shard}\0{key}".encode(), digest_size=8).digest(), "big")
+
+
+def owner_of(vendor_norm: str, shard_names: Iterable[str]) -> str:
+    """Rendezvous hashing: adding a shard only moves keys onto it, never between old shards."""
+    return max(shard_names, key=lambda s: _weight(s, vendor_norm))
+
+
+class Shard:
+    def __init__(self, name: str, db_path: str, state: str):
+        self.name = name
+        self.db_path = db_path
+        self.state = state
+        self.store = Store(db_path)
+
+    @property
+    def conn(self):
+        return self.store.conn
+
+
+class ShardedStore:
+    """
+    Catalog + shard stores for one sharded root directory. Shard connections are
+    per-thread (see store.Store); fan_out() runs one task per shard on a thread pool,
+    where SQLite and numpy release the GIL.
+
+    The shard list is re-read whenever another connection has changed the catalog
+    (PRAGMA data_version), so workers pick up a newly added shard without restarting.
+    """
+
+    def __init__(self, root: str, workers: Optional[int] = None):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.catalog = Store(os.path.join(self.root, CATALOG))
+        self._workers = workers
+        self._pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._shards: Dict[str, Shard] = {}
+        self._ids = iter(())
+        self._lock = threading.Lock()
+        self._seen = threading.local()
+        with unit_of_work(self.catalog.conn) as conn:
+            for stmt in _statements(CATALOG_SCHEMA):
+                conn.execute(stmt)
+            conn.execute("INSERT OR IGNORE INTO id_alloc (one, next_id) VALUES (1, 1)")
+        self._load()
+
+    # -------------------------
+    # Catalog
+    # -------------------------
+    def _load(self) -> None:
+        conn = self.catalog.conn
+        self._seen.version = conn.execute("PRAGMA data_version").fetchone()[0]
+        rows = conn.execute("SELECT name, path, state FROM shards ORDER BY name").fetchall()
+        with self._lock:
+            shards = {}
+            for r in rows:
+                shard = self._shards.get(r["name"]) or Shard(r["name"], os.path.join(self.root, r["path"]), r["state"])
+                shard.state = r["state"]
+                shards[r["name"]] = shard
+            self._shards = shards
+
+    def _refresh(self) -> None:
+        version = self.catalog.conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(self._seen, "version", None) != version:
+            self._load()
+
+    @property
+    def shards(self) -> List[Shard]:
+        """Shards that serve reads and writes (a shard being filled by add_shard is not one yet)."""
+        self._refresh()
+        return [s for s in self._shards.values() if s.state == "active"]
+
+    def owner(self, vendor_name: Optional[str]) -> Shard:
+        """The shard holding this vendor's invoices (vendor-less invoices hash as "")."""
+        shards = self.shards
+        if not shards:
+            raise RuntimeError(f"No active shards in {self.root}; run: python sharding.py init {self.root}")
+        by_name = {s.name: s for s in shards}
+        return by_name[owner_of(norm_key(vendor_name), by_name)]
+
+    def next_id(self) -> int:
+        """Globally unique invoice id, from a block reserved in the catalog."""
+        with self._lock:
+            for invoice_id in self._ids:
+                return invoice_id
+            with unit_of_work(self.catalog.conn) as conn:
+                start = int(conn.execute("SELECT next_id FROM id_alloc WHERE one = 1").fetchone()[0])
+                conn.execute("UPDATE id_alloc SET next_id = ? WHERE one = 1", (start + ID_BLOCK,))
+            self._ids = iter(range(start + 1, start + ID_BLOCK))
+            return start
+
+    def _reserve_past(self, max_id: int) -> None:
+        with unit_of_work(self.catalog.conn) as conn:
+            conn.execute("UPDATE id_alloc SET next_id = MAX(next_id, ?) WHERE one = 1", (max_id + 1,))
+
+    # -------------------------
+    # Fan-out reads
+    # -------------------------
+    def fan_out(self, fn: Callable[[Shard], Any], shards: Optional[List[Shard]] = None) -> List[Any]:
+        """fn(shard) for every active shard in parallel -> results in shard order."""
+        shards = self.shards if shards is None else shards
+        if len(shards) <= 1:
+            return [fn(s) for s in shards]
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._workers or max(4, len(shards)), thread_name_prefix="shard"
+                )
+            pool = self._pool
+        return list(pool.map(fn, shards))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        for shard in self._shards.values():
+            shard.store.close()
+        self.catalog.close()
+
+    # -------------------------
+    # Growing
+    # -------------------------
+    def add_shard(self, name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Create a shard and move the vendors that now hash to it. The new shard is filled
+        while the old owners keep serving, then activated; the old copies are deleted last.
+        """
+        self._refresh()
+        name = name or f"shard-{len(self._shards):02d}"
+        if name in self._shards:
+            raise ValueError(f"Shard {name!r} already exists")
+        path = f"{name}.db"
+        connect(os.path.join(self.root, path)).close()  # create + bootstrap the schema
+        with unit_of_work(self.catalog.conn) as conn:
+            conn.execute(
+                "INSERT INTO shards (name, path, state, added_at) VALUES (?, ?, ?, ?)",
+                (name, path, "filling" if self.shards else "active", time.time()),
+            )
+        self._load()
+        return {"shard": name, **self.rebalance()}
+
+    def rebalance(self) -> Dict[str, int]:
+        """
+        Put every vendor on the shard that owns it once filling shards count as owners.
+        Safe to re-run after a crash: copies are idempotent (same ids), and the per-vendor
+        tables on the destination are rebuilt from its invoice rows.
+        """
+        self._refresh()
+        sources = self.shards
+        owners = list(self._shards)
+        plan: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        for src in sources:
+            for (key,) in src.conn.execute("SELECT DISTINCT COALESCE(vendor_norm, '') FROM invoices"):
+                dst = owner_of(key, owners)
+                if dst != src.name:
+                    plan[(src.name, dst)].append(key)
+
+        # 1) bulk copy in short batches while the sources keep taking writes
+        copied = sum(self._move(self._shards[s], self._shards[d], keys, delete=False) for (s, d), keys in plan.items())
+
+        # 2) route the moved vendors to their new shards
+        with unit_of_work(self.catalog.conn) as conn:
+            conn.execute("UPDATE shards SET state = 'active' WHERE state = 'filling'")
+        self._load()
+
+        # 3) copy rows written meanwhile and drop the sources' copies, holding both write locks
+        for (s, d), keys in plan.items():
+            self._move(self._shards[s], self._shards[d], keys, delete=True)
+        return {"vendors_moved": sum(len(k) for k in plan.values()), "invoices_moved": copied}
+
+    def _move(self, src: Shard, dst: Shard, keys: List[str], delete: bool) -> int:
+        """
+        Copy these vendors' invoices from src to dst. Without delete it is the bulk copy: id
+        ranges of MOVE_BATCH invoices, each in its own short transaction. With delete, one
+        transaction copies whatever arrived since and drops the src rows.
+        """
+        conn = src.conn
+        conn.execute("ATTACH DATABASE ? AS dst", (dst.db_path,))
+        try:
+            with unit_of_work(conn):
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS moving (vendor_norm TEXT PRIMARY KEY)")
+                conn.execute("DELETE FROM temp.moving")
+                conn.executemany("INSERT INTO temp.moving (vendor_norm) VALUES (?)", ((k,) for k in keys))
+            ids = "SELECT id FROM main.invoices WHERE COALESCE(vendor_norm, '') IN (SELECT vendor_norm FROM temp.moving)"
+            if delete:
+                with unit_of_work(conn):  # BEGIN IMMEDIATE takes the write lock on both files
+                    copied = _copy_invoices(conn, ids)
+                    _rebuild_vendor_tables(conn, "dst", keys)
+                    for table in _INVOICE_TABLES:
+                        conn.execute(f"DELETE FROM main.{table} WHERE invoice_id IN ({ids})")
+                    conn.execute(f"DELETE FROM main.invoices WHERE id IN ({ids})")
+                    _drop_vendor_tables(conn, "main", keys)
+                return copied
+
+            copied, last = 0, 0
+            while True:
+                with unit_of_work(conn):
+                    hi = conn.execute(
+                        f"SELECT MAX(id) FROM ({ids} AND id > ? ORDER BY id LIMIT ?)", (last, MOVE_BATCH)
+                    ).fetchone()[0]
+                    if hi is None:
+                        break
+                    copied += _copy_invoices(conn, f"{ids} AND id > {last} AND id <= {int(hi)}")
+                last = int(hi)
+            # Vendor tables too, so dst answers medians as soon as it is routed to
+            for key in keys:
+                with unit_of_work(conn):
+                    _rebuild_vendor_tables(conn, "dst", [key])
+        finally:
+            conn.execute("DETACH DATABASE dst")
+        return copied
+
+    # -------------------------
+    # Inspection
+    # -------------------------
+    def status(self) -> List[Dict[str, Any]]:
+        def _one(shard: Shard) -> Dict[str, Any]:
+            conn = shard.conn
+            return {
+                "shard": shard.name,
+                "state": shard.state,
+                "invoices": conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0],
+                "vendors": conn.execute("SELECT COUNT(*) FROM vendor_keys").fetchone()[0],
+                "embeddings": conn.execute("SELECT COUNT(*) FROM invoice_embeddings").fetchone()[0],
+                "bytes": os.path.getsize(shard.db_path),
+            }
+
+        self._refresh()
+        return self.fan_out(_one, list(self._shards.values()))
+
+    @classmethod
+    def create(cls, root: str, n_shards: int, from_db: Optional[str] = None) -> "ShardedStore":
+        """
+        New sharded root with n_shards. from_db seeds it with an existing single-file store:
+        the file becomes the first shard and add_shard() spreads its vendors over the rest.
+        """
+        sharded = cls(root)
+        if sharded._shards:
+            raise ValueError(f"{root} already has shards")
+        if from_db:
+            src = Store(from_db)  # brings it up to the current schema first
+            dst = sqlite3.connect(os.path.join(sharded.root, "shard-00.db"))
+            src.conn.backup(dst)  # consistent snapshot, even with other writers on from_db
+            dst.close()
+            src.close()
+        sharded.add_shard("shard-00")
+        first = sharded.shards[0]
+        max_id = first.conn.execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0]
+        sharded._reserve_past(int(max_id))
+        for _ in range(n_shards - 1):
+            sharded.add_shard()
+        return sharded
+
+
+class ShardedIndex:
+    """
+    Neighbour search over every shard: each shard's own index (from open_index(conn,
+    db_path), e.g. main._neighbor_index) is searched in parallel and the hits merged.
+    add() is a no-op: the per-shard indexes catch up from their tables on the next search.
+    """
+
+    def __init__(self, sharded: ShardedStore, open_index: Callable[[Any, str], Any]):
+        self.sharded = sharded
+        self.open_index = open_index
+        self.last_scanned = 0
+
+    def nearest(self, query: np.ndarray, k: int = 3) -> List[Dict[str, Any]]:
+        def _one(shard: Shard) -> Tuple[List[Dict[str, Any]], int]:
+            conn = shard.conn
+            if conn.execute("SELECT 1 FROM invoice_embeddings LIMIT 1").fetchone() is None:
+                return [], 0
+            index = self.open_index(conn, shard.db_path)
+            return nearest_neighbors(conn, index, query, k=k), getattr(index, "last_scanned", 0)
+
+        results = self.sharded.fan_out(_one)
+        self.last_scanned = sum(n for _, n in results)
+        merged, seen = [], set()
+        # A vendor mid-move can be on two shards for a moment; ids are global, so dedupe on them
+        for hit in sorted((h for hits, _ in results for h in hits), key=lambda h: (-h["similarity"], h["invoice_id"])):
+            if hit["invoice_id"] not in seen:
+                seen.add(hit["invoice_id"])
+                merged.append(hit)
+        return merged[:k]
+
+    def add(self, invoice_id: int, embedding: np.ndarray) -> None:
+        pass
+
+
+# -------------------------
+# Row moves
+# -------------------------
+def _copy_rows(conn, table: str, where: str) -> int:
+    """INSERT OR IGNORE main.<table> rows matching `where` into dst.<table>, by column name."""
+    cols = ", ".join(r[1] for r in conn.execute(f"PRAGMA main.table_info({table})"))
+    cur = conn.execute(f"INSERT OR IGNORE INTO dst.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE {where}")
+    return cur.rowcount
+
+
+def _copy_invoices(conn, ids: str) -> int:
+    """Copy the invoices whose id is in the `ids` subquery, with their per-invoice rows."""
+    copied = _copy_rows(conn, "invoices", f"id IN ({ids})")
+    for table in _INVOICE_TABLES:
+        _copy_rows(conn, table, f"invoice_id IN ({ids})")
+    return copied
+
+
+def _rebuild_vendor_tables(conn, schema: str, keys: List[str]) -> None:
+    """
+    vendor_keys, vendor_amount_stats and vendor_amount_sketches for these vendors, recomputed
+    from the invoice rows in `schema` (same rules as insert_invoice/update_vendor_amount_stats).
+    """
+    for key in keys:
+        if not key:
+            continue
+        rows = conn.execute(f"SELECT vendor_name, total_amount FROM {schema}.invoices WHERE vendor_norm = ?", (key,)).fetchall()
+        if not rows:
+            continue
+        conn.execute(f"INSERT OR REPLACE INTO {schema}.vendor_keys (vendor_norm, n) VALUES (?, ?)", (key, len(rows)))
+        by_name: Dict[str, List[float]] = defaultdict(list)
+        for name, amount in rows:
+            if name and amount is not None:
+                by_name[name].append(float(amount))
+        for name, xs in by_name.items():
+            arr = np.asarray(xs)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {schema}.vendor_amount_stats (vendor_name, n, mean, m2) VALUES (?, ?, ?, ?)",
+                (name, int(arr.size), float(arr.mean()), float(((arr - arr.mean()) ** 2).sum())),
+            )
+        amounts = [x for xs in by_name.values() for x in xs]
+        if amounts:
+            sk = KLLSketch.from_values(amounts)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {schema}.vendor_amount_sketches (vendor_norm, n, sketch) VALUES (?, ?, ?)",
+                (key, sk.n, sk.to_bytes()),
+            )
+
+
+def _drop_vendor_tables(conn, schema: str, keys: List[str]) -> None:
+    moving = set(keys)
+    conn.executemany(f"DELETE FROM {schema}.vendor_keys WHERE vendor_norm = ?", ((k,) for k in keys))
+    conn.executemany(f"DELETE FROM {schema}.vendor_amount_sketches WHERE vendor_norm = ?", ((k,) for k in keys))
+    names = [r[0] for r in conn.execute(f"SELECT vendor_name FROM {schema}.vendor_amount_stats")]
+    conn.executemany(
+        f"DELETE FROM {schema}.vendor_amount_stats WHERE vendor_name = ?",
+        ((n,) for n in names if norm_key(n) in moving),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a vendor-sharded InvoiceGuard store")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_init = sub.add_parser("init", help="Create a sharded root")
+    p_init.add_argument("root")
+    p_init.add_argument("--shards", type=int, default=4)
+    p_init.add_argument("--from", dest="from_db", default=None, help="Existing single-file DB to split")
+    p_add = sub.add_parser("add", help="Add a shard and move the vendors that hash to it")
+    p_add.add_argument("root")
+    p_add.add_argument("--name", default=None)
+    p_rebalance = sub.add_parser("rebalance", help="Finish an interrupted add")
+    p_rebalance.add_argument("root")
+    p_status = sub.add_parser("status", help="Rows per shard")
+    p_status.add_argument("root")
+    args = parser.parse_args()
+
+    if args.cmd == "init":
+        sharded = ShardedStore.create(args.root, args.shards, from_db=args.from_db)
+    else:
+        sharded = ShardedStore(args.root)
+        if args.cmd == "add":
+            print(json.dumps(sharded.add_shard(args.name)))
+        elif args.cmd == "rebalance":
+            print(json.dumps(sharded.rebalance()))
+    for row in sharded.status():
+        print(json.dumps(row))
+    sharded.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# startup.py
+"""
+--startup-profile support: per-module import times and named init steps.
+
+Kept dependency-free so it can be installed before anything heavy is imported.
+When profiling is off, step() is a shared no-op context manager.
+"""
+from __future__ import annotations
+
+import builtins
+import contextlib
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+_PROFILER: Optional["StartupProfiler"] = None
+
+
+class StartupProfiler:
+    """
+    Wraps builtins.__import__ to time each module's first import, like `python -X importtime`:
+    cumulative = wall time of the import including its own imports, self = minus those.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.imports: Dict[str, List[float]] = {}  # name -> [cumulative_s, self_s]
+        self.steps: List[Tuple[str, float]] = []
+        self._stack: List[List[float]] = []  # per open import: [child time]
+        self._orig_import = builtins.__import__
+
+    def install(self) -> "StartupProfiler":
+        builtins.__import__ = self._import
+        return self
+
+    def uninstall(self) -> None:
+        builtins.__import__ = self._orig_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        self._stack.append([0.0])
+        t = time.perf_counter()
+        try:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        finally:
+            cum = time.perf_counter() - t
+            children = self._stack.pop()[0]
+            if self._stack:
+                self._stack[-1][0] += cum
+            self.imports[name] = [cum, cum - children]
+
+    def report(self, top: int = 25) -> str:
+        lines = [f"startup profile (total {time.perf_counter() - self.t0:.3f}s)", "  imports (top by cumulative):"]
+        ranked = sorted(self.imports.items(), key=lambda kv: -kv[1][0])[:top]
+        for name, (cum, own) in ranked:
+            lines.append(f"    {cum * 1000:9.1f} ms  self {own * 1000:8.1f} ms  {name}")
+        if self.steps:
+            lines.append("  init steps:")
+            for name, dt in self.steps:
+                lines.append(f"    {dt * 1000:9.1f} ms  {name}")
+        return "\n".join(lines)
+
+
+def enable() -> StartupProfiler:
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = StartupProfiler().install()
+    return _PROFILER
+
+
+def profiler() -> Optional[StartupProfiler]:
+    return _PROFILER
+
+
+_NOOP = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _timed(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _PROFILER.steps.append((name, time.perf_counter() - t))
+
+
+def step(name: str):
+    """`with step("embedder.load"): ...` records an init step when profiling is on."""
+    return _timed(name) if _PROFILER is not None else _NOOP
@@ -1,16 +1,24 @@
 # store.py
 from __future__ import annotations
 
+import contextlib
+import json
 import os
 import sqlite3
-from typing import Any, Dict, List, Optional
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 
+from ml import quantize
+from ml.sketch import KLLSketch
+from startup import step
+from tracing import span
+from utils import norm_key
 
 SCHEMA = """
-PRAGMA journal_mode=WAL;
-
 CREATE TABLE IF NOT EXISTS invoices (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   vendor_name TEXT,
@@ -20,15 +28,25 @@ CREATE TABLE IF NOT EXISTS invoices (
   currency TEXT,
   source_file TEXT,
   raw_text TEXT,
-  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  vendor_norm TEXT,
+  invoice_norm TEXT
 );
 
+-- Distinct normalized vendors; fuzzy vendor blocking scans this instead of invoices
+CREATE TABLE IF NOT EXISTS vendor_keys (
+  vendor_norm TEXT PRIMARY KEY,
+  n INTEGER NOT NULL
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS invoice_embeddings (
   invoice_id INTEGER NOT NULL,
   model_name TEXT NOT NULL,
   dim INTEGER NOT NULL,
   embedding BLOB NOT NULL,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  codec TEXT NOT NULL DEFAULT 'f32',  -- f32 | f16 | i8, see ml/quantize.py
+  scale REAL,                         -- per-vector scale for i8
   PRIMARY KEY (invoice_id, model_name),
   FOREIGN KEY(invoice_id) REFERENCES invoices(id)
 );
@@ -40,6 +58,24 @@ CREATE TABLE IF NOT EXISTS vendor_amount_stats (
   m2 REAL NOT NULL
 );
 
+-- Per-vendor KLL quantile sketch (keyed like the risk rules, by normalized vendor)
+CREATE TABLE IF NOT EXISTS vendor_amount_sketches (
+  vendor_norm TEXT PRIMARY KEY,
+  n INTEGER NOT NULL,
+  sketch BLOB NOT NULL
+);
+
+-- Content-addressed OCR cache: same image bytes + same OCR stack -> same text/fields
+CREATE TABLE IF NOT EXISTS ocr_cache (
+  image_sha256 TEXT PRIMARY KEY,
+  ocr_version TEXT NOT NULL,
+  raw_text TEXT NOT NULL,
+  fields_json TEXT NOT NULL,
+  hits INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  last_used REAL NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS price_checks (
   invoice_id INTEGER PRIMARY KEY,
   product_desc TEXT,
@@ -51,39 +87,313 @@ CREATE TABLE IF NOT EXISTS price_checks (
   model_name TEXT,
   raw_output TEXT,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  cache_key TEXT,    -- normalized product + amount bucket, see llm_price_check.cache_key
+  checked_at REAL,   -- epoch seconds of the LLM answer (reused answers keep the original)
+  total_amount REAL,
+  currency TEXT,
+  desc_model TEXT,       -- embedding of product_desc for the semantic cache (float32 BLOB)
+  desc_embedding BLOB,
   FOREIGN KEY(invoice_id) REFERENCES invoices(id)
 );
 """
 
+# Created after _migrate() so they also apply to DBs that predate the *_norm columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_inv ON invoices(vendor_norm, invoice_norm, id);
+CREATE INDEX IF NOT EXISTS idx_ocr_cache_lru ON ocr_cache(last_used);
+CREATE INDEX IF NOT EXISTS idx_price_checks_cache ON price_checks(cache_key, checked_at);
+"""
+
+OCR_CACHE_MAX_ROWS = int(os.getenv("INVOICE_GUARD_OCR_CACHE_MAX", "10000"))
+# put_cached_ocr counts rows against the cap only every this many puts per connection
+OCR_CACHE_TRIM_EVERY = int(os.getenv("INVOICE_GUARD_OCR_CACHE_TRIM_EVERY", "64"))
+
+# Bump when SCHEMA / _migrate change; stored in PRAGMA user_version so opens skip the bootstrap
+SCHEMA_VERSION = 4
+
+# Per-connection tuning. Under WAL, synchronous=NORMAL only fsyncs at checkpoints: a crash
+# can lose the last commits but never corrupts the DB or splits a transaction.
+PRAGMAS = (
+    # NORMAL: WAL commits don't fsync (a power cut can drop the last commits, never corrupt);
+    # FULL fsyncs every commit, which is where grouped commits (writer.WriteQueue) pay off most
+    f"PRAGMA synchronous={os.getenv('INVOICE_GUARD_SYNCHRONOUS', 'NORMAL')}",
+    "PRAGMA mmap_size=268435456",  # 256 MiB
+    "PRAGMA cache_size=-65536",  # 64 MiB
+    "PRAGMA temp_store=MEMORY",
+)
+
 
 # -------------------------
 # Connection / bootstrap
 # -------------------------
-def connect(db_path: str) -> sqlite3.Connection:
+class StoreConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection that remembers how deep it is in unit_of_work() blocks and what to
+    run once the outermost one commits (see after_commit), plus put_cached_ocr's
+    housekeeping state.
+    """
+
+    uow_depth = 0
+    post_commit: Optional[List[Callable[[], None]]] = None
+    ocr_purged: Optional[str] = None  # ocr_version whose stale rows this connection already purged
+    ocr_puts = 0
+
+
+def connect(db_path: str, check_same_thread: bool = True) -> StoreConnection:
     # Ensure parent directory exists
     parent = os.path.dirname(os.path.abspath(db_path))
     if parent and not os.path.exists(parent):
         os.makedirs(parent, exist_ok=True)
 
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    conn.executescript(SCHEMA)
-    conn.commit()
+    with step("store.connect"):
+        conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, factory=StoreConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _bootstrap(conn)
     return conn
 
 
+def _statements(script: str) -> Iterator[str]:
+    """Split a SQL script into statements (executescript would commit our transaction)."""
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            yield buf
+            buf = ""
+
+
+def _bootstrap(conn: sqlite3.Connection) -> None:
+    """
+    Create/migrate the schema once per DB file. Opens of an up-to-date DB only read
+    PRAGMA user_version; otherwise everything runs in one IMMEDIATE transaction, so
+    concurrent openers wait for each other and a crash leaves the old version behind.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            for stmt in _statements(SCHEMA):
+                conn.execute(stmt)
+            _migrate(conn)
+            for stmt in _statements(INDEXES):
+                conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+@contextlib.contextmanager
+def unit_of_work(conn: StoreConnection) -> Iterator[StoreConnection]:
+    """
+    Group writers (called with commit=False) into one transaction: one commit, one fsync,
+    and all-or-nothing if the process dies or an exception escapes.
+
+    The outermost block commits (joining writes already pending on the connection);
+    nested blocks are savepoints, so an inner failure only undoes its own writes.
+    Callbacks registered with after_commit run once the outermost block has committed.
+    """
+    outer = conn.uow_depth == 0
+    if outer:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")  # take the write lock up front: no read->write upgrade
+        conn.post_commit = []
+    else:
+        conn.execute("SAVEPOINT unit_of_work")
+        mark = len(conn.post_commit)
+    conn.uow_depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if outer:
+            conn.rollback()
+            conn.post_commit = None
+        else:
+            conn.execute("ROLLBACK TO unit_of_work")
+            conn.execute("RELEASE unit_of_work")
+            del conn.post_commit[mark:]  # registered for writes that were just undone
+        raise
+    else:
+        if outer:
+            with span("db_commit"):
+                conn.commit()
+        else:
+            conn.execute("RELEASE unit_of_work")
+    finally:
+        conn.uow_depth -= 1
+
+    if outer:
+        hooks, conn.post_commit = conn.post_commit, None
+        for fn in hooks:
+            _run_hook(fn)
+
+
+def after_commit(conn: StoreConnection, fn: Callable[[], None]) -> None:
+    """
+    Run fn() once conn's outermost unit_of_work has committed (now, outside of one). It
+    is dropped if that transaction, or the savepoint it was registered in, rolls back.
+    For side effects outside SQLite that must only reflect committed rows, e.g. saving
+    an index sidecar. A failing callback is reported, not raised: the rows are already
+    committed.
+    """
+    if conn.uow_depth == 0:
+        _run_hook(fn)
+    else:
+        conn.post_commit.append(fn)
+
+
+def _run_hook(fn: Callable[[], None]) -> None:
+    try:
+        fn()
+    except Exception as e:
+        print(f"store: post-commit callback failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+
+class Store:
+    """
+    One DB file shared across threads: each thread lazily gets (and keeps) its own
+    connection, so request handlers and executor threads reuse warm connections.
+
+      store = Store("data/invoices.db")
+      with store.unit_of_work() as conn:
+          invoice_id = insert_invoice(conn, rec, commit=False)
+          upsert_embedding(conn, invoice_id, emb, model, commit=False)
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: List[StoreConnection] = []
+
+    @property
+    def conn(self) -> StoreConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False only so close() can run from another thread
+            conn = self._local.conn = connect(self.db_path, check_same_thread=False)
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def unit_of_work(self):
+        return unit_of_work(self.conn)
+
+    def close(self) -> None:
+        """Close every thread's connection (call at shutdown, once no thread uses them)."""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    _migrate_norm_keys(conn)
+    _migrate_amount_sketches(conn)
+    _migrate_embedding_codec(conn)
+    _migrate_price_check_cache(conn)
+    _migrate_price_check_semantic(conn)
+    _drop_unused_indexes(conn)
+
+
+def _migrate_norm_keys(conn: sqlite3.Connection) -> None:
+    """Add + backfill the normalized match keys on DBs created before they existed."""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(invoices)")}
+    if "vendor_norm" in cols:
+        return
+    conn.execute("ALTER TABLE invoices ADD COLUMN vendor_norm TEXT")
+    conn.execute("ALTER TABLE invoices ADD COLUMN invoice_norm TEXT")
+
+    cur = conn.execute("SELECT id, vendor_name, invoice_number FROM invoices ORDER BY id")
+    while True:
+        rows = cur.fetchmany(10_000)
+        if not rows:
+            break
+        conn.executemany(
+            "UPDATE invoices SET vendor_norm = ?, invoice_norm = ? WHERE id = ?",
+            [(norm_key(r["vendor_name"]), norm_key(r["invoice_number"]), r["id"]) for r in rows],
+        )
+        for r in rows:
+            _index_vendor_key(conn, norm_key(r["vendor_name"]))
+
+
+def _migrate_amount_sketches(conn: sqlite3.Connection) -> None:
+    """Build vendor sketches from history once, for DBs that predate them."""
+    if conn.execute("SELECT 1 FROM vendor_amount_sketches LIMIT 1").fetchone():
+        return
+    cur = conn.execute(
+        """
+        SELECT vendor_norm, total_amount FROM invoices
+        WHERE vendor_norm != '' AND total_amount IS NOT NULL
+        ORDER BY vendor_norm, id
+        """
+    )
+    sketches: Dict[str, KLLSketch] = {}
+    for r in cur:
+        sketches.setdefault(r["vendor_norm"], KLLSketch()).update(float(r["total_amount"]))
+    conn.executemany(
+        "INSERT INTO vendor_amount_sketches (vendor_norm, n, sketch) VALUES (?, ?, ?)",
+        [(v, sk.n, sk.to_bytes()) for v, sk in sketches.items()],
+    )
+
+
+def _migrate_embedding_codec(conn: sqlite3.Connection) -> None:
+    """Older DBs stored float32 only; existing rows become codec 'f32'."""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(invoice_embeddings)")}
+    if "codec" in cols:
+        return
+    conn.execute("ALTER TABLE invoice_embeddings ADD COLUMN codec TEXT NOT NULL DEFAULT 'f32'")
+    conn.execute("ALTER TABLE invoice_embeddings ADD COLUMN scale REAL")
+
+
+def _migrate_price_check_cache(conn: sqlite3.Connection) -> None:
+    """Rows from before the price-check cache have no key, so they are never reused."""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(price_checks)")}
+    if "cache_key" in cols:
+        return
+    conn.execute("ALTER TABLE price_checks ADD COLUMN cache_key TEXT")
+    conn.execute("ALTER TABLE price_checks ADD COLUMN checked_at REAL")
+
+
+def _migrate_price_check_semantic(conn: sqlite3.Connection) -> None:
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(price_checks)")}
+    if "desc_embedding" in cols:
+        return
+    for col, typ in (("total_amount", "REAL"), ("currency", "TEXT"), ("desc_model", "TEXT"), ("desc_embedding", "BLOB")):
+        conn.execute(f"ALTER TABLE price_checks ADD COLUMN {col} {typ}")
+
+
+def _drop_unused_indexes(conn: sqlite3.Connection) -> None:
+    """
+    Vendor medians come from vendor_amount_sketches now, so nothing reads the
+    (vendor_norm, total_amount) index; lookups by vendor_norm alone use idx_invoices_vendor_inv.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_invoices_vendor_amount")
+
+
 # -------------------------
 # Invoices
 # -------------------------
-def insert_invoice(conn: sqlite3.Connection, rec: Dict[str, Any]) -> int:
+def insert_invoice(
+    conn: sqlite3.Connection, rec: Dict[str, Any], commit: bool = True, invoice_id: Optional[int] = None
+) -> int:
+    """invoice_id=None lets SQLite assign the id; sharded stores pass one from the catalog."""
     cur = conn.cursor()
     cur.execute(
         """
         INSERT INTO invoices
-        (vendor_name, invoice_number, invoice_date, total_amount, currency, source_file, raw_text)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        (id, vendor_name, invoice_number, invoice_date, total_amount, currency, source_file, raw_text,
+         vendor_norm, invoice_norm)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
+            invoice_id,
             rec.get("vendor_name"),
             rec.get("invoice_number"),
             rec.get("invoice_date"),
@@ -91,10 +401,15 @@ def insert_invoice(conn: sqlite3.Connection, rec: Dict[str, Any]) -> int:
             rec.get("currency"),
             rec.get("source_file"),
             rec.get("raw_text"),
+            norm_key(rec.get("vendor_name")),
+            norm_key(rec.get("invoice_number")),
         ),
     )
-    conn.commit()
-    return int(cur.lastrowid)
+    invoice_id = int(cur.lastrowid)
+    _index_vendor_key(conn, norm_key(rec.get("vendor_name")))
+    if commit:
+        conn.commit()
+    return invoice_id
 
 
 def fetch_all_invoices(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
@@ -123,6 +438,109 @@ def fetch_invoice_by_id(conn: sqlite3.Connection, invoice_id: int) -> Optional[D
     return dict(row) if row else None
 
 
+def fetch_invoices_by_ids(conn: sqlite3.Connection, invoice_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Batched lookup (one IN (...) query per 900 ids) instead of N fetch_invoice_by_id calls."""
+    out: Dict[int, Dict[str, Any]] = {}
+    ids = [int(i) for i in invoice_ids]
+    cur = conn.cursor()
+    for start in range(0, len(ids), 900):  # stay under SQLite's bound-variable limit
+        chunk = ids[start:start + 900]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            f"""
+            SELECT id, vendor_name, invoice_number, invoice_date, total_amount, currency, source_file
+            FROM invoices
+            WHERE id IN ({placeholders})
+            """,
+            chunk,
+        )
+        for r in cur.fetchall():
+            out[int(r["id"])] = dict(r)
+    return out
+
+
+# -------------------------
+# Duplicate lookups (indexed; used by risk.score_invoice_indexed)
+# -------------------------
+_MATCH_COLS = "id, vendor_name, invoice_number, invoice_date, total_amount, currency, source_file"
+
+
+def _index_vendor_key(conn: sqlite3.Connection, vendor_norm: str) -> None:
+    if not vendor_norm:
+        return
+    conn.execute(
+        "INSERT INTO vendor_keys (vendor_norm, n) VALUES (?, 1) ON CONFLICT(vendor_norm) DO UPDATE SET n = n + 1",
+        (vendor_norm,),
+    )
+
+
+def fetch_vendor_keys(conn: sqlite3.Connection) -> List[str]:
+    cur = conn.cursor()
+    cur.execute("SELECT vendor_norm FROM vendor_keys")
+    return [r[0] for r in cur.fetchall()]
+
+
+def find_exact_duplicate(conn: sqlite3.Connection, vendor_norm: str, invoice_norm: str) -> Optional[Dict[str, Any]]:
+    """Oldest invoice with the same normalized vendor + invoice number (index point lookup)."""
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT {_MATCH_COLS}
+        FROM invoices
+        WHERE vendor_norm = ? AND invoice_norm = ?
+        ORDER BY id ASC
+        LIMIT 1
+        """,
+        (vendor_norm, invoice_norm),
+    )
+    row = cur.fetchone()
+    return dict(row) if row else None
+
+
+def fetch_invoice_keys(
+    conn: sqlite3.Connection, vendor_norms: List[str], invoice_norm: str, min_ratio: float = 0.85
+) -> List[Tuple[int, str]]:
+    """
+    (id, invoice_norm) for the given vendors, read from the covering
+    (vendor_norm, invoice_norm, id) index. Lengths are pre-filtered because
+    ratio(a, b) can never exceed 1 - |la - lb| / (la + lb).
+    """
+    n = len(invoice_norm)
+    slack = 1.0 - min_ratio + 0.01  # a little looser than the bound, for float rounding
+    out: List[Tuple[int, str]] = []
+    cur = conn.cursor()
+    for start in range(0, len(vendor_norms), 900):
+        chunk = vendor_norms[start:start + 900]
+        placeholders = ",".join("?" * len(chunk))
+        cur.execute(
+            f"""
+            SELECT id, invoice_norm
+            FROM invoices
+            WHERE vendor_norm IN ({placeholders})
+              AND invoice_norm != ''
+              AND ABS(LENGTH(invoice_norm) - ?) < ? * (LENGTH(invoice_norm) + ?)
+            """,
+            (*chunk, n, slack, n),
+        )
+        out.extend((int(r[0]), r[1]) for r in cur.fetchall())
+    return out
+
+
+def get_vendor_amount_sketch(conn: sqlite3.Connection, vendor_norm: str) -> Optional[KLLSketch]:
+    cur = conn.cursor()
+    cur.execute("SELECT sketch FROM vendor_amount_sketches WHERE vendor_norm = ?", (vendor_norm,))
+    row = cur.fetchone()
+    return KLLSketch.from_bytes(row["sketch"]) if row else None
+
+
+def vendor_amounts_summary(conn: sqlite3.Connection, vendor_norm: str) -> Tuple[int, Optional[float]]:
+    """(count of amounts, upper median) for one vendor, from its sketch; no history scan."""
+    sk = get_vendor_amount_sketch(conn, vendor_norm)
+    if sk is None:
+        return 0, None
+    return sk.n, sk.quantile(0.5)
+
+
 # -------------------------
 # Embeddings
 # -------------------------
@@ -131,38 +549,69 @@ def _to_blob(vec: np.ndarray) -> bytes:
     return v.tobytes(order="C")
 
 
-def _from_blob(blob: bytes, dim: int) -> np.ndarray:
-    arr = np.frombuffer(blob, dtype=np.float32)
-    if dim > 0 and arr.size != dim:
-        # If dim mismatch, still return best-effort
-        return arr.astype(np.float32)
-    return arr.astype(np.float32)
+def _from_blob(blob: bytes, dim: int, codec: str = "f32", scale: Optional[float] = None) -> np.ndarray:
+    # f32 rows are returned as a read-only view of the blob; no per-row copy
+    return quantize.decode(blob, codec, scale)
 
 
-def upsert_embedding(conn: sqlite3.Connection, invoice_id: int, embedding: np.ndarray, model_name: str) -> None:
+# A re-embedded vector replaces its row under a new, higher rowid: EmbeddingMatrix.refresh
+# and the IVF catch_up only read rowid > last seen, so an in-place update would never reach
+# other processes. The rowid is taken before the old row goes, so replacing the newest row
+# still moves it forward.
+_UPSERT_EMBEDDING = """
+INSERT OR REPLACE INTO invoice_embeddings (rowid, invoice_id, model_name, dim, embedding, codec, scale)
+VALUES ((SELECT COALESCE(MAX(rowid), 0) + 1 FROM invoice_embeddings), ?, ?, ?, ?, ?, ?)
+"""
+
+
+def upsert_embedding(
+    conn: sqlite3.Connection,
+    invoice_id: int,
+    embedding: np.ndarray,
+    model_name: str,
+    commit: bool = True,
+    codec: Optional[str] = None,
+) -> None:
     vec = np.asarray(embedding, dtype=np.float32)
     dim = int(vec.size)
+    codec = quantize.check_codec(codec or quantize.STORAGE_CODEC)
+    blob, scale = quantize.encode(vec, codec)
 
     cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO invoice_embeddings (invoice_id, model_name, dim, embedding)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(invoice_id, model_name) DO UPDATE SET
-          dim=excluded.dim,
-          embedding=excluded.embedding,
-          created_at=CURRENT_TIMESTAMP
-        """,
-        (invoice_id, model_name, dim, _to_blob(vec)),
+    cur.execute(_UPSERT_EMBEDDING, (invoice_id, model_name, dim, blob, codec, scale))
+    if commit:
+        conn.commit()
+
+
+def upsert_embeddings(
+    conn: sqlite3.Connection,
+    invoice_ids: List[int],
+    mat: np.ndarray,
+    model_name: str,
+    commit: bool = True,
+    codec: Optional[str] = None,
+) -> None:
+    """Bulk upsert_embedding: rows of mat are quantized together and written with one executemany."""
+    mat = np.asarray(mat, dtype=np.float32)
+    codec = quantize.check_codec(codec or quantize.STORAGE_CODEC)
+    codes, scales = quantize.quantize(mat, codec)
+    dim = int(mat.shape[1]) if mat.ndim == 2 else 0
+    conn.executemany(
+        _UPSERT_EMBEDDING,
+        (
+            (int(i), model_name, dim, codes[j].tobytes(order="C"), codec, float(scales[j]) if scales is not None else None)
+            for j, i in enumerate(invoice_ids)
+        ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 def fetch_embeddings(conn: sqlite3.Connection, model_name: str) -> List[Dict[str, Any]]:
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT invoice_id, model_name, dim, embedding
+        SELECT invoice_id, model_name, dim, embedding, codec, scale
         FROM invoice_embeddings
         WHERE model_name = ?
         """,
@@ -175,14 +624,138 @@ def fetch_embeddings(conn: sqlite3.Connection, model_name: str) -> List[Dict[str
                 "invoice_id": int(r["invoice_id"]),
                 "model_name": r["model_name"],
                 "dim": int(r["dim"]),
-                "embedding": _from_blob(r["embedding"], int(r["dim"])),
+                "embedding": _from_blob(r["embedding"], int(r["dim"]), r["codec"], r["scale"]),
             }
         )
     return out
 
 
+def _fetch_embedding_rows(
+    conn: sqlite3.Connection, model_name: str, after_rowid: int
+) -> Tuple[List[sqlite3.Row], int, int]:
+    """Rows with rowid > after_rowid in rowid order -> (rows, dim, max_rowid)."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT rowid, invoice_id, dim, embedding, codec, scale
+        FROM invoice_embeddings
+        WHERE model_name = ? AND rowid > ?
+        ORDER BY rowid ASC
+        """,
+        (model_name, int(after_rowid)),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return [], 0, int(after_rowid)
+
+    max_rowid = int(rows[-1]["rowid"])
+    dim = int(rows[-1]["dim"])
+    # Skip rows whose dim does not match (e.g. a half-migrated model); they can't share a matrix
+    rows = [
+        r for r in rows
+        if int(r["dim"]) == dim and len(r["embedding"]) == quantize.bytes_per_vector(r["codec"], dim)
+    ]
+    return rows, dim, max_rowid
+
+
+def _join_blobs(rows: List[sqlite3.Row], dim: int, codec: str) -> np.ndarray:
+    """Same-codec rows -> one writable [n, dim] array from a single frombuffer."""
+    arr = np.frombuffer(b"".join(r["embedding"] for r in rows), dtype=quantize.dtype_of(codec))
+    return arr.reshape(len(rows), dim).copy()  # writable, owns its memory
+
+
+def _rows_to_f32(rows: List[sqlite3.Row], dim: int) -> np.ndarray:
+    mat = np.empty((len(rows), dim), dtype=np.float32)
+    by_codec: Dict[str, List[int]] = {}
+    for i, r in enumerate(rows):
+        by_codec.setdefault(r["codec"], []).append(i)
+    for codec, idx in by_codec.items():
+        group = [rows[i] for i in idx]
+        scales = np.array([r["scale"] for r in group], dtype=np.float32) if codec == "i8" else None
+        mat[idx] = quantize.dequantize(_join_blobs(group, dim, codec), scales)
+    return mat
+
+
+def fetch_embedding_matrix(
+    conn: sqlite3.Connection, model_name: str, after_rowid: int = 0
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Load embeddings as (invoice_ids int64[n], matrix float32[n, dim], max_rowid).
+
+    BLOBs are concatenated and decoded with a single frombuffer instead of one array per row
+    (one per codec when rows were stored with different codecs).
+    Only rows with rowid > after_rowid are returned, so callers can refresh incrementally.
+    """
+    rows, dim, max_rowid = _fetch_embedding_rows(conn, model_name, after_rowid)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32), max_rowid
+
+    ids = np.fromiter((int(r["invoice_id"]) for r in rows), dtype=np.int64, count=len(rows))
+    if all(r["codec"] == "f32" for r in rows):
+        return ids, _join_blobs(rows, dim, "f32"), max_rowid
+    return ids, _rows_to_f32(rows, dim), max_rowid
+
+
+def fetch_embedding_codes(
+    conn: sqlite3.Connection, model_name: str, codec: str, after_rowid: int = 0
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], int]:
+    """
+    Like fetch_embedding_matrix, but returns the matrix in `codec`:
+    (invoice_ids, codes[n, dim], scales float32[n] for i8 else None, max_rowid).
+    Rows already stored in that codec are adopted as-is; others are re-encoded.
+    """
+    quantize.check_codec(codec)
+    rows, dim, max_rowid = _fetch_embedding_rows(conn, model_name, after_rowid)
+    ids = np.fromiter((int(r["invoice_id"]) for r in rows), dtype=np.int64, count=len(rows))
+    if not rows:
+        codes, scales = quantize.quantize(np.zeros((0, dim), dtype=np.float32), codec)
+        return ids, codes, scales, max_rowid
+
+    if all(r["codec"] == codec for r in rows):
+        scales = np.array([r["scale"] for r in rows], dtype=np.float32) if codec == "i8" else None
+        return ids, _join_blobs(rows, dim, codec), scales, max_rowid
+    codes, scales = quantize.quantize(_rows_to_f32(rows, dim), codec)
+    return ids, codes, scales, max_rowid
+
+
+def fetch_embedding_vectors(
+    conn: sqlite3.Connection, model_name: str, invoice_ids: List[int]
+) -> Dict[int, np.ndarray]:
+    """invoice_id -> float32 vector for a handful of ids (re-ranking candidates)."""
+    out: Dict[int, np.ndarray] = {}
+    ids = [int(i) for i in invoice_ids]
+    for start in range(0, len(ids), 900):  # stay under SQLite's bound-variable limit
+        chunk = ids[start:start + 900]
+        placeholders = ",".join("?" * len(chunk))
+        for r in conn.execute(
+            f"""
+            SELECT invoice_id, dim, embedding, codec, scale
+            FROM invoice_embeddings
+            WHERE model_name = ? AND invoice_id IN ({placeholders})
+            """,
+            (model_name, *chunk),
+        ):
+            out[int(r["invoice_id"])] = _from_blob(r["embedding"], int(r["dim"]), r["codec"], r["scale"])
+    return out
+
+
+def embedding_table_state(conn: sqlite3.Connection, model_name: str) -> Tuple[int, int]:
+    """(row count, max rowid) for one model; cheap staleness check for derived indexes."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*) AS n, COALESCE(MAX(rowid), 0) AS max_rowid
+        FROM invoice_embeddings
+        WHERE model_name = ?
+        """,
+        (model_name,),
+    )
+    row = cur.fetchone()
+    return int(row["n"]), int(row["max_rowid"])
+
+
 # -------------------------
-# Vendor amount stats (Welford)
+# Vendor amount stats (Welford + KLL quantile sketch)
 # -------------------------
 def get_vendor_amount_stats(conn: sqlite3.Connection, vendor_name: str) -> Optional[Dict[str, Any]]:
     cur = conn.cursor()
@@ -204,67 +777,175 @@ def get_vendor_amount_stats(conn: sqlite3.Connection, vendor_name: str) -> Optio
     var = (m2 / (n - 1)) if n >= 2 else 0.0
     std = float(np.sqrt(var)) if var > 0 else 0.0
 
-    return {"vendor_name": row["vendor_name"], "n": n, "mean": mean, "m2": m2, "std": std}
+    out = {"vendor_name": row["vendor_name"], "n": n, "mean": mean, "m2": m2, "std": std}
 
+    # Robust location/spread for skewed amounts, when the vendor has a sketch
+    sk = get_vendor_amount_sketch(conn, norm_key(vendor_name))
+    if sk is not None and sk.n >= 2:
+        q25, median, q75 = sk.quantiles([0.25, 0.5, 0.75])
+        out.update({"q25": q25, "median": median, "q75": q75})
+    return out
 
-def update_vendor_amount_stats(conn: sqlite3.Connection, vendor_name: str, amount: float) -> None:
-    cur = conn.cursor()
-    cur.execute(
+
+def update_vendor_amount_stats(
+    conn: sqlite3.Connection, vendor_name: str, amount: float, commit: bool = True
+) -> None:
+    """
+    One Welford step as a single upsert. SET expressions see the old row, so concurrent
+    writers (threads or processes) can't lose updates between a read and a write.
+    The sketch is read-modify-write, so the write lock is taken before it is read.
+    """
+    x = float(amount)
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
         """
-        SELECT n, mean, m2
-        FROM vendor_amount_stats
-        WHERE vendor_name = ?
+        INSERT INTO vendor_amount_stats (vendor_name, n, mean, m2) VALUES (?, 1, ?, 0.0)
+        ON CONFLICT(vendor_name) DO UPDATE SET
+          n = n + 1,
+          mean = mean + (excluded.mean - mean) / (n + 1),
+          m2 = m2 + (excluded.mean - mean) * (excluded.mean - (mean + (excluded.mean - mean) / (n + 1)))
         """,
-        (vendor_name,),
+        (vendor_name, x),
     )
-    row = cur.fetchone()
+    _update_amount_sketch(conn, norm_key(vendor_name), x)
+    if commit:
+        conn.commit()
 
-    x = float(amount)
 
-    if not row:
-        # First observation
-        cur.execute(
-            """
-            INSERT INTO vendor_amount_stats (vendor_name, n, mean, m2)
-            VALUES (?, ?, ?, ?)
-            """,
-            (vendor_name, 1, x, 0.0),
-        )
-        conn.commit()
+def _update_amount_sketch(conn: sqlite3.Connection, vendor_norm: str, amount: float) -> None:
+    if not vendor_norm:
         return
+    sk = get_vendor_amount_sketch(conn, vendor_norm) or KLLSketch()
+    sk.update(amount)
+    conn.execute(
+        """
+        INSERT INTO vendor_amount_sketches (vendor_norm, n, sketch) VALUES (?, ?, ?)
+        ON CONFLICT(vendor_norm) DO UPDATE SET n = excluded.n, sketch = excluded.sketch
+        """,
+        (vendor_norm, sk.n, sk.to_bytes()),
+    )
 
-    n = int(row["n"])
-    mean = float(row["mean"])
-    m2 = float(row["m2"])
 
-    n2 = n + 1
-    delta = x - mean
-    mean2 = mean + delta / n2
-    delta2 = x - mean2
-    m2_2 = m2 + delta * delta2
+# -------------------------
+# OCR cache (keyed by image SHA-256; LRU-capped)
+# -------------------------
+def get_cached_ocr(
+    conn: sqlite3.Connection, image_sha256: str, ocr_version: str, commit: bool = True, touch: bool = True
+) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    (raw_text, fields) for these image bytes, if OCR'd with the same ocr_version.
+    touch=False is a pure read (no hit count / LRU update, stale rows left in place)
+    for reader threads that must not take the write lock.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT ocr_version, raw_text, fields_json FROM ocr_cache WHERE image_sha256 = ?",
+        (image_sha256,),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    if not touch:
+        return (row["raw_text"], json.loads(row["fields_json"])) if row["ocr_version"] == ocr_version else None
+    if row["ocr_version"] != ocr_version:
+        # Preprocessing / Tesseract / extractor changed since this was cached
+        cur.execute("DELETE FROM ocr_cache WHERE image_sha256 = ?", (image_sha256,))
+        if commit:
+            conn.commit()
+        return None
+    cur.execute(
+        "UPDATE ocr_cache SET hits = hits + 1, last_used = ? WHERE image_sha256 = ?",
+        (time.time(), image_sha256),
+    )
+    if commit:
+        conn.commit()
+    return row["raw_text"], json.loads(row["fields_json"])
 
+
+def put_cached_ocr(
+    conn: sqlite3.Connection,
+    image_sha256: str,
+    ocr_version: str,
+    raw_text: str,
+    fields: Dict[str, Any],
+    max_rows: Optional[int] = None,
+    commit: bool = True,
+) -> None:
+    """
+    Cache (raw_text, fields) for these image bytes. The table-wide housekeeping is
+    amortized: rows from older OCR stacks are purged once per connection and version,
+    and the LRU cap is enforced every OCR_CACHE_TRIM_EVERY puts, so the cache can run
+    that many rows per connection over max_rows between trims.
+    """
+    max_rows = OCR_CACHE_MAX_ROWS if max_rows is None else max_rows
+    cur = conn.cursor()
     cur.execute(
         """
-        UPDATE vendor_amount_stats
-        SET n = ?, mean = ?, m2 = ?
-        WHERE vendor_name = ?
+        INSERT INTO ocr_cache (image_sha256, ocr_version, raw_text, fields_json, last_used)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(image_sha256) DO UPDATE SET
+          ocr_version=excluded.ocr_version,
+          raw_text=excluded.raw_text,
+          fields_json=excluded.fields_json,
+          hits=0,
+          last_used=excluded.last_used
         """,
-        (n2, mean2, m2_2, vendor_name),
+        (image_sha256, ocr_version, raw_text, json.dumps(fields), time.time()),
     )
-    conn.commit()
+    tracked = isinstance(conn, StoreConnection)
+    if not tracked or conn.ocr_purged != ocr_version:
+        # Entries from an older OCR stack can never hit again (any that survive a rolled-back
+        # purge are still dropped one by one by get_cached_ocr)
+        cur.execute("DELETE FROM ocr_cache WHERE ocr_version != ?", (ocr_version,))
+        if tracked:
+            conn.ocr_purged = ocr_version
+    due = not tracked or conn.ocr_puts % OCR_CACHE_TRIM_EVERY == 0
+    if tracked:
+        conn.ocr_puts += 1
+    if due:
+        n = int(cur.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0])
+        if n > max_rows:
+            cur.execute(
+                """
+                DELETE FROM ocr_cache WHERE image_sha256 IN (
+                  SELECT image_sha256 FROM ocr_cache ORDER BY last_used ASC LIMIT ?
+                )
+                """,
+                (n - max_rows,),
+            )
+    if commit:
+        conn.commit()
 
 
 # -------------------------
 # Price checks (LLM output)
 # -------------------------
-def save_price_check(conn: sqlite3.Connection, invoice_id: int, product_desc: str, result: Dict[str, Any]) -> None:
+def save_price_check(
+    conn: sqlite3.Connection,
+    invoice_id: int,
+    product_desc: str,
+    result: Dict[str, Any],
+    commit: bool = True,
+    cache_key: Optional[str] = None,
+    checked_at: Optional[float] = None,
+    total_amount: Optional[float] = None,
+    currency: Optional[str] = None,
+    desc_model: Optional[str] = None,
+    desc_embedding: Optional[np.ndarray] = None,
+) -> None:
+    """
+    cache_key=None stores the row without making it reusable (e.g. failed checks).
+    desc_embedding (with desc_model) makes it findable by the semantic price-check cache.
+    """
     cur = conn.cursor()
     cur.execute(
         """
         INSERT INTO price_checks
         (invoice_id, product_desc, estimated_market_low, estimated_market_high,
-         assessment, confidence, explanation, model_name, raw_output)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+         assessment, confidence, explanation, model_name, raw_output, cache_key, checked_at,
+         total_amount, currency, desc_model, desc_embedding)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(invoice_id) DO UPDATE SET
           product_desc=excluded.product_desc,
           estimated_market_low=excluded.estimated_market_low,
@@ -274,6 +955,12 @@ def save_price_check(conn: sqlite3.Connection, invoice_id: int, product_desc: st
           explanation=excluded.explanation,
           model_name=excluded.model_name,
           raw_output=excluded.raw_output,
+          cache_key=excluded.cache_key,
+          checked_at=excluded.checked_at,
+          total_amount=excluded.total_amount,
+          currency=excluded.currency,
+          desc_model=excluded.desc_model,
+          desc_embedding=excluded.desc_embedding,
           created_at=CURRENT_TIMESTAMP
         """,
         (
@@ -286,9 +973,80 @@ def save_price_check(conn: sqlite3.Connection, invoice_id: int, product_desc: st
             result.get("explanation"),
             result.get("model"),
             result.get("raw_output"),
+            cache_key,
+            checked_at if checked_at is not None else (time.time() if cache_key else None),
+            total_amount,
+            currency,
+            desc_model if desc_embedding is not None else None,
+            _to_blob(desc_embedding) if desc_embedding is not None else None,
         ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
+
+
+_PRICE_RESULT_COLS = """
+    invoice_id, estimated_market_low, estimated_market_high, assessment, confidence,
+    explanation, model_name, raw_output, checked_at
+"""
+
+
+def _price_result(row: sqlite3.Row) -> Dict[str, Any]:
+    """price_checks row -> the dict shape run_price_check returns (+ source invoice_id, checked_at)."""
+    out = {
+        "estimated_market_low": row["estimated_market_low"],
+        "estimated_market_high": row["estimated_market_high"],
+        "assessment": row["assessment"],
+        "confidence": row["confidence"],
+        "explanation": row["explanation"],
+        "model": row["model_name"],
+        "invoice_id": row["invoice_id"],
+        "checked_at": row["checked_at"],
+    }
+    if row["raw_output"] is not None:
+        out["raw_output"] = row["raw_output"]
+    return out
+
+
+def find_cached_price_check(
+    conn: sqlite3.Connection, cache_key: str, max_age_s: float
+) -> Optional[Dict[str, Any]]:
+    """Newest reusable answer for cache_key checked within max_age_s (see _price_result)."""
+    row = conn.execute(
+        f"""
+        SELECT {_PRICE_RESULT_COLS}
+        FROM price_checks
+        WHERE cache_key = ? AND checked_at >= ?
+        ORDER BY checked_at DESC
+        LIMIT 1
+        """,
+        (cache_key, time.time() - max_age_s),
+    ).fetchone()
+    return _price_result(row) if row else None
+
+
+def get_reusable_price_check(conn: sqlite3.Connection, invoice_id: int) -> Optional[Dict[str, Any]]:
+    """A cacheable answer by source invoice id (semantic-cache hits), see _price_result."""
+    row = conn.execute(
+        f"SELECT {_PRICE_RESULT_COLS} FROM price_checks WHERE invoice_id = ? AND cache_key IS NOT NULL",
+        (int(invoice_id),),
+    ).fetchone()
+    return _price_result(row) if row else None
+
+
+def fetch_price_check_vectors(
+    conn: sqlite3.Connection, desc_model: str, after_rowid: int = 0
+) -> List[sqlite3.Row]:
+    """Reusable price checks with a description embedding, rowid > after_rowid, in rowid order."""
+    return conn.execute(
+        """
+        SELECT rowid AS rowid, invoice_id, total_amount, currency, checked_at, desc_embedding
+        FROM price_checks
+        WHERE desc_model = ? AND desc_embedding IS NOT NULL AND cache_key IS NOT NULL AND rowid > ?
+        ORDER BY rowid ASC
+        """,
+        (desc_model, int(after_rowid)),
+    ).fetchall()
 
 
 def get_price_check(conn: sqlite3.Connection, invoice_id: int) -> Optional[Dict[str, Any]]:
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# The package modules import each other flat (from store import ...), like main.py does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,74 @@
+# tests/test_extract_fields.py
+from dataclasses import asdict
+
+import pytest
+
+from extract_fields import extract_fields
+from scripts.bench_extract import legacy_extract_fields
+
+# OCR-shaped texts covering each extraction path: labelled / inline / heading / fallback
+# vendors, the date formats the fast parser handles and ones left to dateutil, and totals
+# found under each keyword.
+SAMPLES = [
+    """Invoice no: 51109338
+Date of issue: 04/13/2013
+Seller: Andrews, Kirby and Valdez   Client: Becker Ltd
+58861 Gonzalez Prairie
+Tax Id: 945-82-2137
+Total $ 8,191.20""",
+    """ACME SUPPLIES LTD
+123 Main Street, Springfield
+INVOICE # INV-2024-0042
+Invoice Date: March 5, 2024
+Bill To: Globex Corporation
+Subtotal 1,000.00
+Tax 80.00
+Amount Due USD 1,080.00""",
+    """Seller:
+Wilson, Hart and Scott
+Client:
+Ramos Group
+Invoice number: 2291-A
+Date: 2023-11-30
+Total 440.50""",
+    """From: Initech LLC
+www.initech.example
+Invoice No. X/7781
+Date 7/4/21
+Balance due 99.99""",
+    """Vendor - Umbrella Co
+Invoice #: UMB-55
+Issued 12-01-2022
+TOTAL: 12,000
+Payment terms: net 30""",
+    """Northwind Traders
+Invoice Number: NW-0001
+Date: 1 Feb 2020
+Items
+Widget 2 x 10.00 20.00
+Total 20.00 EUR""",
+    """invoice
+date: sometime next week
+total""",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_extractor_matches_legacy(text):
+    assert asdict(extract_fields(text)) == asdict(legacy_extract_fields(text))
+
+
+
+# The fast date parser replaced dateutil for common formats; it must read them identically
+DATES = [
+    "04/13/2013", "4/3/13", "12-01-2022", "2024-02-29", "2023/1/9", "31/12/2020", "13/13/2013",
+    "1 Feb 2020", "Feb 1, 2020", "February 1 2020", "01 February, 2020", "Sept 5 2021",
+    "March 5, 2024 10:30", "5 mars 2024", "2020", "0099-01-01", "Q3 2023", "n/a",
+]
+
+
+@pytest.mark.parametrize("value", DATES)
+def test_date_parsing_matches_legacy(value):
+    for text in (f"Invoice Date: {value}\nTotal 10.00", f"Due {value}\nDate of issue: {value}"):
+        assert extract_fields(text).invoice_date == legacy_extract_fields(text).invoice_date, text
@@ -0,0 +1,64 @@
+# tests/test_risk.py
+import random
+
+import pytest
+
+from risk import score_invoice, score_invoice_indexed
+from store import connect, fetch_all_invoices, insert_invoice, update_vendor_amount_stats
+
+VENDORS = ["Acme Supplies Ltd", "ACME Supplies, Ltd.", "Globex Corporation", "Initech LLC", "Umbrella Co"]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(str(tmp_path / "invoices.db"))
+    rnd = random.Random(7)
+    for i in range(300):
+        vendor = rnd.choice(VENDORS)
+        amount = round(rnd.uniform(50, 900), 2)
+        rec = {
+            "vendor_name": vendor,
+            "invoice_number": f"INV-{rnd.randint(1000, 1400)}",
+            "invoice_date": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "total_amount": amount,
+            "currency": "USD",
+            "source_file": f"{i}.jpg",
+            "raw_text": "",
+        }
+        # Same writes as main.analyze
+        insert_invoice(conn, rec, commit=False)
+        update_vendor_amount_stats(conn, vendor, amount, commit=False)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _probes(conn):
+    history = fetch_all_invoices(conn)
+    old = history[123]
+    yield dict(old)  # exact duplicate
+    yield {**old, "vendor_name": old["vendor_name"].upper() + ".", "invoice_number": old["invoice_number"] + "1"}
+    yield {**old, "invoice_number": old["invoice_number"].replace("-", "")}
+    yield {**old, "total_amount": 50_000.0, "invoice_number": "FRESH-1"}  # amount outlier
+    yield {**old, "total_amount": 2_000.0, "invoice_number": "FRESH-2"}
+    yield {"vendor_name": "Unknown Vendor", "invoice_number": "INV-1200", "invoice_date": "2024-01-01", "total_amount": 10.0}
+    yield {"vendor_name": "", "invoice_number": "", "invoice_date": "", "total_amount": None}
+    rnd = random.Random(11)
+    for _ in range(40):
+        yield {
+            "vendor_name": rnd.choice(VENDORS),
+            "invoice_number": f"INV-{rnd.randint(1000, 1400)}{rnd.choice(['', 'A', '-2'])}",
+            "invoice_date": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "total_amount": round(rnd.uniform(50, 3000), 2),
+        }
+
+
+def test_indexed_scoring_matches_full_scan(conn):
+    history = fetch_all_invoices(conn)
+    fired = set()
+    for rec in _probes(conn):
+        expected = score_invoice(rec, history)
+        assert score_invoice_indexed(rec, conn) == expected, rec
+        fired.update(r.split(":")[0] for r in expected["reasons"])
+    # the probes exercise every rule
+    assert fired == {"Exact duplicate", "Likely duplicate", "Amount anomaly", "Amount elevated"}
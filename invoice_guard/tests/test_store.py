@@ -0,0 +1,83 @@
+# tests/test_store.py
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from store import connect, get_vendor_amount_sketch, get_vendor_amount_stats, update_vendor_amount_stats
+from utils import norm_key
+from writer import WriteQueue
+
+VENDORS = ["Acme Supplies Ltd", "Globex Corporation"]
+THREADS = 8
+OPS = 60
+
+
+def _amounts(seed):
+    rnd = random.Random(seed)
+    return [(rnd.choice(VENDORS), round(rnd.uniform(1, 1000), 2)) for _ in range(OPS)]
+
+
+def _check_totals(db_path, plan):
+    conn = connect(db_path)
+    try:
+        for vendor in VENDORS:
+            xs = np.array([a for ops in plan for v, a in ops if v == vendor])
+            stats = get_vendor_amount_stats(conn, vendor)
+            assert stats["n"] == xs.size  # no lost updates
+            assert stats["mean"] == pytest.approx(xs.mean())
+            assert stats["m2"] == pytest.approx(((xs - xs.mean()) ** 2).sum())
+            assert get_vendor_amount_sketch(conn, norm_key(vendor)).n == xs.size
+    finally:
+        conn.close()
+
+
+def _run_threads(worker, plan):
+    errors = []
+
+    def run(ops):
+        try:
+            worker(ops)
+        except Exception as e:  # surfaced below; a thread exception would otherwise be lost
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(ops,)) for ops in plan]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+
+
+def test_concurrent_stats_updates_lose_nothing(tmp_path):
+    db_path = str(tmp_path / "invoices.db")
+    connect(db_path).close()
+    plan = [_amounts(i) for i in range(THREADS)]
+
+    def worker(ops):
+        conn = connect(db_path)  # one connection per thread, each committing every update
+        try:
+            for vendor, amount in ops:
+                update_vendor_amount_stats(conn, vendor, amount)
+        finally:
+            conn.close()
+
+    _run_threads(worker, plan)
+    _check_totals(db_path, plan)
+
+
+def test_queued_stats_updates_lose_nothing(tmp_path):
+    db_path = str(tmp_path / "invoices.db")
+    writes = WriteQueue(db_path)
+    plan = [_amounts(100 + i) for i in range(THREADS)]
+
+    def worker(ops):
+        for vendor, amount in ops:
+            writes.call(update_vendor_amount_stats, vendor, amount, commit=False)
+
+    try:
+        _run_threads(worker, plan)
+    finally:
+        writes.close()
+    _check_totals(db_path, plan)
@@ -0,0 +1,162 @@
+# tracing.py
+"""
+Per-stage timing spans for the pipeline, plus Prometheus metrics built from them.
+
+Two independent consumers, both off by default:
+  collect()         spans inside the block are summed into a {stage: ms} dict
+                    (the optional "timings" block of main.run / POST /analyze)
+  enable_metrics()  every span feeds a latency histogram and count() feeds counters;
+                    render() formats them for GET /metrics
+
+With neither on, span() is one ContextVar lookup returning a shared no-op context
+manager and count() is one global check. Dependency-free, like startup.py.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PREFIX = "invoice_guard"
+# Histogram upper bounds in seconds (OCR lands in the 0.1-5 s range, lookups in ms)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_TRACE: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("trace", default=None)
+_METRICS: Optional["Metrics"] = None
+_NOOP = contextlib.nullcontext()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Stage latency histograms and labelled counters, guarded by one lock."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.hist: Dict[str, List[float]] = {}  # stage -> per-bucket counts + [sum, count]
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            h = self.hist.get(stage)
+            if h is None:
+                h = self.hist[stage] = [0.0] * (len(self.buckets) + 2)
+            for i, le in enumerate(self.buckets):
+                if seconds <= le:
+                    h[i] += 1
+                    break
+            h[-2] += seconds
+            h[-1] += 1
+
+    def inc(self, name: str, value: float, labels: LabelKey) -> None:
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0.0) + value
+
+    def render(self, gauges: Optional[Dict[str, Dict[LabelKey, float]]] = None) -> str:
+        """Prometheus text exposition (format 0.0.4); gauges are sampled by the caller."""
+        lines: List[str] = []
+        with self._lock:
+            hist = {k: list(v) for k, v in self.hist.items()}
+            counters = {k: dict(v) for k, v in self.counters.items()}
+
+        name = f"{PREFIX}_stage_seconds"
+        lines += [f"# HELP {name} Wall time per pipeline stage.", f"# TYPE {name} histogram"]
+        for stage, h in sorted(hist.items()):
+            cum = 0.0
+            for le, n in zip(self.buckets, h):
+                cum += n
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cum:g}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h[-1]:g}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h[-2]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h[-1]:g}')
+
+        for kind, series_by_name in (("counter", counters), ("gauge", gauges or {})):
+            for short, series in sorted(series_by_name.items()):
+                name = f"{PREFIX}_{short}_total" if kind == "counter" else f"{PREFIX}_{short}"
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Span:
+    __slots__ = ("name", "trace", "t0")
+
+    def __init__(self, name: str, trace: Optional[Dict[str, float]]):
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self) -> "_Span":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        dt = time.perf_counter() - self.t0
+        if self.trace is not None:
+            self.trace[self.name] = self.trace.get(self.name, 0.0) + dt * 1000
+        if _METRICS is not None:
+            _METRICS.observe(self.name, dt)
+
+
+def span(name: str):
+    """`with span("ocr"): ...` times a stage when a trace is being collected or metrics are on."""
+    trace = _TRACE.get()
+    if trace is None and _METRICS is None:
+        return _NOOP
+    return _Span(name, trace)
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """Add to counter <prefix>_<name>_total{labels} (no-op unless metrics are on)."""
+    if _METRICS is not None:
+        _METRICS.inc(name, value, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+@contextlib.contextmanager
+def collect(enabled: bool = True) -> Iterator[Optional[Dict[str, float]]]:
+    """
+    `with collect() as timings:` gathers span times (ms, summed per stage) from this
+    context; "total" is the wall time of the block. Yields None when not enabled.
+    """
+    if not enabled:
+        yield None
+        return
+    timings: Dict[str, float] = {}
+    token = _TRACE.set(timings)
+    t0 = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        for k in timings:
+            timings[k] = round(timings[k], 3)
+        _TRACE.reset(token)
+
+
+def bind(fn: Callable) -> Callable:
+    """Carry the current trace into an executor thread (run_in_executor doesn't copy context)."""
+    if _TRACE.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def enable_metrics() -> Metrics:
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = Metrics()
+    return _METRICS
+
+
+def metrics() -> Optional[Metrics]:
+    return _METRICS
@@ -1,6 +1,39 @@
 # utils.py
 from __future__ import annotations
+import importlib
 import json
+import types
 
 def pretty(obj) -> str:
     return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def norm_key(s) -> str:
+    """Normalization used for vendor / invoice-number matching (risk rules + SQL keys)."""
+    return (s or "").strip().lower()
+
+
+class _LazyModule(types.ModuleType):
+    """Stand-in that imports the real module on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _load(self):
+        mod = self.__dict__["_lazy_target"]
+        if mod is None:
+            __import__(self.__name__)  # through builtins.__import__, so --startup-profile sees it
+            mod = self.__dict__["_lazy_target"] = importlib.import_module(self.__name__)
+        return mod
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+
+def lazy_module(name: str) -> types.ModuleType:
+    """
+    `cv2 = lazy_module("cv2")` keeps heavy imports (cv2, torch, google.genai) off the
+    startup path: the import happens the first time an attribute is used.
+    """
+    return _LazyModule(name)
@@ -0,0 +1,185 @@
+# writer.py
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from ml.batching import _percentiles
+from store import Store, unit_of_work
+from tracing import count
+
+MAX_GROUP = int(os.getenv("INVOICE_GUARD_WRITER_MAX_GROUP", "64"))
+MAX_WAIT_MS = float(os.getenv("INVOICE_GUARD_WRITER_MAX_WAIT_MS", "0"))
+MAX_QUEUED = int(os.getenv("INVOICE_GUARD_WRITER_MAX_QUEUED", "1024"))
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Single writer for one DB file: every mutation goes through one thread and one
+    connection, so threads never contend for the SQLite write lock ("database is
+    locked" stalls), and commits are grouped.
+
+    Like ml.batching.MicroBatcher, the thread blocks for the first job, then keeps
+    collecting until max_group jobs are queued or max_wait_ms has passed. It then runs
+    them all in one transaction, each job in its own savepoint, and commits once. The
+    default wait is 0: jobs that queue up during one commit form the next group. Every
+    caller's future resolves after that commit, so a result is never reported before
+    it is durable. A job that raises only rolls back its own savepoint; the others
+    still commit.
+
+    Readers keep their own connections (Store, one per thread): under WAL they read the
+    last committed snapshot and never wait for the writer.
+
+      writes = WriteQueue("data/invoices.db")
+      invoice_id = writes.call(insert_invoice, rec, commit=False)       # sync, any thread
+      out = await writes.acall(analyze_and_store, raw_text, fields)     # asyncio
+
+    Jobs are fn(conn, *args, **kwargs) and must not commit (pass commit=False to store
+    writers). max_queued bounds the queue: past it, submit() blocks the producer.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_group: int = MAX_GROUP,
+        max_wait_ms: float = MAX_WAIT_MS,
+        max_queued: int = MAX_QUEUED,
+    ):
+        self.db_path = db_path
+        self.store = Store(db_path)
+        self.max_group = max(1, int(max_group))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(max(0, int(max_queued)))
+        self._lock = threading.Lock()
+        self._group_sizes: Counter = Counter()
+        self._waits_ms: deque = deque(maxlen=10000)
+        self._commit_ms: deque = deque(maxlen=10000)
+        self._jobs = 0
+        self._failed = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+        self._thread.start()
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Queue fn(conn, *args, **kwargs); the future resolves once its group has committed."""
+        fut: Future = Future()
+        if self._closed:
+            fut.set_exception(RuntimeError("WriteQueue is closed"))
+            return fut
+        self._queue.put((fn, args, kwargs, fut, time.perf_counter()))
+        return fut
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def acall(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def close(self) -> None:
+        """Stop the writer after the jobs already queued are committed."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Group-size histogram and queue-wait / commit-time percentiles (ms)."""
+        with self._lock:
+            sizes = dict(sorted(self._group_sizes.items()))
+            waits = np.asarray(self._waits_ms, dtype=np.float64)
+            commits = np.asarray(self._commit_ms, dtype=np.float64)
+            jobs, failed = self._jobs, self._failed
+        groups = sum(sizes.values())
+        return {
+            "jobs": jobs,
+            "failed": failed,
+            "commits": groups,
+            "mean_group_size": round(jobs / groups, 2) if groups else 0.0,
+            "group_size_hist": sizes,
+            "queue_wait_ms": _percentiles(waits),
+            "commit_ms": _percentiles(commits),
+            "queue_depth": self._queue.qsize(),
+        }
+
+    # -------------------------
+    # Worker
+    # -------------------------
+    def _collect(self) -> Tuple[List[Any], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        group = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(group) < self.max_group:
+            timeout = deadline - time.perf_counter()
+            try:
+                job = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return group, True
+            group.append(job)
+        return group, False
+
+    def _run_job(self, conn, job) -> Tuple[bool, Any]:
+        fn, args, kwargs, fut, _ = job
+        try:
+            with unit_of_work(conn):  # savepoint: a failing job undoes only its own writes
+                return True, fn(conn, *args, **kwargs)
+        except Exception as e:
+            return False, e
+
+    def _loop(self) -> None:
+        conn = self.store.conn
+        stop = False
+        while not stop:
+            jobs, stop = self._collect()
+            # Callers that gave up (cancelled asyncio tasks) don't get their writes run
+            jobs = [j for j in jobs if j[3].set_running_or_notify_cancel()]
+            if not jobs:
+                continue
+            started = time.perf_counter()
+            try:
+                # The write lock is only taken once the group is complete, so other
+                # processes are not kept waiting while it fills
+                with unit_of_work(conn):
+                    outcomes = [self._run_job(conn, job) for job in jobs]
+                    committing = time.perf_counter()
+            except Exception as e:  # the commit itself failed: nothing in the group landed
+                for job in jobs:
+                    job[3].set_exception(e)
+                with self._lock:
+                    self._failed += len(jobs)
+                continue
+            committed = time.perf_counter()
+
+            failed = 0
+            for job, (ok, value) in zip(jobs, outcomes):
+                if ok:
+                    job[3].set_result(value)
+                else:
+                    failed += 1
+                    job[3].set_exception(value)
+            count("writer_commits")
+            count("writer_jobs", len(jobs))
+            with self._lock:
+                self._jobs += len(jobs)
+                self._failed += failed
+                self._group_sizes[len(jobs)] += 1
+                self._waits_ms.extend((started - job[4]) * 1000.0 for job in jobs)
+                self._commit_ms.append((committed - committing) * 1000.0)
@@ -24,58 +24,105 @@ function normDate(d) {
   return dt.toISOString().slice(0, 10);
 }
 
-// Helper function to call Python invoice checker
-function callPythonInvoiceCheck(invoicePath) {
-  return new Promise((resolve, reject) => {
-    const dbPath = path.join(__dirname, "../../data/invoices.db");
-    const pythonDir = path.join(__dirname, "../../invoice_guard");
-    
-    const python = spawn("python", [
-      "main.py",
-      "--db", dbPath,
-      "--price-check", invoicePath
-    ], {
-      cwd: pythonDir,
-      env: {
-        ...process.env,
-        GEMINI_API_KEY: process.env.GEMINI_API_KEY,
-        GEMINI_MODEL: process.env.GEMINI_MODEL || "gemini-2.5-flash"
-      }
-    });
+// Long-lived Python worker (main.py --serve): the model and SQLite connection are
+// loaded once, so each invoice only pays for OCR + scoring, not interpreter startup.
+let pyWorker = null;
 
-    let output = "";
-    let error = "";
+function startPythonWorker() {
+  const dbPath = path.join(__dirname, "../../data/invoices.db");
+  const pythonDir = path.join(__dirname, "../../invoice_guard");
 
-    python.stdout.on("data", (data) => {
-      output += data.toString();
-    });
+  const proc = spawn("python", ["main.py", "--db", dbPath, "--serve"], {
+    cwd: pythonDir,
+    env: {
+      ...process.env,
+      GEMINI_API_KEY: process.env.GEMINI_API_KEY,
+      GEMINI_MODEL: process.env.GEMINI_MODEL || "gemini-2.5-flash"
+    }
+  });
 
-    python.stderr.on("data", (data) => {
-      error += data.toString();
-    });
+  const worker = { proc, pending: new Map(), nextId: 1, buffer: "" };
 
-    python.on("close", (code) => {
-      if (code !== 0) {
-        console.error("Python error:", error);
-        return reject(new Error(`Python process exited with code ${code}`));
+  proc.stdout.on("data", (data) => {
+    worker.buffer += data.toString();
+    let nl;
+    while ((nl = worker.buffer.indexOf("\n")) !== -1) {
+      const line = worker.buffer.slice(0, nl).trim();
+      worker.buffer = worker.buffer.slice(nl + 1);
+      if (!line) continue;
+
+      let msg;
+      try {
+        msg = JSON.parse(line);
+      } catch (e) {
+        console.error("Python worker sent invalid JSON:", line);
+        continue;
       }
+      const waiter = worker.pending.get(msg.id);
+      if (!waiter) continue;
+      worker.pending.delete(msg.id);
+      if (msg.ok) waiter.resolve(msg.result);
+      else waiter.reject(new Error(msg.error || "Python worker error"));
+    }
+  });
 
-      // Extract JSON from output (last JSON object in output)
-      const jsonMatch = output.match(/\{[\s\S]*\}(?![\s\S]*\{)/);
-      if (jsonMatch) {
-        try {
-          const result = JSON.parse(jsonMatch[0]);
-          resolve(result);
-        } catch (e) {
-          reject(new Error("Failed to parse Python output"));
-        }
-      } else {
-        reject(new Error("No JSON found in Python output"));
+  proc.stderr.on("data", (data) => {
+    process.stderr.write(data);
+  });
+
+  // A spawn failure (e.g. no python on PATH) emits "error" instead of "close", and writing
+  // to a dead worker's stdin emits EPIPE; unhandled, either would crash the server.
+  proc.on("error", (err) => failWorker(worker, err));
+  proc.stdin.on("error", (err) => failWorker(worker, err));
+  proc.on("close", (code) => {
+    failWorker(worker, new Error(`Python worker exited with code ${code}`));
+  });
+
+  return worker;
+}
+
+// Drop a broken worker: the next call spawns a fresh one
+function failWorker(worker, err) {
+  if (pyWorker === worker) pyWorker = null;
+  for (const waiter of worker.pending.values()) waiter.reject(err);
+  worker.pending.clear();
+  if (worker.proc.exitCode === null && !worker.proc.killed) worker.proc.kill("SIGTERM");
+}
+
+// Per-request limit; a timed-out request is dropped, the worker keeps serving the others
+const PY_WORKER_TIMEOUT_MS = Number(process.env.PY_WORKER_TIMEOUT_MS || 60000);
+
+// Helper function to call Python invoice checker
+function callPythonInvoiceCheck(invoicePath) {
+  return new Promise((resolve, reject) => {
+    if (!pyWorker) pyWorker = startPythonWorker();
+    const worker = pyWorker;
+
+    const id = `req_${worker.nextId++}`;
+    const timer = setTimeout(() => {
+      worker.pending.delete(id);
+      reject(new Error(`Python worker timed out after ${PY_WORKER_TIMEOUT_MS} ms`));
+    }, PY_WORKER_TIMEOUT_MS);
+    worker.pending.set(id, {
+      resolve: (result) => {
+        clearTimeout(timer);
+        resolve(result);
+      },
+      reject: (err) => {
+        clearTimeout(timer);
+        reject(err);
       }
     });
+    worker.proc.stdin.write(
+      JSON.stringify({ id, image_path: invoicePath, price_check: true }) + "\n"
+    );
   });
 }
 
+process.on("exit", () => {
+  if (pyWorker) pyWorker.proc.kill("SIGTERM");
+});
+
 // List invoices
 router.get("/", (req, res) => {
   res.json({ invoices: [...db.invoices].reverse() });